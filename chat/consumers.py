@@ -5,23 +5,26 @@ import asyncio
 import os
 import magic
 from channels.layers import get_channel_layer
+from redis.exceptions import ResponseError
+from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
 from wish_bot.db import (
     get_chat_collection,
     get_room_collection,
-    get_shortcut_collection,
-    get_trigger_collection,
-    insert_with_timestamps,
     get_contact_collection,
     get_admin_collection,
-    get_widget_collection,
 )
-from utils.redis_client import redis_client
-from asgiref.sync import sync_to_async
+from wish_bot import async_db
+from dashboard.rollups import build_rollup_update, rollup_filter
+from utils.redis_client import redis_client, async_redis_client
+from utils.executor import run_blocking
+from utils.pagination import InvalidCursor, encode_cursor, parse_limit
 from utils.random_id import generate_room_id, generate_contact_id
+from utils import cache, presence, rate_limit, redis_scripts, room_index
 import logging
 from prometheus_client import Histogram
 from functools import lru_cache
+from collections import defaultdict
 from typing import Optional, List, Dict, Any
 
 # Prometheus metrics
@@ -37,9 +40,25 @@ logger = logging.getLogger(__name__)
 try:
     redis_client.ping()
     logger.info("[REDIS] Connection successful")
+    redis_scripts.load_all()
 except Exception as e:
     logger.error(f"[REDIS] Connection failed: {e}")
 
+# Room-list patches are coalesced per agent connection over this window (seconds)
+ROOM_LIST_PATCH_WINDOW = getattr(settings, 'ROOM_LIST_UPDATES', {}).get('PATCH_WINDOW_MS', 250) / 1000
+ROOM_LIST_PAGE_SIZE = getattr(settings, 'ROOM_LIST_UPDATES', {}).get('PAGE_SIZE', 100)
+ROOM_LIST_MAX_PAGE_SIZE = 500
+MARK_READ_MAX_ROOMS = 500
+
+# Room fields a room-list row is built from (see build_room_list_entry)
+ROOM_LIST_PROJECTION = {
+    '_id': 0, 'room_id': 1, 'widget_id': 1, 'is_active': 1, 'assigned_agent': 1,
+    'last_message': 1, 'last_sender': 1, 'last_timestamp': 1,
+}
+
+# Messages kept in the chat_history:<room> list (oldest first, one JSON frame each)
+HISTORY_CACHE_SIZE = 50
+
 # Cache TTL constants
 CACHE_TTL_SHORT = 60  # 1 minute
 CACHE_TTL_MEDIUM = 300  # 5 minutes
@@ -65,188 +84,264 @@ def convert_to_serializable(obj):
 
 async def get_agent_widgets(admin_id: str) -> List[str]:
     """Get widgets assigned to an agent with caching"""
-    cache_key = f"agent_widgets:{admin_id}"
-    cached = redis_client.get(cache_key)
-    if cached:
-        return json.loads(cached.decode() if isinstance(cached, bytes) else cached)
-    
-    try:
-        admin_collection = await sync_to_async(get_admin_collection)()
-        agent_doc = await sync_to_async(lambda: admin_collection.find_one({'admin_id': admin_id}))()
+    async def load():
+        agent_doc = await async_db.find_admin(admin_id, {'assigned_widgets': 1})
         widgets = agent_doc.get('assigned_widgets', []) if agent_doc else []
-        redis_client.setex(cache_key, CACHE_TTL_MEDIUM, json.dumps(widgets))
-        return widgets
+        return [widgets] if isinstance(widgets, str) else widgets
+
+    try:
+        return await cache.agent_widgets.get(admin_id, load)
     except Exception as e:
         logger.error(f"Error getting agent widgets for {admin_id}: {e}")
         return []
 
 async def get_room_widget(room_id: str) -> Optional[str]:
     """Get widget ID for a room with caching"""
-    cache_key = f"room_widget:{room_id}"
-    cached = redis_client.get(cache_key)
-    if cached:
-        return cached.decode() if isinstance(cached, bytes) else cached
-    
+    async def load():
+        room = await async_db.find_room(room_id, {'widget_id': 1})
+        return room.get('widget_id') if room else None
+
     try:
-        room_collection = await sync_to_async(get_room_collection)()
-        room = await sync_to_async(lambda: room_collection.find_one({'room_id': room_id}))()
-        widget_id = room.get('widget_id') if room else None
-        if widget_id:
-            redis_client.setex(cache_key, CACHE_TTL_LONG, widget_id)
-        return widget_id
+        return await cache.room_widget.get(room_id, load)
     except Exception as e:
         logger.error(f"Error getting room widget for {room_id}: {e}")
         return None
 
 async def get_all_widget_ids() -> List[str]:
     """Get all widget IDs with caching"""
-    cache_key = "all_widgets"
-    cached = redis_client.get(cache_key)
-    if cached:
-        return json.loads(cached.decode() if isinstance(cached, bytes) else cached)
-    
     try:
-        collection = await sync_to_async(get_widget_collection)()
-        widgets = await sync_to_async(lambda: list(collection.find({}, {'widget_id': 1})))()
-        widget_ids = [w['widget_id'] for w in widgets if 'widget_id' in w]
-        redis_client.setex(cache_key, CACHE_TTL_MEDIUM, json.dumps(widget_ids))
-        return widget_ids
+        return await cache.widget_ids.get(None, async_db.find_widget_ids)
     except Exception as e:
         logger.error(f"Error getting all widget IDs: {e}")
         return []
 
 async def is_user_superadmin(admin_id: str) -> bool:
     """Check if user is superadmin with caching"""
-    cache_key = f"superadmin:{admin_id}"
-    cached = redis_client.get(cache_key)
-    if cached:
-        return cached.decode() == 'true' if isinstance(cached, bytes) else cached == 'true'
-    
+    async def load():
+        doc = await async_db.find_admin(admin_id, {'role': 1})
+        return bool(doc and doc.get('role') == 'superadmin')
+
     try:
-        collection = await sync_to_async(get_admin_collection)()
-        doc = await sync_to_async(lambda: collection.find_one({'admin_id': admin_id}))()
-        is_super = doc and doc.get('role') == 'superadmin'
-        redis_client.setex(cache_key, CACHE_TTL_MEDIUM, 'true' if is_super else 'false')
-        return is_super
+        return await cache.superadmin.get(admin_id, load)
     except Exception as e:
         logger.error(f"Error checking superadmin status for {admin_id}: {e}")
         return False
 
-async def get_eligible_admins_for_widget(widget_id: str) -> List[Dict[str, Any]]:
-    """Get all admins eligible to receive notifications for a widget"""
-    cache_key = f"widget_admins:{widget_id}"
-    cached = redis_client.get(cache_key)
-    
-    if cached:
-        return json.loads(cached.decode() if isinstance(cached, bytes) else cached)
-    
-    try:
-        admin_collection = await sync_to_async(get_admin_collection)()
-        all_admins = await sync_to_async(lambda: list(admin_collection.find({})))()
-        
-        eligible_admins = []
-        for admin in all_admins:
-            admin_id = admin.get('admin_id')
-            role = admin.get('role', 'agent')
-            assigned_widgets = admin.get('assigned_widgets', [])
-            
-            # Normalize assigned_widgets to list
-            if isinstance(assigned_widgets, str):
-                assigned_widgets = [assigned_widgets]
-            
-            # Superadmin sees all widgets, agents only see assigned widgets
-            if role == 'superadmin' or widget_id in assigned_widgets:
-                eligible_admins.append({
-                    'admin_id': admin_id,
-                    'role': role,
-                    'assigned_widgets': assigned_widgets
-                })
-        
-        redis_client.setex(cache_key, CACHE_TTL_MEDIUM, json.dumps(eligible_admins))
-        return eligible_admins
-    except Exception as e:
-        logger.error(f"Error getting eligible admins for widget {widget_id}: {e}")
-        return []
-
-async def notify_event(event_type: str, payload: Dict[str, Any]):
-    """Send notification event to eligible admins"""
+SUPERADMIN_NOTIFICATION_GROUP = 'notifications_superadmins'
+
+# Events that invalidate an admin's cached dashboard summary and room list
+REFRESH_EVENTS = {
+    'new_message_agent',
+    'unread_update',
+    'new_contact',
+    'new_room',
+    'new_live_visitor',
+    'visitor_disconnected',
+    'room_list_update',
+}
+
+def widget_notification_group(widget_id: str) -> str:
+    return f'notifications_widget_{widget_id}'
+
+def admin_notification_group(admin_id: str) -> str:
+    return f'notifications_admin_{admin_id}'
+
+async def notify_widget(widget_id: str, events: List[tuple]):
+    """
+    Publish one combined notification for a widget.
+
+    `events` is a list of (event_type, payload) pairs.  Agents receive it
+    through their widget groups and superadmins through their own group, so
+    the cost is two publishes however many admins are online; each
+    NotificationConsumer filters for its admin.
+    """
     with notification_time.time():
         try:
-            channel_layer = get_notifier()
-            widget_id = payload.get('widget_id')
-            admin_id = payload.get('admin_id')
-            
-            if not widget_id or not admin_id:
-                logger.warning(f"notify_event - Missing widget_id or admin_id: {payload}")
+            if not widget_id:
+                logger.warning(f"notify_widget - Missing widget_id: {events}")
                 return
-            
-            # Clear relevant caches to force refresh
-            redis_client.delete(f"dashboard_summary:{admin_id}")
-            redis_client.delete(f"room_list:{admin_id}")
-            
-            await channel_layer.group_send(
-                f'notifications_admin_{admin_id}',
-                {
-                    'type': 'notify_filtered',
-                    'event_type': event_type,
-                    'payload': payload,
-                }
+
+            channel_layer = get_notifier()
+            timestamp = datetime.datetime.utcnow().isoformat()
+            message = {
+                'type': 'notify_widget',
+                'widget_id': widget_id,
+                'events': [
+                    {
+                        # Metadata consumers filter on; the frame itself is pre-encoded
+                        'event_type': event_type,
+                        'room_id': payload.get('room_id'),
+                        'force_refresh': bool(payload.get('force_refresh')),
+                        'frame': encode_notification(event_type, payload, timestamp),
+                    }
+                    for event_type, payload in events
+                ],
+            }
+            await asyncio.gather(
+                channel_layer.group_send(widget_notification_group(widget_id), message),
+                channel_layer.group_send(SUPERADMIN_NOTIFICATION_GROUP, message),
             )
-            logger.debug(f"Sent {event_type} notification to admin {admin_id} for widget {widget_id}")
+            logger.debug(f"Sent {[e[0] for e in events]} notification for widget {widget_id}")
         except Exception as e:
-            logger.error(f"notify_event error: {e}", exc_info=True)
+            logger.error(f"notify_widget error: {e}", exc_info=True)
+
+def encode_notification(event_type: str, payload: Dict[str, Any], timestamp: str) -> List[str]:
+    """
+    A `dashboard_<event_type>` frame encoded once per publish, split just
+    after the opening brace of `payload` so each recipient only inserts its
+    own admin_id there (see `notification_text`).  The split point is the
+    start of the payload object, so the payload's keys and shape don't matter.
+    """
+    payload = {k: v for k, v in convert_to_serializable(payload).items() if k != 'admin_id'}
+    head = json.dumps({'type': f"dashboard_{event_type}", 'timestamp': timestamp, 'payload': {}})[:-2]
+    body = json.dumps(payload)
+    separator = '' if body == '{}' else ', '
+    return [head, separator + body[1:] + '}']
+
+def notification_text(frame: List[str], admin_id: str) -> str:
+    head, tail = frame
+    return f'{head}"admin_id": {json.dumps(admin_id)}{tail}'
+
+def chat_message_payload(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Client-facing fields of a chat message"""
+    return {
+        'message': event['message'],
+        'sender': event['sender'],
+        'message_id': event['message_id'],
+        'file_url': event.get('file_url', ''),
+        'file_name': event.get('file_name', ''),
+        'timestamp': event['timestamp'],
+        'status': 'delivered',
+        'suggested_replies': event.get('suggested_replies', []),
+        'contact_id': event.get('contact_id', ''),
+        'shortcut_id': event.get('shortcut_id'),
+        'is_shortcut': event.get('is_shortcut', False),
+        'sender_type': event.get('sender_type', 'unknown')
+    }
+
+def chat_message_event(room_id: str, **fields) -> Dict[str, Any]:
+    """
+    Channel-layer event for a chat message.  The client frame is encoded
+    here, once; every connection in the room forwards `text` unchanged.
+    """
+    return {'type': 'chat_message', 'room_id': room_id, 'text': json.dumps(chat_message_payload(fields))}
 
 async def batch_notify_admins(event_type: str, widget_id: str, base_payload: Dict[str, Any]):
-    """Batch notify all eligible admins for a widget"""
-    try:
-        eligible_admins = await get_eligible_admins_for_widget(widget_id)
-        
-        # Send notifications concurrently
-        tasks = []
-        for admin in eligible_admins:
-            admin_id = admin['admin_id']
-            payload = {**base_payload, 'admin_id': admin_id}
-            tasks.append(notify_event(event_type, payload))
-        
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
-    except Exception as e:
-        logger.error(f"Error in batch_notify_admins: {e}")
+    """Notify all admins watching a widget of a single event"""
+    await notify_widget(widget_id, [(event_type, base_payload)])
+
+def room_visible_to_agent(room: Dict[str, Any], admin_id: str) -> bool:
+    """Agents see unassigned rooms and their own"""
+    assigned_agent = room.get('assigned_agent')
+    return not assigned_agent or assigned_agent in ['agent', 'superadmin', admin_id]
+
+def build_room_list_entry(room: Dict[str, Any], contact_doc: Optional[Dict[str, Any]], is_live: bool,
+                          current_time: datetime.datetime) -> Dict[str, Any]:
+    """One row of the agent room list, built from the denormalized room document"""
+    unread_count = int(room.get('unread_count') or 0)
+    timestamp = room.get('last_timestamp')
+    timestamp_str = timestamp if isinstance(timestamp, str) else (
+        timestamp.isoformat() if isinstance(timestamp, datetime.datetime) else ''
+    )
+
+    # Create sorting timestamp - use epoch seconds for reliable sorting
+    # Live rooms get current time (highest priority)
+    # Rooms with messages get their timestamp
+    # Rooms without messages get 0 (lowest priority)
+    if is_live:
+        sorting_value = current_time.timestamp()
+    elif isinstance(timestamp, datetime.datetime):
+        sorting_value = timestamp.timestamp()
+    elif isinstance(timestamp, str):
+        try:
+            sorting_value = datetime.datetime.fromisoformat(timestamp).timestamp()
+        except (ValueError, AttributeError):
+            sorting_value = 0
+    else:
+        sorting_value = 0
+
+    return {
+        'room_id': room['room_id'],
+        'widget_id': room.get('widget_id'),
+        'contact': {
+            'name': contact_doc.get('name') if contact_doc else '',
+            'email': contact_doc.get('email') if contact_doc else '',
+            'phone': contact_doc.get('phone') if contact_doc else ''
+        },
+        'latest_message': room.get('last_message') or '',
+        'latest_message_sender': room.get('last_sender') or '',
+        'timestamp': timestamp_str,
+        'sorting_value': sorting_value,
+        'unread_count': unread_count,
+        'has_unread': unread_count > 0,
+        'assigned_agent': room.get('assigned_agent'),
+        'is_live': is_live
+    }
 
-async def cleanup_redis_keys():
-    """Periodic cleanup of stale Redis keys"""
+def history_entry(msg: Dict[str, Any]) -> str:
+    """One message of a `history` frame, serialized once (also the cache entry)"""
+    timestamp = msg.get('timestamp', '')
+    cursor = None
+    if msg.get('_id') is not None:
+        # Pages strictly older than this message; Mongo stores milliseconds
+        sort_value = timestamp
+        if isinstance(timestamp, datetime.datetime):
+            sort_value = timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+        cursor = encode_cursor(sort_value, msg['_id'])
+    return json.dumps({
+        'message': msg.get('message', ''),
+        'sender': msg.get('sender', 'unknown'),
+        'message_id': msg.get('message_id', ''),
+        'file_url': msg.get('file_url', ''),
+        'file_name': msg.get('file_name', ''),
+        'timestamp': timestamp.isoformat() if isinstance(timestamp, datetime.datetime) else timestamp,
+        'status': 'history',
+        'contact_id': msg.get('contact_id', ''),
+        'cursor': cursor
+    })
+
+def history_frame(room_id: str, entries: List[str], before: Optional[str]) -> str:
+    """Wrap already-serialized entries (oldest first) in a `history` frame"""
+    return '{"type": "history", "room_id": %s, "before": %s, "messages": [%s]}' % (
+        json.dumps(room_id), json.dumps(before), ', '.join(entries)
+    )
+
+async def append_history_cache(room_id: str, msg: Dict[str, Any]):
+    """Append to a warm history cache; a cold one is filled on the next read"""
+    cache_key = f"chat_history:{room_id}"
+    pipe = async_redis_client.pipeline()
+    pipe.rpushx(cache_key, history_entry(msg))
+    pipe.ltrim(cache_key, -HISTORY_CACHE_SIZE, -1)
+    pipe.expire(cache_key, CACHE_TTL_MEDIUM)
+    await pipe.execute()
+
+async def load_history_cache(room_id: str) -> List[str]:
+    """Cached history entries for a room, oldest first, filling the cache from Mongo on a miss"""
+    cache_key = f"chat_history:{room_id}"
     try:
-        room_collection = await sync_to_async(get_room_collection)()
-        active_rooms = await sync_to_async(lambda: list(room_collection.find({'is_active': True}, {'room_id': 1})))()
-        active_room_ids = set(room['room_id'] for room in active_rooms)
-        
-        prefixes = ['live_visitor:*', 'unread:*', 'typing:*', 'predefined:*']
-        for prefix in prefixes:
-            for key in redis_client.scan_iter(prefix):
-                key_str = key.decode() if isinstance(key, bytes) else key
-                room_id = key_str.split(':')[-1] if 'predefined' not in key_str else key_str.split(':')[1]
-                if room_id not in active_room_ids:
-                    redis_client.delete(key)
-                    logger.debug(f"Cleaned up stale key: {key_str}")
-        
-        admin_collection = await sync_to_async(get_admin_collection)()
-        active_admins = await sync_to_async(lambda: list(admin_collection.find({}, {'admin_id': 1})))()
-        active_admin_ids = set(admin['admin_id'] for admin in active_admins)
-        
-        for key in redis_client.scan_iter('agent_online:*'):
-            admin_id = key.decode().split(':')[-1] if isinstance(key, bytes) else key.split(':')[-1]
-            if admin_id not in active_admin_ids:
-                redis_client.delete(key)
-                redis_client.delete(f"agent_conn_count:{admin_id}")
-                logger.debug(f"Cleaned up stale agent key: {key}")
-    except Exception as e:
-        logger.error(f"Error in Redis cleanup: {e}")
+        entries = await async_redis_client.lrange(cache_key, 0, -1)
+    except ResponseError:
+        # Pre-list JSON blob left over from an older deploy
+        await async_redis_client.delete(cache_key)
+        entries = []
+    if entries:
+        return entries
+
+    messages = await async_db.find_recent_messages(room_id, HISTORY_CACHE_SIZE)
+    entries = [history_entry(msg) for msg in reversed(messages)]
+    if entries:
+        pipe = async_redis_client.pipeline()
+        pipe.delete(cache_key)
+        pipe.rpush(cache_key, *entries)
+        pipe.expire(cache_key, CACHE_TTL_MEDIUM)
+        await pipe.execute()
+    return entries
 
 async def validate_pdf(file_data: bytes, max_size_mb: int = 10) -> tuple:
     """Validate PDF file (MIME type and size)"""
     try:
         mime = magic.Magic(mime=True)
-        file_type = mime.from_buffer(file_data)
+        file_type = await run_blocking(mime.from_buffer, file_data)
         if file_type != 'application/pdf':
             return False, "Invalid file type. Only PDFs are allowed."
         
@@ -263,12 +358,15 @@ async def store_pdf(file_data: bytes, file_name: str) -> tuple:
     """Store PDF file and return URL"""
     try:
         upload_dir = '/var/www/Chat_app/uploads/'
-        os.makedirs(upload_dir, exist_ok=True)
         file_id = str(uuid.uuid4())
         file_path = os.path.join(upload_dir, f"{file_id}_{file_name}")
         
-        with open(file_path, 'wb') as f:
-            f.write(file_data)
+        def write_file():
+            os.makedirs(upload_dir, exist_ok=True)
+            with open(file_path, 'wb') as f:
+                f.write(file_data)
+        
+        await run_blocking(write_file)
         
         file_url = f"/uploads/{file_id}_{file_name}"
         return file_url, file_id
@@ -288,7 +386,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         logger.debug(f"Connection attempt - Room: {self.room_name}, Is Agent: {self.is_agent}, User: {self.user}, Agent ID: {self.admin_id}")
 
         # Validate room
-        room_valid = await sync_to_async(self.validate_room)()
+        room_valid = await self.validate_room()
         if not room_valid:
             logger.debug(f"Room {self.room_name} is not valid, closing connection")
             await self.close()
@@ -303,7 +401,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         # Check agent access
         if self.is_agent:
-            room_widget_id = await sync_to_async(self.get_widget_id_from_room)()
+            room_widget_id = await self.get_widget_id_from_room()
             if not self.can_access_room(room_widget_id):
                 logger.debug(f"Agent {self.admin_id} cannot access room {self.room_name}")
                 await self.close()
@@ -311,15 +409,16 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         # Set room active for visitors
         if not self.is_agent:
-            await self.set_room_active_status(self.room_name, True)
-            redis_client.delete(f'unread:{self.room_name}')
+            await self.set_room_active_status(self.room_name, True, reset_unread=True)
 
-        # Join room group
+        # Join room group, and the admin's group for access changes
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        if self.is_agent and self.admin_id:
+            await self.channel_layer.group_add(admin_notification_group(self.admin_id), self.channel_name)
 
         # Set agent online status
         if self.is_agent:
-            await self.set_agent_online_status(True)
+            await presence.agent_connected(self.admin_id, self.agent_widgets)
 
         await self.accept()
         logger.debug(f"WebSocket connection accepted for room: {self.room_name}")
@@ -335,65 +434,114 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def handle_visitor_connection(self):
         """Handle new visitor connection and notifications"""
         try:
-            self.widget_id = await sync_to_async(self.get_widget_id_from_room)()
+            self.widget_id = await self.get_widget_id_from_room()
             connection_timestamp = datetime.datetime.utcnow()
             
             # Set live visitor status
-            redis_client.setex(
-                f"live_visitor:{self.room_name}", 
-                CACHE_TTL_LONG, 
-                connection_timestamp.isoformat()
-            )
+            await room_index.set_live(self.widget_id, self.room_name, True, connection_timestamp)
 
-            # Batch notify all eligible admins
-            await batch_notify_admins('new_live_visitor', self.widget_id, {
-                'room_id': self.room_name,
-                'widget_id': self.widget_id,
-                'connection_timestamp': connection_timestamp.isoformat(),
-                'visitor_id': self.user,
-                'visitor_type': 'connected',
-            })
-            
-            # Send room list update to force refresh
-            await batch_notify_admins('room_list_update', self.widget_id, {
-                'room_id': self.room_name,
-                'widget_id': self.widget_id,
-                'action': 'visitor_connected',
-                'connection_timestamp': connection_timestamp.isoformat(),
-                'force_refresh': True
-            })
+            # Notify admins, with a room list update to force refresh
+            await notify_widget(self.widget_id, [
+                ('new_live_visitor', {
+                    'room_id': self.room_name,
+                    'widget_id': self.widget_id,
+                    'connection_timestamp': connection_timestamp.isoformat(),
+                    'visitor_id': self.user,
+                    'visitor_type': 'connected',
+                }),
+                ('room_list_update', {
+                    'room_id': self.room_name,
+                    'widget_id': self.widget_id,
+                    'action': 'visitor_connected',
+                    'connection_timestamp': connection_timestamp.isoformat(),
+                    'force_refresh': True
+                }),
+            ])
 
             # Load triggers and send first message
             self.triggers = await self.fetch_triggers_for_widget(self.widget_id)
-            redis_client.setex(f"predefined:{self.room_name}:{self.user}", CACHE_TTL_LONG, 0)
+            await async_redis_client.setex(f"predefined:{self.room_name}:{self.user}", CACHE_TTL_LONG, 0)
             await self.send_trigger_message(0)
             
         except Exception as e:
             logger.error(f"Error in handle_visitor_connection: {e}", exc_info=True)
 
-    def validate_room(self) -> bool:
+    async def load_room_context(self) -> Optional[Dict[str, Any]]:
+        """Load the room once per connection; refreshed on room_context_invalidate"""
+        room = await async_db.find_room(self.room_name)
+        if room is None:
+            self.room_context = None
+            return None
+
+        self.room_context = {
+            'room': room,
+            'widget_id': room.get('widget_id'),
+            'contact_id': room.get('contact_id'),
+            'assigned_agent': room.get('assigned_agent'),
+            'agent_display_name': None,  # resolved lazily by get_agent_display_name
+        }
+        return self.room_context
+
+    async def get_room_context(self) -> Optional[Dict[str, Any]]:
+        """Cached room context, loading it if this connection has none yet"""
+        context = getattr(self, 'room_context', None)
+        if context is None:
+            context = await self.load_room_context()
+        return context
+
+    async def get_agent_display_name(self) -> Optional[str]:
+        """Display name of the room's assigned agent, looked up once per context"""
+        context = await self.get_room_context()
+        if not context or not context['assigned_agent']:
+            return None
+        if context['agent_display_name'] is None:
+            agent_doc = await async_db.find_admin(context['assigned_agent'], {'name': 1})
+            if not agent_doc:
+                return None
+            context['agent_display_name'] = agent_doc.get('name') or 'Agent'
+        return context['agent_display_name']
+
+    async def validate_room(self) -> bool:
         """Validate room exists and is active"""
         try:
-            room_collection = get_room_collection()
-            room = room_collection.find_one({'room_id': self.room_name})
-            if room is None:
+            context = await self.load_room_context()
+            if context is None:
                 logger.debug(f"Room {self.room_name} not found in database")
                 return False
-            return room.get('is_active', False)
+            return context['room'].get('is_active', False)
         except Exception as e:
             logger.error(f"Error validating room {self.room_name}: {e}")
             return False
 
-    def get_widget_id_from_room(self) -> Optional[str]:
+    async def get_widget_id_from_room(self) -> Optional[str]:
         """Get widget ID from room"""
         try:
-            room_collection = get_room_collection()
-            room = room_collection.find_one({'room_id': self.room_name})
-            return room.get('widget_id') if room else None
+            context = await self.get_room_context()
+            return context['widget_id'] if context else None
         except Exception as e:
             logger.error(f"Error getting widget ID for {self.room_name}: {e}")
             return None
 
+    async def room_context_invalidate(self, event):
+        """Reload the cached room context after the room was changed elsewhere"""
+        try:
+            if event.get('room_id') != self.room_name:
+                return
+            await self.load_room_context()
+            logger.debug(f"Reloaded room context for {self.room_name}")
+        except Exception as e:
+            logger.error(f"Error reloading room context for {self.room_name}: {e}")
+
+    async def admin_access_invalidate(self, event):
+        """Re-check access after the agent's widgets changed or it was deleted"""
+        try:
+            self.agent_widgets = await get_agent_widgets(self.admin_id)
+            if not self.can_access_room(await self.get_widget_id_from_room()):
+                logger.debug(f"Agent {self.admin_id} lost access to room {self.room_name}, closing")
+                await self.close()
+        except Exception as e:
+            logger.error(f"Error re-checking access for agent {self.admin_id}: {e}")
+
     def can_access_room(self, room_widget_id: Optional[str]) -> bool:
         """Check if agent can access room"""
         if not self.is_agent or not self.admin_id:
@@ -402,48 +550,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return False
         return room_widget_id in self.agent_widgets
 
-    async def set_agent_online_status(self, is_online: bool):
-        """Set agent online/offline status with connection counting"""
-        try:
-            if self.is_agent and self.admin_id:
-                status_key = f"agent_online:{self.admin_id}"
-                count_key = f"agent_conn_count:{self.admin_id}"
-                
-                pipe = redis_client.pipeline()
-                if is_online:
-                    pipe.incr(count_key)
-                    pipe.setex(status_key, CACHE_TTL_LONG, datetime.datetime.utcnow().isoformat())
-                else:
-                    pipe.decr(count_key)
-                    pipe.get(count_key)
-                
-                results = pipe.execute()
-                
-                # Clean up if no more connections
-                if not is_online and results[-1] and int(results[-1]) <= 0:
-                    pipe = redis_client.pipeline()
-                    pipe.delete(status_key)
-                    pipe.delete(count_key)
-                    pipe.execute()
-        except Exception as e:
-            logger.error(f"Error setting agent online status for {self.admin_id}: {e}")
-
     async def fetch_triggers_for_widget(self, widget_id: str) -> List[Dict]:
         """Fetch triggers for widget with caching"""
         if not widget_id:
             logger.debug("No widget_id provided, cannot fetch triggers")
             return []
         
-        cache_key = f"triggers:{widget_id}"
-        cached = redis_client.get(cache_key)
-        if cached:
-            return json.loads(cached.decode() if isinstance(cached, bytes) else cached)
-        
-        try:
-            collection = await sync_to_async(get_trigger_collection)()
-            triggers = await sync_to_async(lambda: list(
-                collection.find({'widget_id': widget_id, 'is_active': True}).sort('order', 1)
-            ))()
+        async def load():
+            triggers = await async_db.find_active_triggers(widget_id)
             
             # Convert MongoDB document to serializable format
             serializable_triggers = []
@@ -475,9 +589,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         serializable_trigger[key] = value
                 
                 serializable_triggers.append(serializable_trigger)
-            
-            redis_client.setex(cache_key, CACHE_TTL_MEDIUM, json.dumps(serializable_triggers))
             return serializable_triggers
+
+        try:
+            return await cache.widget_triggers.get(widget_id, load)
         except Exception as e:
             logger.error(f"Error fetching triggers for widget {widget_id}: {e}")
             return []
@@ -506,27 +621,24 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'file_name': '',
                 'delivered': True,
                 'seen': False,
-                'timestamp': timestamp
-                
+                'timestamp': timestamp,
+                'sender_type': 'bot'
             }
 
-            collection = await sync_to_async(get_chat_collection)()
-            await sync_to_async(insert_with_timestamps)(collection, doc)
+            await async_db.insert_message(doc)
+            await async_db.record_room_message(self.room_name, message, 'Wish-bot', timestamp, sender_type='bot')
+            await room_index.touch_room(await self.get_widget_id_from_room(), self.room_name, timestamp)
 
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': message,
-                    'room_id': self.room_name,
-                    'sender': 'Wish-bot',
-                    'message_id': message_id,
-                    'file_url': '',
-                    'file_name': '',
-                    'timestamp': timestamp.isoformat(),
-                    'suggested_replies': suggested_replies,
-                    "is_trigger": True
-                }
+                chat_message_event(
+                    self.room_name,
+                    message=message,
+                    sender='Wish-bot',
+                    message_id=message_id,
+                    timestamp=timestamp.isoformat(),
+                    suggested_replies=suggested_replies,
+                )
             )
         except Exception as e:
             logger.error(f"Error in send_trigger_message: {e}", exc_info=True)
@@ -539,40 +651,40 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 
                 # Handle visitor disconnect
                 if not self.is_agent:
-                    redis_client.delete(f'live_visitor:{self.room_name}')
-                    widget_id = getattr(self, 'widget_id', None) or await sync_to_async(self.get_widget_id_from_room)()
-                    
+                    widget_id = getattr(self, 'widget_id', None) or await self.get_widget_id_from_room()
+                    await room_index.set_live(widget_id, self.room_name, False)
+
                     if widget_id:
-                        # Batch notify admins about disconnect
-                        await batch_notify_admins('visitor_disconnected', widget_id, {
-                            'room_id': self.room_name,
-                            'widget_id': widget_id,
-                            'disconnect_timestamp': disconnect_timestamp.isoformat(),
-                            'visitor_id': self.user,
-                            'close_code': close_code,
-                        })
-                        
-                        await batch_notify_admins('room_list_update', widget_id, {
-                            'room_id': self.room_name,
-                            'widget_id': widget_id,
-                            'action': 'visitor_disconnected',
-                            'disconnect_timestamp': disconnect_timestamp.isoformat(),
-                        })
+                        # Notify admins about disconnect
+                        await notify_widget(widget_id, [
+                            ('visitor_disconnected', {
+                                'room_id': self.room_name,
+                                'widget_id': widget_id,
+                                'disconnect_timestamp': disconnect_timestamp.isoformat(),
+                                'visitor_id': self.user,
+                                'close_code': close_code,
+                            }),
+                            ('room_list_update', {
+                                'room_id': self.room_name,
+                                'widget_id': widget_id,
+                                'action': 'visitor_disconnected',
+                                'disconnect_timestamp': disconnect_timestamp.isoformat(),
+                            }),
+                        ])
 
                 # Handle agent disconnect
                 if self.is_agent:
-                    await self.set_agent_online_status(False)
+                    await presence.agent_disconnected(self.admin_id)
 
                 # Clean up typing indicators
-                redis_client.delete(f'typing:{self.room_name}:{self.user}')
+                await async_redis_client.delete(f'typing:{self.room_name}:{self.user}')
                 if not self.is_agent:
-                    redis_client.delete(f'predefined:{self.room_name}:{self.user}')
+                    await async_redis_client.delete(f'predefined:{self.room_name}:{self.user}')
 
                 # Leave room group
                 await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
-                
-                # Clean up stale keys
-                await cleanup_redis_keys()
+                if self.is_agent and self.admin_id:
+                    await self.channel_layer.group_discard(admin_notification_group(self.admin_id), self.channel_name)
         except Exception as e:
             logger.error(f"Error in disconnect: {e}", exc_info=True)
 
@@ -588,21 +700,23 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 await self.send(text_data=json.dumps({'error': 'No data provided'}))
                 return
 
-            collection = await sync_to_async(get_chat_collection)()
-
             # Handle specific actions
             if data.get('action') == 'get_room_list' and self.is_agent:
-                await self.send_room_list()
+                await self.send_room_list(data.get('cursor'), data.get('limit'))
                 return
 
             if data.get('action') == 'heartbeat' and self.is_agent:
-                await self.set_agent_online_status(True)
+                await presence.heartbeat(self.admin_id, self.agent_widgets)
                 return
 
             if data.get('action') == 'mark_room_read' and self.is_agent:
                 await self.mark_room_messages_read(data.get('room_id', self.room_name))
                 return
 
+            if data.get('action') == 'get_history':
+                await self.send_chat_history(data.get('before') or data.get('cursor'), data.get('limit'))
+                return
+
             # Rate limiting for non-agent messages
             if not self.is_agent and (data.get('message') or data.get('file_url') or data.get('form_data') or data.get('file_data')):
                 if not await self.check_rate_limit():
@@ -616,12 +730,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
             # Handle seen status
             if data.get('status') == 'seen' and data.get('message_id'):
-                await self.handle_seen_status(data, collection)
+                await self.handle_seen_status(data)
                 return
 
             # Handle form submission
             if data.get('form_data'):
-                await self.handle_form_data(data, collection)
+                await self.handle_form_data(data)
                 return
 
             # Handle file upload
@@ -629,12 +743,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 await self.handle_new_message({
                     'file_data': data.get('file_data'), 
                     'file_name': data.get('file_name', 'document.pdf')
-                }, collection)
+                })
                 return
 
             # Handle regular messages
             if data.get('message') or data.get('file_url'):
-                await self.handle_new_message(data, collection)
+                await self.handle_new_message(data)
 
         except json.JSONDecodeError as e:
             logger.error(f"JSON decode error: {e}")
@@ -643,27 +757,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
             logger.error(f"Error in receive: {e}", exc_info=True)
 
     async def check_rate_limit(self) -> bool:
-        """Check rate limit for user messages"""
-        try:
-            rate_limit_key = f"rate_limit:{self.user}"
-            current_time = datetime.datetime.utcnow()
-            last_message_time = redis_client.get(rate_limit_key)
-            
-            if last_message_time:
-                try:
-                    last_time = datetime.datetime.fromisoformat(
-                        last_message_time.decode() if isinstance(last_message_time, bytes) else last_message_time
-                    )
-                    if (current_time - last_time) < datetime.timedelta(seconds=1):
-                        return False
-                except ValueError:
-                    redis_client.delete(rate_limit_key)
-            
-            redis_client.setex(rate_limit_key, 60, current_time.isoformat())
-            return True
-        except Exception as e:
-            logger.error(f"Error in rate limit check: {e}")
-            return True
+        """Take a token from the visitor's, IP's and widget's message buckets"""
+        allowed, _ = await rate_limit.check(
+            'chat_message',
+            visitor=self.room_name,
+            ip=rate_limit.scope_client_ip(self.scope),
+            widget=getattr(self, 'widget_id', None) or await self.get_widget_id_from_room(),
+        )
+        return allowed
 
     async def mark_room_messages_read(self, room_id: str):
         """Mark all messages in room as read"""
@@ -672,15 +773,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
             if not self.can_access_room(room_widget_id):
                 return
 
-            collection = await sync_to_async(get_chat_collection)()
-            await sync_to_async(collection.update_many)(
-                {'room_id': room_id, 'seen': False, 'sender': {'$ne': 'agent'}},
-                {'$set': {'seen': True, 'seen_at': datetime.datetime.utcnow()}}
-            )
+            await async_db.mark_room_messages_seen(room_id, datetime.datetime.utcnow())
 
             # Clear unread count
-            unread_key = f'unread:{room_id}'
-            redis_client.delete(unread_key)
+            await room_index.reset_unread(room_widget_id, room_id)
+            await async_db.reset_room_unread(room_id)
             logger.debug(f"Cleared unread count for room {room_id}")
 
             # Notify admins of unread update
@@ -702,7 +799,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 typing_key = f'typing:{self.room_name}:{self.user}'
                 
                 # Throttle typing events
-                last_sent = redis_client.get(f"{typing_key}:last_sent")
+                last_sent = await async_redis_client.get(f"{typing_key}:last_sent")
                 if last_sent:
                     last_time = datetime.datetime.fromisoformat(
                         last_sent.decode() if isinstance(last_sent, bytes) else last_sent
@@ -711,14 +808,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         return
                 
                 # Update typing status
-                pipe = redis_client.pipeline()
+                pipe = async_redis_client.pipeline()
                 if typing:
                     pipe.setex(typing_key, 10, content)
                     pipe.setex(f"{typing_key}:last_sent", 10, datetime.datetime.utcnow().isoformat())
                 else:
                     pipe.delete(typing_key)
                     pipe.delete(f"{typing_key}:last_sent")
-                pipe.execute()
+                await pipe.execute()
 
                 # Broadcast typing status
                 await self.channel_layer.group_send(
@@ -734,7 +831,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             except Exception as e:
                 logger.error(f"Error handling typing: {e}")
 
-    async def handle_seen_status(self, data: Dict[str, Any], collection):
+    async def handle_seen_status(self, data: Dict[str, Any]):
         """Handle message seen status update"""
         try:
             message_id = data.get('message_id')
@@ -745,10 +842,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 return
 
             # Update message seen status
-            result = await sync_to_async(collection.update_one)(
-                {'message_id': message_id, 'room_id': self.room_name},
-                {'$set': {'seen': True, 'seen_at': datetime.datetime.utcnow()}}
-            )
+            result = await async_db.mark_message_seen(self.room_name, message_id, datetime.datetime.utcnow())
 
             if result.modified_count == 0:
                 logger.warning(f"handle_seen_status: No message updated for {message_id}")
@@ -758,24 +852,18 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
             # Update unread count for agents
             if self.is_agent:
-                unread_key = f'unread:{self.room_name}'
-                current_unread = int(redis_client.get(unread_key) or 0)
-                
-                if current_unread > 0:
-                    new_unread = max(0, current_unread - 1)
-                    if new_unread == 0:
-                        redis_client.delete(unread_key)
-                    else:
-                        redis_client.set(unread_key, new_unread)
-                    
-                    room_widget_id = await get_room_widget(self.room_name)
-                    if room_widget_id:
-                        await batch_notify_admins('unread_update', room_widget_id, {
-                            'room_id': self.room_name,
-                            'widget_id': room_widget_id,
-                            'unread_count': new_unread,
-                            'timestamp': datetime.datetime.utcnow().isoformat(),
-                        })
+                room_widget_id = await self.get_widget_id_from_room()
+                new_unread = await room_index.decrement_unread(room_widget_id, self.room_name)
+
+                # None when nothing was unread (or the room has no widget)
+                if new_unread is not None:
+                    await async_db.decrement_room_unread(self.room_name)
+                    await batch_notify_admins('unread_update', room_widget_id, {
+                        'room_id': self.room_name,
+                        'widget_id': room_widget_id,
+                        'unread_count': new_unread,
+                        'timestamp': datetime.datetime.utcnow().isoformat(),
+                    })
 
             # Broadcast seen status to all clients
             await self.channel_layer.group_send(
@@ -791,7 +879,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             logger.error(f"Error in handle_seen_status: {e}", exc_info=True)
 
-    async def handle_form_data(self, data: Dict[str, Any], collection):
+    async def handle_form_data(self, data: Dict[str, Any]):
         """Handle contact form submission"""
         try:
             form_data = data.get('form_data', {})
@@ -802,11 +890,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
             phone = form_data.get('phone', '')
 
             # Get or create contact
-            contact_collection = await sync_to_async(get_contact_collection)()
-            room_collection = await sync_to_async(get_room_collection)()
-            room = await sync_to_async(lambda: room_collection.find_one({'room_id': self.room_name}))()
-            contact_id = room.get('contact_id') if room and room.get('contact_id') else generate_contact_id()
-            widget_id = room.get('widget_id') if room else None
+            context = await self.get_room_context()
+            if context and not context['contact_id']:
+                context['contact_id'] = generate_contact_id()
+            contact_id = context['contact_id'] if context else generate_contact_id()
+            widget_id = context['widget_id'] if context else None
+            sender_type = 'agent' if self.is_agent else 'customer'
 
             # Save contact
             contact_doc = {
@@ -818,7 +907,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'widget_id': widget_id,
                 'timestamp': timestamp
             }
-            await sync_to_async(insert_with_timestamps)(contact_collection, contact_doc)
+            await async_db.insert_contact(contact_doc)
 
             # Save message
             message = f"Contact information submitted: {name} ({email})"
@@ -833,58 +922,104 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'delivered': True,
                 'seen': False,
                 'timestamp': timestamp,
-                'form_data': form_data
+                'form_data': form_data,
+                'sender_type': sender_type
             }
-            await sync_to_async(insert_with_timestamps)(collection, doc)
+            await async_db.insert_message(doc)
+            before = await async_db.record_room_message(
+                self.room_name, message, self.user, timestamp,
+                increment_unread=not self.is_agent and bool(widget_id),
+                sender_type=sender_type,
+                message_id=message_id
+            )
+            await self.record_message_stats(context, timestamp, sender_type, before)
+            await room_index.touch_room(widget_id, self.room_name, timestamp)
 
             # Update unread count and notify admins
             if not self.is_agent and widget_id:
-                unread_key = f'unread:{self.room_name}'
-                redis_client.incr(unread_key)
-                unread_count = int(redis_client.get(unread_key) or 0)
-                
-                # Batch notify admins
-                await batch_notify_admins('unread_update', widget_id, {
-                    'room_id': self.room_name,
-                    'widget_id': widget_id,
-                    'unread_count': unread_count,
-                    'timestamp': timestamp.isoformat(),
-                })
-                
-                await batch_notify_admins('new_contact', widget_id, {
-                    'room_id': self.room_name,
-                    'widget_id': widget_id,
-                    'contact_info': contact_doc,
-                    'timestamp': timestamp.isoformat(),
-                })
+                unread_count = await room_index.increment_unread(widget_id, self.room_name)
                 
-                await batch_notify_admins('room_list_update', widget_id, {
-                    'room_id': self.room_name,
-                    'widget_id': widget_id,
-                    'action': 'contact_added',
-                    'timestamp': timestamp.isoformat(),
-                })
+                # One combined notification for all admins of the widget
+                await notify_widget(widget_id, [
+                    ('unread_update', {
+                        'room_id': self.room_name,
+                        'widget_id': widget_id,
+                        'unread_count': unread_count,
+                        'timestamp': timestamp.isoformat(),
+                    }),
+                    ('new_contact', {
+                        'room_id': self.room_name,
+                        'widget_id': widget_id,
+                        'contact_info': contact_doc,
+                        'timestamp': timestamp.isoformat(),
+                    }),
+                    ('room_list_update', {
+                        'room_id': self.room_name,
+                        'widget_id': widget_id,
+                        'action': 'contact_added',
+                        'timestamp': timestamp.isoformat(),
+                    }),
+                ])
 
             # Broadcast message
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': message,
-                    'contact_id': contact_id,
-                    'sender': self.user,
-                    'message_id': message_id,
-                    'file_url': '',
-                    'file_name': '',
-                    'timestamp': timestamp.isoformat(),
-                    'form_data': form_data
-                }
+                chat_message_event(
+                    self.room_name,
+                    message=message,
+                    contact_id=contact_id,
+                    sender=self.user,
+                    message_id=message_id,
+                    timestamp=timestamp.isoformat(),
+                )
             )
         except Exception as e:
             logger.error(f"Error handling form data: {e}", exc_info=True)
             await self.send(text_data=json.dumps({'error': 'Failed to submit form data'}))
 
-    async def handle_new_message(self, data: Dict[str, Any], collection):
+    @staticmethod
+    def response_stamps(before: Optional[Dict[str, Any]], timestamp: datetime.datetime) -> Dict[str, Any]:
+        """SLA fields for an agent reply: the oldest customer message it answers and how long it waited"""
+        awaiting = (before or {}).get('awaiting_customer_ts') or []
+        if not awaiting:
+            return {}
+        # Rooms queued before ids were tracked have timestamps without ids
+        awaiting_ids = before.get('awaiting_customer_ids') or []
+        return {
+            'responds_to': awaiting_ids[0] if len(awaiting_ids) == len(awaiting) else None,
+            'response_latency_seconds': (timestamp - awaiting[0]).total_seconds(),
+        }
+
+    async def record_message_stats(self, context: Optional[Dict[str, Any]], timestamp: datetime.datetime,
+                                   sender_type: str, before: Optional[Dict[str, Any]]):
+        """Update response-time counters on the room and the assigned agent's daily rollup"""
+        try:
+            response_times = []
+            first_response_time = None
+            if sender_type == 'agent' and before:
+                response_times = [(timestamp - t).total_seconds() for t in before.get('awaiting_customer_ts') or []]
+                if response_times:
+                    await async_db.record_room_responses(self.room_name, response_times)
+                first_customer_at = before.get('first_customer_at')
+                if first_customer_at and not before.get('first_response_at'):
+                    seconds = (timestamp - first_customer_at).total_seconds()
+                    if await async_db.set_first_response(self.room_name, timestamp, seconds):
+                        first_response_time = seconds
+
+            agent_id = context.get('assigned_agent') if context else None
+            if not agent_id:
+                return
+            update = build_rollup_update(
+                agent_messages=int(sender_type == 'agent'),
+                customer_messages=int(sender_type == 'customer'),
+                response_times=response_times,
+                first_response_time=first_response_time
+            )
+            await async_db.increment_agent_rollup(rollup_filter(agent_id, context.get('widget_id'), timestamp), update)
+        except Exception as e:
+            logger.error(f"Error updating message stats for {self.room_name}: {e}")
+
+    async def handle_new_message(self, data: Dict[str, Any]):
         """Handle new message with optimized notifications"""
         with message_delivery_time.time():
             try:
@@ -899,25 +1034,24 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 file_name = data.get('file_name', '')
                 display_sender_name = sender
 
-                # Fetch room details
-                room_collection = await sync_to_async(get_room_collection)()
-                room = await sync_to_async(lambda: room_collection.find_one({'room_id': self.room_name}))()
-                if not room:
+                # Room details are cached per connection
+                context = await self.get_room_context()
+                if not context:
                     logger.error(f"Room {self.room_name} not found")
                     return None
 
                 # Get room metadata
                 if not contact_id:
-                    contact_id = room.get('contact_id') or generate_contact_id()
-                widget_id = room.get('widget_id')
-                assigned_admin_id = room.get('assigned_agent')
+                    if not context['contact_id']:
+                        context['contact_id'] = generate_contact_id()
+                    contact_id = context['contact_id']
+                widget_id = context['widget_id']
+                assigned_admin_id = context['assigned_agent']
+                sender_type = 'agent' if self.is_agent or sender == 'agent' else 'customer'
 
                 # Set display name for agent
                 if sender == 'agent' and assigned_admin_id:
-                    admin_collection = await sync_to_async(get_admin_collection)()
-                    agent_doc = await sync_to_async(lambda: admin_collection.find_one({'admin_id': assigned_admin_id}))()
-                    if agent_doc:
-                        display_sender_name = agent_doc.get('name') or 'Agent'
+                    display_sender_name = await self.get_agent_display_name() or display_sender_name
 
                 # Handle file upload (PDF)
                 if data.get('file_data'):
@@ -940,8 +1074,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 suggested_replies = []
                 is_shortcut = False
                 if shortcut_id:
-                    shortcut_collection = await sync_to_async(get_shortcut_collection)()
-                    shortcut_doc = await sync_to_async(lambda: shortcut_collection.find_one({'shortcut_id': shortcut_id}))()
+                    shortcut_doc = await async_db.find_shortcut(shortcut_id)
                     if shortcut_doc:
                         message = shortcut_doc.get('content', '')
                         suggested_replies = shortcut_doc.get('suggested_messages', [])
@@ -961,23 +1094,34 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     'timestamp': timestamp,
                     'is_shortcut': is_shortcut,
                     'shortcut_id': shortcut_id if is_shortcut else None,
-                    'suggested_replies': suggested_replies
+                    'suggested_replies': suggested_replies,
+                    'sender_type': sender_type
                 }
-                await sync_to_async(insert_with_timestamps)(collection, doc)
+                # Insert first: a rejected message (e.g. a resent message_id)
+                # must not touch the room's counters or reply queue
+                await async_db.insert_message(doc)
+                try:
+                    # Returns the reply queue the update cleared
+                    before = await async_db.record_room_message(
+                        self.room_name, message, display_sender_name, timestamp,
+                        increment_unread=not self.is_agent,
+                        sender_type=sender_type,
+                        message_id=message_id
+                    )
+                except Exception:
+                    await async_db.delete_message(message_id)
+                    raise
+                if sender_type == 'agent':
+                    stamps = self.response_stamps(before, timestamp)
+                    if stamps:
+                        doc.update(stamps)
+                        await async_db.set_message_fields(message_id, stamps)
+                await self.record_message_stats(context, timestamp, sender_type, before)
+                await room_index.touch_room(widget_id, self.room_name, timestamp)
 
                 # Update chat history cache
-                cache_key = f"chat_history:{self.room_name}"
                 try:
-                    cached = redis_client.get(cache_key)
-                    if cached:
-                        messages = json.loads(cached.decode() if isinstance(cached, bytes) else cached)
-                        messages.append({
-                            k: v.isoformat() if isinstance(v, datetime.datetime) else str(v) if isinstance(v, ObjectId) else v 
-                            for k, v in doc.items()
-                        })
-                        if len(messages) > 50:
-                            messages = messages[-50:]
-                        redis_client.setex(cache_key, CACHE_TTL_MEDIUM, json.dumps(messages))
+                    await append_history_cache(self.room_name, doc)
                 except Exception as e:
                     logger.error(f"Error updating chat cache: {e}")
 
@@ -985,35 +1129,26 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 new_unread = 0
                 if not self.is_agent:
                     try:
-                        unread_key = f'unread:{self.room_name}'
-                        lua_script = """
-                        local key = KEYS[1]
-                        local new = redis.call('INCR', key)
-                        return new
-                        """
-                        script = redis_client.register_script(lua_script)
-                        new_unread = int(script(keys=[unread_key]))
+                        new_unread = await room_index.increment_unread(widget_id, self.room_name)
                         logger.debug(f"Updated unread count for {self.room_name}: {new_unread}")
                     except Exception as e:
                         logger.error(f"Error updating unread count: {e}")
 
-                # Broadcast message to room group
-                message_data = {
-                    'type': 'chat_message',
-                    'room_id': self.room_name,
-                    'message': message,
-                    'contact_id': contact_id,
-                    'sender': display_sender_name,
-                    'message_id': message_id,
-                    'file_url': file_url,
-                    'file_name': file_name,
-                    'timestamp': timestamp_iso,
-                    'suggested_replies': suggested_replies,
-                    'shortcut_id': shortcut_id if is_shortcut else None,
-                    'is_shortcut': is_shortcut,
-                    'sender_type': 'user' if not self.is_agent else 'agent',
-                    'status': 'delivered'
-                }
+                # Broadcast message to room group (encoded once for every connection)
+                message_data = chat_message_event(
+                    self.room_name,
+                    message=message,
+                    contact_id=contact_id,
+                    sender=display_sender_name,
+                    message_id=message_id,
+                    file_url=file_url,
+                    file_name=file_name,
+                    timestamp=timestamp_iso,
+                    suggested_replies=suggested_replies,
+                    shortcut_id=shortcut_id if is_shortcut else None,
+                    is_shortcut=is_shortcut,
+                    sender_type='user' if not self.is_agent else 'agent',
+                )
                 await self.channel_layer.group_send(self.room_group_name, message_data)
 
                 # Send notifications for user messages
@@ -1032,29 +1167,31 @@ class ChatConsumer(AsyncWebsocketConsumer):
                             'sender_type': 'user'
                         }
                         
-                        await batch_notify_admins('new_message_agent', widget_id, notify_data)
-                        await batch_notify_admins('unread_update', widget_id, {
-                            'room_id': self.room_name,
-                            'widget_id': widget_id,
-                            'unread_count': new_unread,
-                            'timestamp': timestamp_iso,
-                        })
-                        await batch_notify_admins('room_list_update', widget_id, {
-                            'room_id': self.room_name,
-                            'widget_id': widget_id,
-                            'action': 'new_message',
-                            'timestamp': timestamp_iso,
-                        })
+                        await notify_widget(widget_id, [
+                            ('new_message_agent', notify_data),
+                            ('unread_update', {
+                                'room_id': self.room_name,
+                                'widget_id': widget_id,
+                                'unread_count': new_unread,
+                                'timestamp': timestamp_iso,
+                            }),
+                            ('room_list_update', {
+                                'room_id': self.room_name,
+                                'widget_id': widget_id,
+                                'action': 'new_message',
+                                'timestamp': timestamp_iso,
+                            }),
+                        ])
                     except Exception as e:
                         logger.error(f"Error sending notifications: {e}")
 
                 # Handle trigger messages for users
                 if not self.is_agent:
                     redis_key = f"predefined:{self.room_name}:{self.user}"
-                    current_index = int(redis_client.get(redis_key) or 0)
+                    current_index = int(await async_redis_client.get(redis_key) or 0)
                     next_index = current_index + 1
                     if hasattr(self, 'triggers') and self.triggers and next_index < len(self.triggers):
-                        redis_client.setex(redis_key, CACHE_TTL_LONG, next_index)
+                        await async_redis_client.setex(redis_key, CACHE_TTL_LONG, next_index)
                         await asyncio.sleep(0.5)
                         await self.send_trigger_message(next_index)
                         if next_index == 1:
@@ -1082,157 +1219,81 @@ class ChatConsumer(AsyncWebsocketConsumer):
             try:
                 if event.get('room_id') != self.room_name:
                     return
-
-                message_data = {
-                    'message': event['message'],
-                    'sender': event['sender'],
-                    'message_id': event['message_id'],
-                    'file_url': event.get('file_url', ''),
-                    'file_name': event.get('file_name', ''),
-                    'timestamp': event['timestamp'],
-                    'status': 'delivered',
-                    'suggested_replies': event.get('suggested_replies', []),
-                    'contact_id': event.get('contact_id', ''),
-                    'shortcut_id': event.get('shortcut_id'),
-                    'is_shortcut': event.get('is_shortcut', False),
-                    'sender_type': event.get('sender_type', 'unknown')
-                }
-                await self.send(text_data=json.dumps(message_data))
+                # Events published in the older dict-only format are encoded here
+                await self.send(text_data=event.get('text') or json.dumps(chat_message_payload(event)))
             except Exception as e:
                 logger.error(f"Error in chat_message: {e}", exc_info=True)
 
-    async def send_chat_history(self):
-        """Send chat history to client"""
+    async def send_chat_history(self, before: Optional[str] = None, limit: Any = None):
+        """
+        Send one `history` frame: the cached latest messages, or a page of
+        `limit` messages older than `before`.  The frame's own `before` is
+        the cursor for the next older page (None when there is none).
+        """
         with chat_history_time.time():
             try:
-                room_widget_id = await get_room_widget(self.room_name)
+                room_widget_id = await self.get_widget_id_from_room()
                 if not self.can_access_room(room_widget_id):
                     await self.send(text_data=json.dumps({'error': 'Access denied'}))
                     return
-                
-                cache_key = f"chat_history:{self.room_name}"
-                cached = redis_client.get(cache_key)
-                
-                if cached:
-                    messages = json.loads(cached.decode() if isinstance(cached, bytes) else cached)
+
+                if before:
+                    try:
+                        messages, older = await async_db.find_messages_page(self.room_name, parse_limit(limit), before)
+                    except InvalidCursor as e:
+                        await self.send(text_data=json.dumps({'error': str(e)}))
+                        return
+                    entries = [history_entry(msg) for msg in reversed(messages)]
                 else:
-                    collection = await sync_to_async(get_chat_collection)()
-                    messages = await sync_to_async(lambda: list(
-                        collection.find({'room_id': self.room_name}, {'_id': 0}).sort('timestamp', -1).limit(50)
-                    ))()
-                    redis_client.setex(cache_key, CACHE_TTL_MEDIUM, json.dumps(messages))
+                    entries = await load_history_cache(self.room_name)
+                    # A short cache holds the whole conversation
+                    older = json.loads(entries[0]).get('cursor') if len(entries) >= HISTORY_CACHE_SIZE else None
 
-                for msg in reversed(messages):
-                    await self.send(text_data=json.dumps({
-                        'message': msg.get('message', ''),
-                        'sender': msg.get('sender', 'unknown'),
-                        'message_id': msg.get('message_id', ''),
-                        'file_url': msg.get('file_url', ''),
-                        'file_name': msg.get('file_name', ''),
-                        'timestamp': msg.get('timestamp', ''),
-                        'status': 'history',
-                        'contact_id': msg.get('contact_id', '')
-                    }))
+                await self.send(text_data=history_frame(self.room_name, entries, older))
             except Exception as e:
                 logger.error(f"Error sending chat history: {e}")
 
-    async def send_room_list(self):
-        """Send room list to agent"""
+    async def send_room_list(self, cursor: Optional[str] = None, limit: Optional[int] = None):
+        """Send one page of the room list to agent (live rooms lead the first page)"""
         try:
+            limit = parse_limit(limit, default=ROOM_LIST_PAGE_SIZE, maximum=ROOM_LIST_MAX_PAGE_SIZE)
             cache_key = f"room_list:{self.admin_id}"
-            cached = redis_client.get(cache_key)
-            if cached:
-                await self.send(text_data=cached.decode() if isinstance(cached, bytes) else cached)
-                return
-
-            room_collection = await sync_to_async(get_room_collection)()
-            chat_collection = await sync_to_async(get_chat_collection)()
-            contact_collection = await sync_to_async(get_contact_collection)()
-
-            # Filter rooms by widget access
-            if self.is_agent and self.agent_widgets:
-                rooms = await sync_to_async(lambda: list(
-                    room_collection.find({'is_active': True, 'widget_id': {'$in': self.agent_widgets}})
-                ))()
-            else:
-                rooms = await sync_to_async(lambda: list(
-                    room_collection.find({'is_active': True})
-                ))()
+            if not cursor:
+                cached = await async_redis_client.get(cache_key)
+                if cached:
+                    await self.send(text_data=cached.decode() if isinstance(cached, bytes) else cached)
+                    return
 
-            # Batch fetch live and unread status
-            pipe = redis_client.pipeline()
-            for room in rooms:
-                room_id = room['room_id']
-                pipe.exists(f'live_visitor:{room_id}')
-                pipe.get(f'unread:{room_id}')
-            results = pipe.execute()
-            live_statuses = results[::2]
-            unread_counts = results[1::2]
+            # Ordering, unread counts and live status come from the per-widget
+            # Redis index; only the rooms being shown are read from Mongo
+            widget_ids = self.agent_widgets if self.is_agent and self.agent_widgets else await get_all_widget_ids()
+            await room_index.ensure_indexed(widget_ids)
+            live = await room_index.live_rooms(widget_ids)
+            unread = await room_index.unread_counts(widget_ids)
+            page, next_cursor = await room_index.page_rooms(widget_ids, limit, cursor)
+            total_rooms = await room_index.count_rooms(widget_ids)
+
+            page_ids = [room_id for room_id, _, _ in page]
+            if not cursor:
+                page_ids += [room_id for room_id in live if room_id not in page_ids]
+            elif live:
+                # Later pages skip live rooms, which all lead the first page
+                page_ids = [room_id for room_id in page_ids if room_id not in live]
+            rooms = {
+                room['room_id']: room
+                for room in await async_db.find_rooms(page_ids, ROOM_LIST_PROJECTION)
+                if room.get('is_active')
+            }
+            contacts = await async_db.find_contacts_by_rooms(rooms)
 
             room_list = []
-            total_unread = 0
-            live_rooms = []
             current_time = datetime.datetime.utcnow()
-
-            for idx, room in enumerate(rooms):
-                room_id = room['room_id']
-                assigned_agent = room.get('assigned_agent')
-                
-                # Filter by assigned agent
-                if self.is_agent and assigned_agent and assigned_agent not in [None, 'agent', 'superadmin', self.admin_id]:
+            for room_id in page_ids:
+                room = rooms.get(room_id)
+                if room is None or (self.is_agent and not room_visible_to_agent(room, self.admin_id)):
                     continue
-
-                # Fetch last message and contact
-                last_message = await sync_to_async(lambda: chat_collection.find_one(
-                    {'room_id': room_id}, sort=[('timestamp', -1)]
-                ))()
-                contact_doc = await sync_to_async(lambda: contact_collection.find_one({'room_id': room_id}))()
-                
-                unread_count = int(unread_counts[idx] or 0)
-                total_unread += unread_count
-
-                is_live = bool(live_statuses[idx])
-                if is_live:
-                    live_rooms.append(room_id)
-
-                timestamp = last_message.get('timestamp') if last_message else None
-                timestamp_str = timestamp if isinstance(timestamp, str) else (
-                    timestamp.isoformat() if isinstance(timestamp, datetime.datetime) else ''
-                )
-
-                # Create sorting timestamp - use epoch seconds for reliable sorting
-                # Live rooms get current time (highest priority)
-                # Rooms with messages get their timestamp
-                # Rooms without messages get 0 (lowest priority)
-                if is_live:
-                    sorting_value = current_time.timestamp()
-                elif isinstance(timestamp, datetime.datetime):
-                    sorting_value = timestamp.timestamp()
-                elif isinstance(timestamp, str):
-                    try:
-                        sorting_value = datetime.datetime.fromisoformat(timestamp).timestamp()
-                    except (ValueError, AttributeError):
-                        sorting_value = 0
-                else:
-                    sorting_value = 0
-
-                room_list.append({
-                    'room_id': room_id,
-                    'widget_id': room.get('widget_id'),
-                    'contact': {
-                        'name': contact_doc.get('name') if contact_doc else '',
-                        'email': contact_doc.get('email') if contact_doc else '',
-                        'phone': contact_doc.get('phone') if contact_doc else ''
-                    },
-                    'latest_message': last_message.get('message') if last_message else '',
-                    'latest_message_sender': last_message.get('sender') if last_message else '',
-                    'timestamp': timestamp_str,
-                    'sorting_value': sorting_value,
-                    'unread_count': unread_count,
-                    'has_unread': unread_count > 0,
-                    'assigned_agent': assigned_agent,
-                    'is_live': is_live
-                })
+                room = {**room, 'unread_count': unread.get(room_id, (None, 0))[1]}
+                room_list.append(build_room_list_entry(room, contacts.get(room_id), room_id in live, current_time))
 
             # Sort rooms: live first (descending sorting_value), then by timestamp (descending)
             room_list.sort(key=lambda x: (not x['is_live'], -x['sorting_value']))
@@ -1244,13 +1305,17 @@ class ChatConsumer(AsyncWebsocketConsumer):
             response = json.dumps({
                 'type': 'room_list',
                 'rooms': room_list,
-                'total_unread': total_unread,
-                'live_room_ids': live_rooms,
+                'total_rooms': total_rooms,
+                # Totals cover the widgets' whole index, not just this page
+                'total_unread': sum(count for _, count in unread.values()),
+                'live_room_ids': list(live),
                 'agent_widgets': self.agent_widgets if self.is_agent else [],
+                'next_cursor': next_cursor,
                 'timestamp': datetime.datetime.utcnow().isoformat()
             })
 
-            redis_client.setex(cache_key, CACHE_TTL_SHORT, response)
+            if not cursor:
+                await async_redis_client.setex(cache_key, CACHE_TTL_SHORT, response)
             await self.send(text_data=response)
         except Exception as e:
             logger.error(f"Error sending room list: {e}", exc_info=True)
@@ -1303,26 +1368,24 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             logger.error(f"Error in show_form_signal: {e}")
 
-    @sync_to_async
-    def set_room_active_status(self, room_id: str, status: bool):
+    async def set_room_active_status(self, room_id: str, status: bool, reset_unread: bool = False):
         """Set room active status"""
         try:
-            collection = get_room_collection()
-            result = collection.update_one(
-                {'room_id': room_id},
-                {'$set': {'is_active': status}},
-                upsert=True
-            )
+            result = await async_db.set_room_active(room_id, status, reset_unread)
             logger.debug(f"Room status update for {room_id}: {result.modified_count} modified")
-            
-            if not status:
+
+            widget_id = await get_room_widget(room_id)
+            if status:
+                await room_index.touch_room(widget_id, room_id, only_new=True)
+                if reset_unread:
+                    await room_index.reset_unread(widget_id, room_id)
+            else:
                 # Clean up caches for inactive room
-                redis_client.delete(f"room_widget:{room_id}")
-                redis_client.delete(f"chat_history:{room_id}")
-                redis_client.delete(f"unread:{room_id}")
-                redis_client.delete(f"live_visitor:{room_id}")
-                for key in redis_client.scan_iter(f"predefined:{room_id}:*"):
-                    redis_client.delete(key)
+                await room_index.remove_room(widget_id, room_id)
+                await cache.room_widget.invalidate(room_id)
+                await async_redis_client.delete(f"chat_history:{room_id}")
+                async for key in async_redis_client.scan_iter(f"predefined:{room_id}:*"):
+                    await async_redis_client.delete(key)
         except Exception as e:
             logger.error(f"Error updating room status for {room_id}: {e}")
 
@@ -1333,6 +1396,8 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         self.admin_id = self.scope.get('url_route', {}).get('kwargs', {}).get('admin_id')
         self.query_string = self.scope.get('query_string', b'').decode()
         self.is_agent = 'agent=true' in self.query_string
+        # Clients that handle room_list_patch opt in; others keep getting refresh_room_list
+        self.supports_patches = 'room_list_patch=1' in self.query_string
         self.is_superadmin = await is_user_superadmin(self.admin_id)
 
         if not self.admin_id:
@@ -1345,53 +1410,37 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         else:
             self.agent_widgets = await get_agent_widgets(self.admin_id)
 
-        # Join notification group
-        await self.channel_layer.group_add(f'notifications_admin_{self.admin_id}', self.channel_name)
+        # Room-list patches waiting for the debounce window
+        self.pending_rooms = set()
+        self.summary_dirty = False
+        self.flush_task = None
+
+        # Join notification groups
+        self.notification_groups = self.get_notification_groups()
+        for group in self.notification_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
         await self.accept()
+
+        # Set agent online (before the summary so it counts this agent)
+        await presence.agent_connected(self.admin_id, self.agent_widgets)
         
         # Send initial dashboard summary
         await self.send_dashboard_summary()
-        
-        # Set agent online
-        redis_client.setex(f"agent_online:{self.admin_id}", CACHE_TTL_LONG, datetime.datetime.utcnow().isoformat())
         logger.debug(f"NotificationConsumer connected for admin {self.admin_id}")
 
     async def disconnect(self, close_code):
         """Handle notification WebSocket disconnection"""
         try:
-            await self.channel_layer.group_discard(f'notifications_admin_{self.admin_id}', self.channel_name)
+            for group in getattr(self, 'notification_groups', []):
+                await self.channel_layer.group_discard(group, self.channel_name)
+            if getattr(self, 'flush_task', None):
+                self.flush_task.cancel()
             if self.admin_id:
-                await self.set_agent_online_status(False)
-            await cleanup_redis_keys()
+                await presence.agent_disconnected(self.admin_id)
             logger.debug(f"NotificationConsumer disconnected for admin {self.admin_id}")
         except Exception as e:
             logger.error(f"Error in NotificationConsumer disconnect: {e}")
 
-    async def set_agent_online_status(self, is_online: bool):
-        """Set agent online/offline status"""
-        try:
-            if self.admin_id:
-                status_key = f"agent_online:{self.admin_id}"
-                count_key = f"agent_conn_count:{self.admin_id}"
-                
-                pipe = redis_client.pipeline()
-                if is_online:
-                    pipe.incr(count_key)
-                    pipe.setex(status_key, CACHE_TTL_LONG, datetime.datetime.utcnow().isoformat())
-                else:
-                    pipe.decr(count_key)
-                    pipe.get(count_key)
-                
-                results = pipe.execute()
-                
-                if not is_online and results[-1] and int(results[-1]) <= 0:
-                    pipe = redis_client.pipeline()
-                    pipe.delete(status_key)
-                    pipe.delete(count_key)
-                    pipe.execute()
-        except Exception as e:
-            logger.error(f"Error setting agent online status: {e}")
-
     async def receive(self, text_data):
         """Handle incoming notification messages"""
         try:
@@ -1401,21 +1450,56 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             if action == 'get_dashboard_summary':
                 await self.send_dashboard_summary()
             elif action == 'heartbeat':
-                redis_client.setex(f"agent_online:{self.admin_id}", CACHE_TTL_LONG, datetime.datetime.utcnow().isoformat())
+                await presence.heartbeat(self.admin_id, self.agent_widgets)
                 await self.send(text_data=json.dumps({
                     'type': 'heartbeat_response',
                     'timestamp': datetime.datetime.utcnow().isoformat()
                 }))
             elif action in ['mark_messages_read', 'mark_room_read']:
-                room_id = data.get('payload', {}).get('room_id')
-                if room_id:
-                    await self.mark_room_messages_read(room_id)
+                payload = data.get('payload', {})
+                room_ids = payload.get('room_ids') or [payload.get('room_id')]
+                room_ids = [room_id for room_id in room_ids if room_id][:MARK_READ_MAX_ROOMS]
+                if room_ids:
+                    await self.mark_rooms_read(room_ids)
                     
         except json.JSONDecodeError as e:
             logger.error(f"JSON decode error in NotificationConsumer: {e}")
         except Exception as e:
             logger.error(f"Error in NotificationConsumer receive: {e}")
 
+    def get_notification_groups(self) -> List[str]:
+        """Superadmins get every widget's events, agents one group per assigned widget"""
+        groups = [admin_notification_group(self.admin_id)]
+        if self.is_superadmin:
+            groups.append(SUPERADMIN_NOTIFICATION_GROUP)
+        else:
+            groups.extend(widget_notification_group(w) for w in self.agent_widgets)
+        return groups
+
+    async def admin_access_invalidate(self, event):
+        """Reload widget assignments and regroup after they changed elsewhere"""
+        try:
+            if self.is_superadmin:
+                self.agent_widgets = await get_all_widget_ids()
+            elif not await async_db.find_admin(self.admin_id, {'admin_id': 1}):
+                logger.debug(f"Admin {self.admin_id} was deleted, closing notifications")
+                await self.close()
+                return
+            else:
+                self.agent_widgets = await get_agent_widgets(self.admin_id)
+
+            groups = self.get_notification_groups()
+            for group in set(self.notification_groups) - set(groups):
+                await self.channel_layer.group_discard(group, self.channel_name)
+            for group in set(groups) - set(self.notification_groups):
+                await self.channel_layer.group_add(group, self.channel_name)
+            self.notification_groups = groups
+
+            await presence.heartbeat(self.admin_id, self.agent_widgets)
+            await self.send_dashboard_summary()
+        except Exception as e:
+            logger.error(f"Error reloading access for admin {self.admin_id}: {e}")
+
     def can_access_room(self, room_widget_id: Optional[str]) -> bool:
         """Check if admin can access room"""
         if self.is_superadmin:
@@ -1424,29 +1508,32 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             return False
         return room_widget_id in self.agent_widgets
 
-    async def mark_room_messages_read(self, room_id: str):
-        """Mark all messages in room as read"""
+    async def mark_rooms_read(self, room_ids: List[str]):
+        """Mark every message in `room_ids` as read, with one batched unread reset"""
         try:
-            room_widget_id = await get_room_widget(room_id)
-            if not self.can_access_room(room_widget_id):
+            rooms = await async_db.find_rooms(room_ids, {'_id': 0, 'room_id': 1, 'widget_id': 1})
+            rooms = [room for room in rooms if self.can_access_room(room.get('widget_id'))]
+            if not rooms:
                 return
+            room_ids = [room['room_id'] for room in rooms]
 
-            collection = await sync_to_async(get_chat_collection)()
-            await sync_to_async(collection.update_many)(
-                {'room_id': room_id, 'seen': False, 'sender': {'$ne': 'agent'}},
-                {'$set': {'seen': True, 'seen_at': datetime.datetime.utcnow()}}
-            )
+            await async_db.mark_rooms_messages_seen(room_ids, datetime.datetime.utcnow())
 
-            unread_key = f'unread:{room_id}'
-            redis_client.delete(unread_key)
-            logger.debug(f"Cleared unread count for room {room_id}")
+            await room_index.adjust_unread_many((room.get('widget_id'), room['room_id'], 'reset') for room in rooms)
+            await async_db.reset_rooms_unread(room_ids)
+            logger.debug(f"Cleared unread count for {len(room_ids)} rooms")
 
-            await batch_notify_admins('unread_update', room_widget_id, {
-                'room_id': room_id,
-                'widget_id': room_widget_id,
-                'unread_count': 0,
-                'timestamp': datetime.datetime.utcnow().isoformat(),
-            })
+            timestamp = datetime.datetime.utcnow().isoformat()
+            events_by_widget = defaultdict(list)
+            for room in rooms:
+                events_by_widget[room.get('widget_id')].append(('unread_update', {
+                    'room_id': room['room_id'],
+                    'widget_id': room.get('widget_id'),
+                    'unread_count': 0,
+                    'timestamp': timestamp,
+                }))
+            for widget_id, events in events_by_widget.items():
+                await notify_widget(widget_id, events)
         except Exception as e:
             logger.error(f"Error marking room messages as read: {e}")
 
@@ -1454,62 +1541,50 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         """Send dashboard summary to admin"""
         try:
             cache_key = f"dashboard_summary:{self.admin_id}"
-            cached = redis_client.get(cache_key)
+            cached = await async_redis_client.get(cache_key)
             if cached:
                 await self.send(text_data=cached.decode() if isinstance(cached, bytes) else cached)
                 return
 
-            room_collection = await sync_to_async(get_room_collection)()
-            contact_collection = await sync_to_async(get_contact_collection)()
-
             # Filter by widgets
             widget_filter = {'widget_id': {'$in': self.agent_widgets}} if self.agent_widgets else {}
-            rooms = await sync_to_async(lambda: list(room_collection.find({
-                'is_active': True,
-                **widget_filter
-            }, {'room_id': 1, 'assigned_agent': 1, 'widget_id': 1})))()
+            widget_ids = self.agent_widgets or await get_all_widget_ids()
+
+            # Totals come from the Redis room index; Mongo is only asked about
+            # the rooms with unread messages and the agent's own rooms
+            await room_index.ensure_indexed(widget_ids)
+            total_rooms = await room_index.count_rooms(widget_ids)
+            live_rooms = list(await room_index.live_rooms(widget_ids))
+            unread = await room_index.unread_counts(widget_ids)
 
-            total_rooms = len(rooms)
             total_unread = 0
             rooms_with_unread = 0
-            live_rooms = []
-            assigned_rooms = []
-
-            # Batch fetch live and unread status
-            pipe = redis_client.pipeline()
-            for room in rooms:
-                room_id = room['room_id']
-                pipe.exists(f'live_visitor:{room_id}')
-                pipe.get(f'unread:{room_id}')
-            results = pipe.execute()
-            live_statuses = results[::2]
-            unread_counts = results[1::2]
-
-            for idx, room in enumerate(rooms):
-                room_id = room['room_id']
-                assigned_agent = room.get('assigned_agent')
-                unread = int(unread_counts[idx] or 0)
-
-                # Count unread only for accessible rooms
-                if self.is_superadmin or assigned_agent == self.admin_id or assigned_agent is None:
-                    total_unread += unread
-                    if unread > 0:
+            if unread:
+                unread_rooms = await async_db.find_rooms(unread, {'_id': 0, 'room_id': 1, 'assigned_agent': 1, 'is_active': 1})
+                for room in unread_rooms:
+                    assigned_agent = room.get('assigned_agent')
+                    # Count unread only for accessible rooms
+                    if room.get('is_active') and (self.is_superadmin or assigned_agent == self.admin_id or assigned_agent is None):
+                        total_unread += unread[room['room_id']][1]
                         rooms_with_unread += 1
 
-                if bool(live_statuses[idx]):
-                    live_rooms.append(room_id)
-                if assigned_agent == self.admin_id or self.is_superadmin:
-                    assigned_rooms.append(room_id)
+            if self.is_superadmin:
+                assigned_rooms = await room_index.room_ids(widget_ids)
+            else:
+                assigned_rooms = [
+                    room['room_id']
+                    for room in await async_db.find_active_rooms(widget_ids, {'room_id': 1}, assigned_agent=self.admin_id)
+                ]
 
             # Count contacts today
             today = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-            contacts_today = await sync_to_async(lambda: contact_collection.count_documents({
+            contacts_today = await async_db.count_contacts({
                 'timestamp': {'$gte': today},
                 **widget_filter
-            }))()
+            })
 
             # Count online agents
-            online_agents = len([key for key in redis_client.scan_iter('agent_online:*')])
+            online_agents = await presence.online_count()
 
             response = json.dumps({
                 'type': 'dashboard_summary',
@@ -1528,52 +1603,96 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 }
             })
 
-            redis_client.setex(cache_key, 30, response)
+            await async_redis_client.setex(cache_key, 30, response)
             await self.send(text_data=response)
         except Exception as e:
             logger.error(f"Error sending dashboard summary: {e}", exc_info=True)
 
-    async def notify_filtered(self, event):
-        """Handle filtered notification events"""
+    def schedule_room_list_flush(self):
+        """Start the debounce timer unless one is already running"""
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self.flush_room_list_updates())
+
+    async def flush_room_list_updates(self):
+        """After the patch window, push one patch for every room touched during it"""
         try:
-            event_type = event.get('event_type')
-            payload = event.get('payload', {})
-            widget_id = payload.get('widget_id')
-
-            # Clear caches for important events
-            should_refresh = event_type in [
-                'new_message_agent', 
-                'unread_update', 
-                'new_contact', 
-                'new_room', 
-                'new_live_visitor', 
-                'visitor_disconnected', 
-                'room_list_update'
-            ]
-            
-            if should_refresh:
-                redis_client.delete(f"dashboard_summary:{self.admin_id}")
-                redis_client.delete(f"room_list:{self.admin_id}")
-                
-                # Force immediate refresh for live visitor events
-                if event_type in ['new_live_visitor', 'visitor_disconnected'] or payload.get('force_refresh'):
-                    # Send dashboard summary
-                    await self.send_dashboard_summary()
-                    
-                    # Send refresh signal
+            await asyncio.sleep(ROOM_LIST_PATCH_WINDOW)
+            room_ids, self.pending_rooms = self.pending_rooms, set()
+            refresh_summary, self.summary_dirty = self.summary_dirty, False
+
+            await async_redis_client.delete(f"dashboard_summary:{self.admin_id}", f"room_list:{self.admin_id}")
+            if room_ids and self.supports_patches:
+                await self.send_room_list_patch(room_ids)
+            if refresh_summary:
+                await self.send_dashboard_summary()
+                if not self.supports_patches:
+                    # Legacy clients re-fetch the whole list on this signal
                     await self.send(text_data=json.dumps({
                         'type': 'refresh_room_list',
                         'timestamp': datetime.datetime.utcnow().isoformat()
                     }))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error flushing room list updates for {self.admin_id}: {e}", exc_info=True)
+
+    async def send_room_list_patch(self, room_ids):
+        """
+        Send per-room changes instead of the whole list.
+
+        Each op is either `upsert` (full room row, including `sorting_value`
+        so the client can move it: live first, then newest first) or
+        `remove` (room closed, reassigned away or no longer accessible).
+        """
+        rooms = {room['room_id']: room for room in await async_db.find_rooms(room_ids, ROOM_LIST_PROJECTION)}
+        contacts = await async_db.find_contacts_by_rooms(rooms)
+        ordered_ids = sorted(room_ids)
+        unread_counts, live_statuses = await room_index.room_states(
+            [{'room_id': room_id, 'widget_id': rooms.get(room_id, {}).get('widget_id')} for room_id in ordered_ids]
+        )
+
+        current_time = datetime.datetime.utcnow()
+        ops = []
+        for room_id, unread_count, is_live in zip(ordered_ids, unread_counts, live_statuses):
+            room = rooms.get(room_id)
+            visible = (
+                room is not None and room.get('is_active')
+                and self.can_access_room(room.get('widget_id'))
+                and (self.is_superadmin or room_visible_to_agent(room, self.admin_id))
+            )
+            if visible:
+                room = {**room, 'unread_count': unread_count}
+                ops.append({'op': 'upsert', 'room': build_room_list_entry(room, contacts.get(room_id), is_live, current_time)})
+            else:
+                ops.append({'op': 'remove', 'room_id': room_id})
 
-            # Send the event to the admin
-            await self.send(text_data=json.dumps({
-                'type': f'dashboard_{event_type}',
-                'payload': payload,
-                'timestamp': datetime.datetime.utcnow().isoformat()
-            }))
+        await self.send(text_data=json.dumps({
+            'type': 'room_list_patch',
+            'ops': ops,
+            'timestamp': current_time.isoformat()
+        }))
+
+    async def notify_widget(self, event):
+        """Handle a combined widget notification, filtered for this admin"""
+        try:
+            if not self.can_access_room(event.get('widget_id')):
+                return
+            events = event.get('events', [])
+            event_types = {e.get('event_type') for e in events}
+
+            # Queue the affected rooms; the list is patched once per window
+            if event_types & REFRESH_EVENTS:
+                self.pending_rooms.update(e['room_id'] for e in events if e.get('room_id'))
+                if event_types & {'new_live_visitor', 'visitor_disconnected'} or \
+                        any(e.get('force_refresh') for e in events):
+                    self.summary_dirty = True
+                self.schedule_room_list_flush()
+
+            # Forward each pre-encoded event with this admin's id
+            for e in events:
+                await self.send(text_data=notification_text(e['frame'], self.admin_id))
         except Exception as e:
-            logger.error(f"Error in notify_filtered: {e}", exc_info=True)
+            logger.error(f"Error in notify_widget: {e}", exc_info=True)
 
 
 # Utility functions for external use
@@ -1581,12 +1700,9 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 async def get_unread_summary_by_widget(widget_ids: Optional[List[str]] = None) -> Dict[str, Any]:
     """Get unread message summary grouped by widget"""
     try:
-        room_collection = await sync_to_async(get_room_collection)()
-        widget_filter = {'widget_id': {'$in': widget_ids}} if widget_ids else {}
-        
-        rooms = await sync_to_async(lambda: list(
-            room_collection.find({'is_active': True, **widget_filter}, {'room_id': 1, 'widget_id': 1})
-        ))()
+        widget_ids = widget_ids or await get_all_widget_ids()
+        await room_index.ensure_indexed(widget_ids)
+        unread_counts = await room_index.unread_counts(widget_ids)
         
         unread_summary = {
             'total_unread': 0,
@@ -1595,17 +1711,7 @@ async def get_unread_summary_by_widget(widget_ids: Optional[List[str]] = None) -
             'widget_breakdown': {}
         }
         
-        # Batch fetch unread counts
-        pipe = redis_client.pipeline()
-        for room in rooms:
-            pipe.get(f'unread:{room["room_id"]}')
-        unread_counts = pipe.execute()
-        
-        for idx, room in enumerate(rooms):
-            room_id = room['room_id']
-            room_widget_id = room.get('widget_id')
-            unread_count = int(unread_counts[idx] or 0)
-            
+        for room_id, (room_widget_id, unread_count) in unread_counts.items():
             if unread_count > 0:
                 unread_summary['total_unread'] += unread_count
                 unread_summary['rooms_with_unread'] += 1
@@ -1688,41 +1794,38 @@ def get_agent_accessible_rooms(admin_id: str) -> List[str]:
 def get_widget_statistics(widget_id: str) -> Dict[str, Any]:
     """Get statistics for a specific widget"""
     try:
-        room_collection = get_room_collection()
         contact_collection = get_contact_collection()
         chat_collection = get_chat_collection()
-        
-        # Get active rooms
-        active_rooms = list(room_collection.find({
-            'widget_id': widget_id,
-            'is_active': True
-        }, {'room_id': 1}))
-        
-        room_ids = [room['room_id'] for room in active_rooms]
-        
-        # Get unread counts
-        pipe = redis_client.pipeline()
-        for room_id in room_ids:
-            pipe.get(f'unread:{room_id}')
-        unread_counts = pipe.execute()
-        total_unread = sum(int(count or 0) for count in unread_counts)
-        
+        admin_collection = get_admin_collection()
+
+        # Room counts come from the widget's Redis room index
+        room_index.ensure_indexed_sync(widget_id)
+        active_rooms = room_index.count_rooms_sync(widget_id)
+        total_unread = room_index.unread_total_sync(widget_id)
+
         # Get total contacts
         total_contacts = contact_collection.count_documents({'widget_id': widget_id})
-        
-        # Get recent messages (last 24 hours)
+
+        # Get recent messages (last 24 hours); only rooms active since then can have any
         yesterday = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        recent_room_ids = room_index.rooms_active_since_sync(widget_id, yesterday)
         recent_messages = chat_collection.count_documents({
-            'room_id': {'$in': room_ids},
+            'room_id': {'$in': recent_room_ids},
             'timestamp': {'$gte': yesterday}
-        })
-        
+        }) if recent_room_ids else 0
+
+        # Agents assigned the widget (multikey index) plus every superadmin
+        eligible_admins = admin_collection.count_documents({
+            'assigned_widgets': widget_id, 'role': {'$ne': 'superadmin'}
+        }) + admin_collection.count_documents({'role': 'superadmin'})
+
         return {
             'widget_id': widget_id,
-            'active_rooms': len(active_rooms),
+            'active_rooms': active_rooms,
             'total_unread': total_unread,
             'total_contacts': total_contacts,
             'recent_messages_24h': recent_messages,
+            'eligible_admins': eligible_admins,
             'timestamp': datetime.datetime.utcnow().isoformat()
         }
     except Exception as e:
@@ -1733,5 +1836,6 @@ def get_widget_statistics(widget_id: str) -> Dict[str, Any]:
             'total_unread': 0,
             'total_contacts': 0,
             'recent_messages_24h': 0,
+            'eligible_admins': 0,
             'timestamp': datetime.datetime.utcnow().isoformat()
         }
\ No newline at end of file
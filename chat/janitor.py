@@ -0,0 +1,170 @@
+"""
+Background Redis janitor.
+
+Each tick advances one SCAN step (REDIS_JANITOR['SCAN_COUNT'] keys) from a
+cursor persisted in Redis, so a full pass is spread over many ticks and
+survives restarts.  Per tick it:
+
+  - deletes room-scoped keys (typing:, predefined:, chat_history:,
+    room_widget:) whose room is closed or gone, checking only the rooms
+    seen in that step
+  - prunes the oldest members of any widget_rooms: index it came across
+  - sweeps up to PRESENCE_BATCH expired agents out of the presence
+    registry, and checks the next PRESENCE_BATCH online agents (from a
+    heartbeat-score cursor, also persisted) against Mongo for deleted ones
+
+Counters are kept in the `janitor:metrics` hash and exported to Prometheus
+(keys scanned, keys reclaimed per kind, tick duration); run it with
+`python manage.py run_redis_janitor`.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from prometheus_client import Counter as PrometheusCounter, Gauge
+
+from utils import presence, room_index
+from utils.redis_client import async_redis_client
+from wish_bot import async_db
+
+logger = logging.getLogger(__name__)
+
+CURSOR_KEY = "janitor:scan_cursor"
+PRESENCE_CURSOR_KEY = "janitor:presence_cursor"
+METRICS_KEY = "janitor:metrics"
+ROOM_KEY_PREFIXES = ('typing', 'predefined', 'chat_history', 'room_widget')
+
+keys_scanned = PrometheusCounter('janitor_keys_scanned_total', 'Redis keys visited by the janitor SCAN')
+keys_reclaimed = PrometheusCounter('janitor_keys_reclaimed_total', 'Redis entries reclaimed by the janitor', ['kind'])
+tick_duration = Gauge('janitor_tick_seconds', 'Duration of the last janitor tick')
+
+
+def _config(key, default=None):
+    return getattr(settings, 'REDIS_JANITOR', {}).get(key, default)
+
+
+def _room_id(key):
+    prefix, _, rest = key.partition(':')
+    if prefix not in ROOM_KEY_PREFIXES or not rest:
+        return None
+    return rest.split(':', 1)[0]
+
+
+async def _active_room_ids(room_ids):
+    rooms = await async_db.find_rooms(room_ids, {'room_id': 1, 'is_active': 1})
+    return {room['room_id'] for room in rooms if room.get('is_active')}
+
+
+async def _reclaim_room_keys(keys):
+    """Delete room-scoped keys of inactive rooms; returns reclaimed counts per prefix"""
+    keys_by_room = defaultdict(list)
+    for key in keys:
+        room_id = _room_id(key)
+        if room_id:
+            keys_by_room[room_id].append(key)
+    if not keys_by_room:
+        return Counter()
+
+    active = await _active_room_ids(keys_by_room)
+    stale = [key for room_id, room_keys in keys_by_room.items() if room_id not in active for key in room_keys]
+    if stale:
+        await async_redis_client.delete(*stale)
+    return Counter(key.partition(':')[0] for key in stale)
+
+
+async def _prune_room_index(keys):
+    """Drop closed rooms from the least recently active end of each index seen"""
+    batch = _config('INDEX_BATCH', 200)
+    pruned = 0
+    for key in keys:
+        widget_id = key.partition(':')[2]
+        oldest = await async_redis_client.zrange(key, 0, batch - 1)
+        if not oldest:
+            continue
+        active = await _active_room_ids(oldest)
+        for room_id in oldest:
+            if room_id not in active:
+                await room_index.remove_room(widget_id, room_id)
+                pruned += 1
+    return pruned
+
+
+async def _sweep_presence():
+    """Bounded presence sweep: one page of expired agents, one page of online ones checked for deletion"""
+    batch = _config('PRESENCE_BATCH', 200)
+    removed = len(await presence.sweep_expired(batch))
+
+    after = await async_redis_client.get(PRESENCE_CURSOR_KEY)
+    page = await presence.online_page(float(after) if after else None, batch)
+    online = [admin_id for admin_id, _ in page]
+    if online:
+        existing = {
+            admin['admin_id']
+            for admin in await async_db.find_admins({'admin_id': {'$in': online}}, {'admin_id': 1})
+        }
+        deleted = [admin_id for admin_id in online if admin_id not in existing]
+        await presence.remove_agents(deleted)
+        removed += len(deleted)
+
+    # A short page reached the newest heartbeat: start over from the oldest
+    if len(page) < batch:
+        await async_redis_client.delete(PRESENCE_CURSOR_KEY)
+    else:
+        await async_redis_client.set(PRESENCE_CURSOR_KEY, page[-1][1])
+    return removed
+
+
+async def run_tick():
+    """One bounded janitor step; returns this tick's counters"""
+    started = time.monotonic()
+    cursor = int(await async_redis_client.get(CURSOR_KEY) or 0)
+    cursor, keys = await async_redis_client.scan(cursor, count=_config('SCAN_COUNT', 500))
+
+    reclaimed = await _reclaim_room_keys(keys)
+    reclaimed['widget_rooms'] = await _prune_room_index([key for key in keys if key.startswith('widget_rooms:')])
+    reclaimed['presence'] = await _sweep_presence()
+    reclaimed = +reclaimed  # drop zero counts
+
+    pipe = async_redis_client.pipeline()
+    pipe.set(CURSOR_KEY, cursor)
+    pipe.hincrby(METRICS_KEY, 'ticks', 1)
+    pipe.hincrby(METRICS_KEY, 'keys_scanned', len(keys))
+    pipe.hincrby(METRICS_KEY, 'keys_reclaimed', sum(reclaimed.values()))
+    for kind, count in reclaimed.items():
+        pipe.hincrby(METRICS_KEY, f'reclaimed:{kind}', count)
+    if cursor == 0:
+        pipe.hincrby(METRICS_KEY, 'passes_completed', 1)
+    pipe.hset(METRICS_KEY, 'last_tick_at', int(time.time()))
+    await pipe.execute()
+
+    keys_scanned.inc(len(keys))
+    for kind, count in reclaimed.items():
+        keys_reclaimed.labels(kind).inc(count)
+    tick_duration.set(time.monotonic() - started)
+
+    if reclaimed:
+        logger.info(f"Redis janitor reclaimed {dict(reclaimed)} from {len(keys)} scanned keys")
+    return {'scanned': len(keys), 'reclaimed': dict(reclaimed), 'pass_complete': cursor == 0}
+
+
+async def get_metrics():
+    return await async_redis_client.hgetall(METRICS_KEY)
+
+
+async def run_forever(interval=None, once=False):
+    """Tick every `interval` seconds; with `once`, run a single full pass and return"""
+    interval = _config('INTERVAL', 30) if interval is None else interval
+    while True:
+        try:
+            result = await run_tick()
+        except Exception as e:
+            if once:
+                raise
+            logger.error(f"Redis janitor tick failed: {e}", exc_info=True)
+            result = {'pass_complete': False}
+        if once and result['pass_complete']:
+            return
+        if not once:
+            await asyncio.sleep(interval)
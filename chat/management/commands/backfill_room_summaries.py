@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from utils.room_index import get_unread_sync
+from wish_bot.db import get_chat_collection, get_room_collection
+
+
+class Command(BaseCommand):
+    help = "Populate last_message/last_timestamp/message_count/unread_count on existing room documents."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Room updates per bulk write")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        room_collection = get_room_collection()
+
+        pipeline = [
+            # Legacy messages may carry string timestamps
+            {
+                "$addFields": {
+                    "ts": {
+                        "$cond": {
+                            "if": {"$eq": [{"$type": "$timestamp"}, "string"]},
+                            "then": {"$toDate": "$timestamp"},
+                            "else": "$timestamp"
+                        }
+                    }
+                }
+            },
+            {"$sort": {"room_id": 1, "ts": -1}},
+            {
+                "$group": {
+                    "_id": "$room_id",
+                    "last_message": {"$first": "$message"},
+                    "last_sender": {"$first": "$sender"},
+                    "last_timestamp": {"$first": "$ts"},
+                    "message_count": {"$sum": 1},
+                }
+            },
+        ]
+
+        room_widgets = {room['room_id']: room.get('widget_id') for room in room_collection.find({}, {'room_id': 1, 'widget_id': 1})}
+
+        updates = []
+        updated = 0
+        for summary in get_chat_collection().aggregate(pipeline, allowDiskUse=True):
+            room_id = summary['_id']
+            updates.append(UpdateOne(
+                {'room_id': room_id},
+                {'$set': {
+                    'last_message': summary['last_message'],
+                    'last_sender': summary['last_sender'],
+                    'last_timestamp': summary['last_timestamp'],
+                    'message_count': summary['message_count'],
+                    'unread_count': get_unread_sync(room_widgets.get(room_id), room_id),
+                }}
+            ))
+            if len(updates) >= batch_size:
+                updated += room_collection.bulk_write(updates, ordered=False).modified_count
+                updates = []
+
+        if updates:
+            updated += room_collection.bulk_write(updates, ordered=False).modified_count
+
+        # Rooms without any messages still need the counters for sorting/filtering
+        room_collection.update_many({'message_count': {'$exists': False}}, {'$set': {'message_count': 0}})
+        room_collection.update_many({'unread_count': {'$exists': False}}, {'$set': {'unread_count': 0}})
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled summaries for {updated} rooms"))
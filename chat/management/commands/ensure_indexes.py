@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from wish_bot.db import COLLECTION_INDEXES, ensure_indexes
+
+
+class Command(BaseCommand):
+    help = "Create or repair MongoDB indexes for all collections. Run once per deploy."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'collections',
+            nargs='*',
+            help=f"Collections to process (default: all). Choices: {', '.join(COLLECTION_INDEXES)}",
+        )
+
+    def handle(self, *args, **options):
+        names = options['collections'] or None
+        unknown = [name for name in names or [] if name not in COLLECTION_INDEXES]
+        if unknown:
+            self.stderr.write(self.style.ERROR(f"Unknown collections: {', '.join(unknown)}"))
+            return
+
+        for name in ensure_indexes(names):
+            self.stdout.write(f"Ensured indexes for {name}")
+        self.stdout.write(self.style.SUCCESS("Index bootstrap complete"))
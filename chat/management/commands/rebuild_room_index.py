@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from utils.room_index import rebuild_widget_index
+from wish_bot.db import get_widget_collection
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-widget Redis room index (activity ZSET and unread hash) from MongoDB."
+
+    def add_arguments(self, parser):
+        parser.add_argument('widget_ids', nargs='*', help="Widgets to rebuild (default: all)")
+
+    def handle(self, *args, **options):
+        widget_ids = options['widget_ids'] or [
+            widget['widget_id'] for widget in get_widget_collection().find({}, {'widget_id': 1})
+        ]
+        total = 0
+        for widget_id in widget_ids:
+            indexed = rebuild_widget_index(widget_id)
+            if indexed is None:
+                self.stdout.write(f"Skipped widget {widget_id}: another rebuild is running")
+                continue
+            total += indexed
+            self.stdout.write(f"Indexed {indexed} rooms for widget {widget_id}")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt room index for {len(widget_ids)} widgets ({total} rooms)"))
@@ -0,0 +1,31 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from prometheus_client import start_http_server
+
+from chat.janitor import get_metrics, run_forever
+
+
+class Command(BaseCommand):
+    help = "Reclaim stale chat keys from Redis in small, resumable SCAN steps. Runs until interrupted unless --once is given."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Finish the current SCAN pass and exit")
+        parser.add_argument('--interval', type=float, help="Seconds between ticks (default: REDIS_JANITOR['INTERVAL'])")
+        parser.add_argument('--stats', action='store_true', help="Print the janitor metrics and exit")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            for name, value in sorted(asyncio.run(get_metrics()).items()):
+                self.stdout.write(f"{name}: {value}")
+            return
+
+        metrics_port = getattr(settings, 'REDIS_JANITOR', {}).get('METRICS_PORT')
+        if metrics_port:
+            start_http_server(metrics_port)
+            self.stdout.write(f"Serving janitor metrics on port {metrics_port}")
+
+        self.stdout.write("Redis janitor started")
+        asyncio.run(run_forever(options['interval'], once=options['once']))
+        self.stdout.write(self.style.SUCCESS("Redis janitor pass complete"))
@@ -0,0 +1,57 @@
+"""
+Channel-layer events published by HTTP views for live ChatConsumers.
+
+Views are synchronous, so these helpers wrap group_send with async_to_sync.
+Failures are logged and swallowed: a missed event only means a consumer
+keeps a slightly stale cache until it reconnects.
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+
+def invalidate_room_context(room_id):
+    """Ask consumers connected to `room_id` to reload their cached room context"""
+    try:
+        channel_layer = get_channel_layer()
+        async_to_sync(channel_layer.group_send)(
+            f'chat_{room_id}',
+            {
+                'type': 'room_context_invalidate',
+                'room_id': room_id,
+            }
+        )
+    except Exception as e:
+        logger.error(f"Error invalidating room context for {room_id}: {e}")
+
+
+def invalidate_room_contexts(room_ids):
+    for room_id in room_ids:
+        invalidate_room_context(room_id)
+
+
+def _send_access_invalidate(group, admin_id=None):
+    try:
+        channel_layer = get_channel_layer()
+        async_to_sync(channel_layer.group_send)(
+            group,
+            {
+                'type': 'admin_access_invalidate',
+                'admin_id': admin_id,
+            }
+        )
+    except Exception as e:
+        logger.error(f"Error invalidating admin access for {group}: {e}")
+
+
+def invalidate_admin_access(admin_id):
+    """Ask an admin's live sockets to reload their widget assignments"""
+    _send_access_invalidate(f'notifications_admin_{admin_id}', admin_id)
+
+
+def invalidate_superadmin_access():
+    """Ask superadmin dashboards to reload the widget list"""
+    _send_access_invalidate('notifications_superadmins')
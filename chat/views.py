@@ -14,6 +14,9 @@ from authentication.permissions import IsAgentOrSuperAdmin
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from utils.random_id import generate_room_id,generate_widget_id,generate_contact_id
+from chat.room_events import invalidate_room_context, invalidate_superadmin_access
+from utils import cache as cache_layer
+from utils.pagination import InvalidCursor, paginate, parse_limit
 import logging
 import uuid
 import json
@@ -274,6 +277,9 @@ def delete_widget(request, widget_id):
         
         # Delete the widget
         widget_collection.delete_one({"widget_id": widget_id})
+        cache_layer.invalidate_after_write(cache_layer.widget_ids)
+        cache_layer.invalidate_after_write(cache_layer.widget_triggers, widget_id)
+        invalidate_superadmin_access()
         
         return JsonResponse({"message": f"Widget {widget_id} deleted successfully"}, status=200)
     
@@ -405,6 +411,8 @@ def create_widget(request):
         }
 
         insert_with_timestamps(widget_collection, widget)
+        cache_layer.invalidate_after_write(cache_layer.widget_ids)
+        invalidate_superadmin_access()
 
         return JsonResponse({
             "widget_id": widget_id,
@@ -949,6 +957,11 @@ class UserChatAPIView(APIView):
                 'created_at': datetime.utcnow(),
                 'updated_at': datetime.utcnow(),
                 'assigned_agent': None,
+                'last_message': None,
+                'last_sender': None,
+                'last_timestamp': None,
+                'message_count': 0,
+                'unread_count': 0,
                 'user_location': {
                     'user_ip': client_ip,
                     'country': ip_info.get('country', 'Unknown'),
@@ -1255,6 +1268,7 @@ class AgentChatAPIView(APIView):
                     }
                 }
             )
+            invalidate_room_context(room_id)
 
             return Response({
                 "message": f"Agent '{agent_name}' assigned to room '{room_id}'",
@@ -1307,6 +1321,7 @@ class TestAgentAssignView(APIView):
                     {'room_id': room_id},
                     {'$set': {'assigned_agent': assigned_agent}}
                 )
+                invalidate_room_context(room_id)
                 agent_info = f"Assigned test agent to room {room_id}"
 
             return render(request, 'chat/agent_chat.html', {
@@ -1656,12 +1671,20 @@ def test_widget_view(request):
 
 class ChatMessagesAPIView(APIView):
     @swagger_auto_schema(
-        operation_description="Retrieve all chat messages for a specific room.",
+        operation_description="Retrieve chat messages for a specific room, newest page first.",
         manual_parameters=[
             openapi.Parameter(
                 'room_id', openapi.IN_PATH, description="The ID of the chat room", 
                 type=openapi.TYPE_STRING, required=True
             ),
+            openapi.Parameter(
+                'limit', openapi.IN_QUERY, description="Messages per page (max 200)",
+                type=openapi.TYPE_INTEGER, required=False
+            ),
+            openapi.Parameter(
+                'cursor', openapi.IN_QUERY, description="next_cursor from the previous page",
+                type=openapi.TYPE_STRING, required=False
+            ),
         ],
         responses={
             200: openapi.Response(
@@ -1680,21 +1703,30 @@ class ChatMessagesAPIView(APIView):
                                     'message': openapi.Schema(type=openapi.TYPE_STRING),
                                 }
                             )
-                        )
+                        ),
+                        'next_cursor': openapi.Schema(type=openapi.TYPE_STRING),
                     }
                 )
             ),
-            400: openapi.Response(description="Bad request, room_id is required"),
+            400: openapi.Response(description="Bad request, room_id is required or cursor is invalid"),
         }
     )
     def get(self, request, room_id):
-        """Retrieve all chat messages for a specific room"""
+        """Retrieve one page of chat messages for a specific room, oldest first"""
         
         if not room_id:
             return Response({'error': 'room_id is required'}, status=status.HTTP_400_BAD_REQUEST)
 
+        # Pages walk backwards from the newest message; pass next_cursor to load older ones
         collection = get_chat_collection()
-        messages = list(collection.find({'room_id': room_id}).sort('timestamp', 1))
+        try:
+            messages, next_cursor = paginate(
+                collection, {'room_id': room_id}, 'timestamp',
+                parse_limit(request.GET.get('limit')), cursor=request.GET.get('cursor')
+            )
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        messages.reverse()
         
         for msg in messages:
             msg['_id'] = str(msg['_id'])
@@ -1709,7 +1741,7 @@ class ChatMessagesAPIView(APIView):
             elif isinstance(msg['timestamp'], datetime):
                 msg['timestamp'] = msg['timestamp'].isoformat()
 
-        return Response({'messages': messages}, status=status.HTTP_200_OK)
+        return Response({'messages': messages, 'next_cursor': next_cursor}, status=status.HTTP_200_OK)
 
 
 
@@ -2030,36 +2062,14 @@ logger = logging.getLogger(__name__)
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from django.core.cache import cache
 from django.conf import settings
 import json
-from functools import wraps
 from wish_bot.db import get_room_collection, get_chat_collection
-
-def rate_limit(max_requests=5, period=60):
-    def decorator(view_func):
-        @wraps(view_func)
-        def wrapped_view(request, *args, **kwargs):
-            if not settings.DEBUG:  # Don't rate limit in development
-                ip = request.META.get('REMOTE_ADDR')
-                cache_key = f'rate_limit:{ip}:{request.path}'
-                count = cache.get(cache_key, 0)
-                
-                if count >= max_requests:
-                    return JsonResponse({
-                        'error': 'Too many requests',
-                        'retry_after': period
-                    }, status=429)
-                
-                cache.set(cache_key, count + 1, period)
-            
-            return view_func(request, *args, **kwargs)
-        return wrapped_view
-    return decorator
+from utils.rate_limit import rate_limit
 
 @csrf_exempt
 @require_http_methods(["POST"])
-@rate_limit(max_requests=10, period=60)  # 10 requests per minute
+@rate_limit('chat_history')  # RATE_LIMITS['chat_history']
 def chat_history(request):
     try:
         # Verify Content-Type
@@ -2084,13 +2094,8 @@ def chat_history(request):
         
         room_id = data['room_id']
         widget_id = data['widget_id']
-        limit = int(data.get('limit', 0))  # Default to 0 (no limit)
-        
-        # Validate limit
-        if limit < 0:
-            return JsonResponse({
-                'error': 'Limit must be a positive integer'
-            }, status=400)
+        limit = parse_limit(data.get('limit'))
+        cursor = data.get('cursor')  # next_cursor from the previous (newer) page
         
         # Verify room belongs to this widget
         room_collection = get_room_collection()
@@ -2111,21 +2116,18 @@ def chat_history(request):
         # Get total count for reference
         total_count = chat_collection.count_documents(query)
         
-        # Get messages sorted by timestamp (newest first)
-        cursor = chat_collection.find(
-            query,
-            {
-                '_id': 0,
-                'room_id': 0,
-                'form_data': 0  # Exclude sensitive form data
-            }
-        ).sort('timestamp', -1)  # Most recent first
-        
-        # Apply limit if specified
-        if limit > 0:
-            cursor = cursor.limit(limit)
-        
-        messages = list(cursor)
+        # Get one page of messages sorted by timestamp (newest first)
+        try:
+            messages, next_cursor = paginate(
+                chat_collection, query, 'timestamp', limit, cursor=cursor,
+                projection={
+                    '_id': 0,
+                    'room_id': 0,
+                    'form_data': 0  # Exclude sensitive form data
+                }
+            )
+        except InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
         
         # Convert ObjectId and datetime to strings
         # for message in messages:
@@ -2148,7 +2150,8 @@ def chat_history(request):
             'room_id': room_id,
             'total_messages': total_count,
             'returned_messages': len(messages),
-            'limit_applied': limit if limit > 0 else None,
+            'limit_applied': limit,
+            'next_cursor': next_cursor,
             'messages': messages
         }, status=200)
         
@@ -0,0 +1,322 @@
+"""
+Columnar response-time analytics.
+
+Messages are loaded once into NumPy arrays (room index, timestamp, sender
+kind), ordered by room and time, and every statistic is computed with
+vectorized operations:
+
+  - response time of each customer message = time until the next agent
+    message in the same room (a reverse running minimum over agent
+    positions, so long customer streaks stay linear)
+  - first response time per room = first customer message to the first
+    agent reply after it
+  - chat duration per room = last message minus first message
+
+Rooms can belong to different agents, so the same frame answers a single
+agent's analytics, the rollup rebuild and the team leaderboard.
+"""
+from collections import Counter
+
+import numpy as np
+
+from dashboard.rollups import infer_sender_type
+from wish_bot.db import get_chat_collection
+
+CUSTOMER = 0
+AGENT = 1
+OTHER = 2
+
+_KINDS = {'customer': CUSTOMER, 'agent': AGENT}
+
+DAY_MS = 86400 * 1000
+
+
+class MessageFrame:
+    """Messages of many rooms as parallel arrays, sorted by (room, timestamp)"""
+
+    def __init__(self, room_ids, room_index, timestamps, kinds, message_ids=None):
+        self.room_ids = room_ids                  # position -> room_id
+        self.room_index = room_index              # int64, per message
+        self.timestamps = timestamps              # int64 epoch milliseconds, per message
+        self.kinds = kinds                        # int8 CUSTOMER/AGENT/OTHER, per message
+        self.message_ids = message_ids or []      # message_id, per message
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def from_messages(cls, messages):
+        """Build a frame from message dicts already ordered by room, then timestamp"""
+        room_ids, room_positions = [], {}
+        rooms, stamps, kinds, message_ids = [], [], [], []
+        for message in messages:
+            ts = message.get('timestamp')
+            if not hasattr(ts, 'year'):
+                continue
+            room_id = message['room_id']
+            if room_id not in room_positions:
+                room_positions[room_id] = len(room_ids)
+                room_ids.append(room_id)
+            rooms.append(room_positions[room_id])
+            stamps.append(ts.replace(tzinfo=None))
+            kinds.append(_KINDS.get(infer_sender_type(message), OTHER))
+            message_ids.append(message.get('message_id'))
+
+        timestamps = np.array(stamps, dtype='datetime64[ms]').astype(np.int64)
+        return cls(room_ids, np.array(rooms, dtype=np.int64), timestamps, np.array(kinds, dtype=np.int8), message_ids)
+
+    @classmethod
+    def load(cls, room_ids, start=None, end=None, batch_size=5000):
+        """Load messages for `room_ids` (optionally within [start, end))"""
+        query = {'room_id': {'$in': list(room_ids)}}
+        date_q = {}
+        if start:
+            date_q['$gte'] = start
+        if end:
+            date_q['$lt'] = end
+        if date_q:
+            query['timestamp'] = date_q
+        # (room_id -1, timestamp 1) walks the room_id_1_timestamp_-1 index backwards
+        cursor = get_chat_collection().find(
+            query,
+            {'_id': 0, 'room_id': 1, 'message_id': 1, 'timestamp': 1, 'sender': 1, 'sender_type': 1}
+        ).sort([('room_id', -1), ('timestamp', 1)]).batch_size(batch_size)
+        return cls.from_messages(cursor)
+
+
+def response_times(frame):
+    """
+    Response time for every answered customer message.
+
+    Returns (customer_positions, seconds, reply_positions) as arrays.
+    """
+    n = len(frame)
+    if not n:
+        empty = np.array([], dtype=np.int64)
+        return empty, np.array([], dtype=np.float64), empty
+
+    positions = np.arange(n)
+    agent_at = np.where(frame.kinds == AGENT, positions, n)
+    # Index of the next agent message at or after each position
+    next_agent = np.minimum.accumulate(agent_at[::-1])[::-1]
+
+    customers = positions[frame.kinds == CUSTOMER]
+    replies = next_agent[customers]
+    answered = replies < n
+    customers, replies = customers[answered], replies[answered]
+    same_room = frame.room_index[replies] == frame.room_index[customers]
+    customers, replies = customers[same_room], replies[same_room]
+    return customers, (frame.timestamps[replies] - frame.timestamps[customers]) / 1000.0, replies
+
+
+def first_response_times(frame):
+    """Seconds from each room's first customer message to the first agent reply (NaN if none)"""
+    result = np.full(len(frame.room_ids), np.nan)
+    customers, seconds, _ = response_times(frame)
+    if not len(customers):
+        return result
+
+    first_customer = np.full(len(frame.room_ids), -1, dtype=np.int64)
+    customer_rooms = frame.room_index[frame.kinds == CUSTOMER]
+    customer_positions = np.flatnonzero(frame.kinds == CUSTOMER)
+    rooms, first_idx = np.unique(customer_rooms, return_index=True)
+    first_customer[rooms] = customer_positions[first_idx]
+
+    # Answered customer messages that are their room's first customer message
+    is_first = first_customer[frame.room_index[customers]] == customers
+    result[frame.room_index[customers[is_first]]] = seconds[is_first]
+    return result
+
+
+def chat_durations(frame):
+    """Seconds between the first and last message of each room"""
+    if not len(frame):
+        return np.zeros(len(frame.room_ids))
+    count = len(frame.room_ids)
+    first = np.full(count, np.iinfo(np.int64).max)
+    last = np.full(count, np.iinfo(np.int64).min)
+    np.minimum.at(first, frame.room_index, frame.timestamps)
+    np.maximum.at(last, frame.room_index, frame.timestamps)
+    seen = np.bincount(frame.room_index, minlength=count) > 0
+    return np.where(seen, (last - first) / 1000.0, 0.0)
+
+
+def distribution(seconds):
+    """API response-time distribution buckets"""
+    minutes = np.asarray(seconds) / 60
+    return {
+        "under_1_min": int(np.count_nonzero(minutes < 1)),
+        "1_5_min": int(np.count_nonzero((minutes >= 1) & (minutes < 5))),
+        "5_15_min": int(np.count_nonzero((minutes >= 5) & (minutes < 15))),
+        "over_15_min": int(np.count_nonzero(minutes >= 15)),
+    }
+
+
+def _round(value):
+    return round(float(value), 2) if value is not None and np.isfinite(value) else None
+
+
+def agent_stats(frame, room_agents, agent_ids=None):
+    """
+    Per-agent statistics for `agent_ids` (default: every agent in
+    `room_agents`, a room_id -> agent_id map).
+
+    `total_chats` counts the assigned rooms, `active_chats` those with
+    messages in the frame.  Returns {agent_id: stats}.
+    """
+    agents = list(agent_ids) if agent_ids is not None else sorted({a for a in room_agents.values() if a})
+    agent_pos = {a: i for i, a in enumerate(agents)}
+    room_agent = np.array([agent_pos.get(room_agents.get(r), -1) for r in frame.room_ids], dtype=np.int64)
+
+    customers, seconds, _ = response_times(frame)
+    rt_agent = room_agent[frame.room_index[customers]] if len(customers) else np.array([], dtype=np.int64)
+    firsts = first_response_times(frame)
+    durations = chat_durations(frame)
+    assigned = Counter(a for a in room_agents.values() if a)
+    msg_agent = room_agent[frame.room_index] if len(frame) else np.array([], dtype=np.int64)
+    sent = np.bincount(msg_agent[(frame.kinds == AGENT) & (msg_agent >= 0)], minlength=len(agents))
+
+    # Sort response times by agent once, then slice each agent's block
+    order = np.lexsort((seconds, rt_agent))
+    sorted_agents, sorted_seconds = rt_agent[order], seconds[order]
+    bounds = np.searchsorted(sorted_agents, np.arange(len(agents) + 1))
+
+    stats = {}
+    for i, agent_id in enumerate(agents):
+        own = sorted_seconds[bounds[i]:bounds[i + 1]]
+        agent_rooms = room_agent == i
+        own_firsts = firsts[agent_rooms]
+        own_firsts = own_firsts[~np.isnan(own_firsts)]
+        stats[agent_id] = {
+            "agent_id": agent_id,
+            "total_chats": assigned[agent_id],
+            "active_chats": int(np.count_nonzero(agent_rooms)),
+            "messages_sent": int(sent[i]),
+            "responses": int(len(own)),
+            "average_response_time_seconds": _round(own.mean()) if len(own) else None,
+            "median_response_time_seconds": _round(np.median(own)) if len(own) else None,
+            "p90_response_time_seconds": _round(np.percentile(own, 90)) if len(own) else None,
+            "average_first_response_time_seconds": _round(own_firsts.mean()) if len(own_firsts) else None,
+            "average_chat_duration_minutes": _round(durations[agent_rooms].mean() / 60) if agent_rooms.any() else None,
+            "response_time_distribution": distribution(own),
+        }
+    return stats
+
+
+def to_datetimes(millis):
+    """Naive UTC datetimes for an array of epoch milliseconds"""
+    return np.asarray(millis, dtype=np.int64).astype('datetime64[ms]').astype(object).tolist()
+
+
+def capped_response_times(frame, cap):
+    """
+    response_times() limited to the first `cap` customer messages of each
+    unanswered streak, matching what the live path keeps in
+    `awaiting_customer_ts`.
+    """
+    customers, seconds, replies = response_times(frame)
+    if not len(customers):
+        return customers, seconds, replies
+    # Customers are ordered, so each streak is a contiguous block sharing a reply
+    _, starts, inverse = np.unique(replies, return_index=True, return_inverse=True)
+    keep = np.arange(len(customers)) - starts[inverse] < cap
+    return customers[keep], seconds[keep], replies[keep]
+
+
+def room_fields(frame, cap):
+    """Room-level counters and first-response fields, keyed by room_id"""
+    count = len(frame.room_ids)
+    agent_msgs = np.bincount(frame.room_index[frame.kinds == AGENT], minlength=count)
+    customer_msgs = np.bincount(frame.room_index[frame.kinds == CUSTOMER], minlength=count)
+
+    customers, seconds, replies = capped_response_times(frame, cap)
+    response_rooms = frame.room_index[customers]
+    response_count = np.bincount(response_rooms, minlength=count)
+    response_sum = np.bincount(response_rooms, weights=seconds, minlength=count)
+
+    # Messages are ordered by room and time, so each room's first position is its first message
+    first_message = np.full(count, -1, dtype=np.int64)
+    rooms, first_idx = np.unique(frame.room_index, return_index=True)
+    first_message[rooms] = first_idx
+
+    first_customer = np.full(count, -1, dtype=np.int64)
+    customer_positions = np.flatnonzero(frame.kinds == CUSTOMER)
+    rooms, first_idx = np.unique(frame.room_index[customer_positions], return_index=True)
+    first_customer[rooms] = customer_positions[first_idx]
+    first_seconds = first_response_times(frame)
+    # The reply to a room's first customer message is its first response
+    customers_all, _, replies_all = response_times(frame)
+    first_reply = np.full(count, -1, dtype=np.int64)
+    is_first = first_customer[frame.room_index[customers_all]] == customers_all
+    first_reply[frame.room_index[customers_all[is_first]]] = replies_all[is_first]
+
+    # Customer messages after a room's last agent message are still awaiting a reply
+    last_agent = np.full(count, -1, dtype=np.int64)
+    agent_positions = np.flatnonzero(frame.kinds == AGENT)
+    np.maximum.at(last_agent, frame.room_index[agent_positions], agent_positions)
+    awaiting = customer_positions[customer_positions > last_agent[frame.room_index[customer_positions]]]
+
+    fields = {}
+    for i, room_id in enumerate(frame.room_ids):
+        has_customer = first_customer[i] >= 0
+        answered = first_reply[i] >= 0
+        fields[room_id] = {
+            'agent_message_count': int(agent_msgs[i]),
+            'customer_message_count': int(customer_msgs[i]),
+            'response_count': int(response_count[i]),
+            'response_time_sum': float(response_sum[i]),
+            'first_message_at': to_datetimes([frame.timestamps[first_message[i]]])[0] if first_message[i] >= 0 else None,
+            'first_customer_at': to_datetimes([frame.timestamps[first_customer[i]]])[0] if has_customer else None,
+            'first_response_at': to_datetimes([frame.timestamps[first_reply[i]]])[0] if answered else None,
+            'first_response_seconds': float(first_seconds[i]) if answered else None,
+            'awaiting_customer_ts': [],
+            'awaiting_customer_ids': [],
+        }
+    waiting_rooms = frame.room_index[awaiting]
+    for position, room, ts in zip(awaiting.tolist(), waiting_rooms.tolist(), to_datetimes(frame.timestamps[awaiting])):
+        room_doc = fields[frame.room_ids[room]]
+        if len(room_doc['awaiting_customer_ts']) < cap:
+            room_doc['awaiting_customer_ts'].append(ts)
+            room_doc['awaiting_customer_ids'].append(frame.message_ids[position])
+    return fields
+
+
+def room_day_rows(frame, cap):
+    """
+    Per (room_id, day) rollup data: message counts by sender kind, the
+    response times answered that day and the room's first response time
+    if it happened that day.  Days are naive UTC midnights.
+    """
+    if not len(frame):
+        return {}
+    days = frame.timestamps // DAY_MS
+    keys, inverse = np.unique(np.stack([frame.room_index, days], axis=1), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    agent_msgs = np.bincount(inverse, weights=frame.kinds == AGENT, minlength=len(keys))
+    customer_msgs = np.bincount(inverse, weights=frame.kinds == CUSTOMER, minlength=len(keys))
+
+    # Responses belong to the day of the agent reply
+    customers, seconds, replies = capped_response_times(frame, cap)
+    reply_keys = inverse[replies]
+    order = np.argsort(reply_keys, kind='stable')
+    reply_keys, seconds, customers = reply_keys[order], seconds[order], customers[order]
+    bounds = np.searchsorted(reply_keys, np.arange(len(keys) + 1))
+
+    first_seconds = first_response_times(frame)
+    first_customer = np.full(len(frame.room_ids), -1, dtype=np.int64)
+    customer_positions = np.flatnonzero(frame.kinds == CUSTOMER)
+    rooms, first_idx = np.unique(frame.room_index[customer_positions], return_index=True)
+    first_customer[rooms] = customer_positions[first_idx]
+
+    day_starts = to_datetimes(keys[:, 1] * DAY_MS)
+    rows = {}
+    for k, ((room, _), day) in enumerate(zip(keys.tolist(), day_starts)):
+        own = slice(bounds[k], bounds[k + 1])
+        is_first = customers[own] == first_customer[room]
+        rows[(frame.room_ids[room], day)] = {
+            'agent_messages': int(agent_msgs[k]),
+            'customer_messages': int(customer_msgs[k]),
+            'response_times': seconds[own].tolist(),
+            'first_response_time': float(first_seconds[room]) if is_first.any() else None,
+        }
+    return rows
@@ -0,0 +1,271 @@
+"""
+Background multi-room chat exports.
+
+Jobs are documents in the `export_jobs` collection.  The API queues them,
+`python manage.py run_export_jobs` claims and runs them, and the result is a
+compressed archive on local disk or S3 (settings.EXPORT_JOBS['STORAGE']):
+
+  - layout 'per_room': a .zip with one <format> file per room
+  - layout 'combined': a single gzipped NDJSON stream of every message
+
+A running job's `updated_at` is its heartbeat, refreshed at least every
+PROGRESS_INTERVAL seconds while messages stream.  Every write a worker
+makes is conditional on it still owning the job (`worker_id`), so a worker
+whose job was reclaimed as stale stops at its next heartbeat instead of
+finishing alongside the new owner.
+"""
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+from datetime import datetime, timedelta, timezone
+
+import boto3
+from django.conf import settings
+from pymongo import ReturnDocument
+
+from dashboard.exports import (
+    build_message_query, export_filename, iter_bytes, iter_export, iter_messages,
+)
+from wish_bot.db import get_export_job_collection, get_room_collection, insert_with_timestamps
+
+logger = logging.getLogger(__name__)
+
+LAYOUTS = ('per_room', 'combined')
+PROGRESS_INTERVAL = 2  # seconds between progress writes
+
+
+def _config(key, default=None):
+    return getattr(settings, 'EXPORT_JOBS', {}).get(key, default)
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def create_export_job(created_by, widget_ids=None, agent_id=None, start=None, end=None,
+                      fmt='ndjson', layout='per_room'):
+    """Queue an export job and return its document"""
+    job = {
+        'job_id': uuid.uuid4().hex,
+        'status': 'queued',
+        'created_by': created_by,
+        'filters': {
+            'widget_ids': widget_ids or [],
+            'agent_id': agent_id,
+            'start_date': start,
+            'end_date': end,
+        },
+        'format': 'ndjson' if layout == 'combined' else fmt,
+        'layout': layout,
+        'progress': {'rooms_total': 0, 'rooms_done': 0, 'messages_exported': 0},
+        'archive': None,
+        'error': None,
+    }
+    insert_with_timestamps(get_export_job_collection(), job)
+    return job
+
+
+def get_export_job(job_id):
+    return get_export_job_collection().find_one({'job_id': job_id}, {'_id': 0})
+
+
+def claim_next_job(worker_id):
+    """Atomically move the oldest queued (or stale running) job to running"""
+    stale_before = _now() - timedelta(seconds=_config('STALE_AFTER', 600))
+    now = _now()
+    return get_export_job_collection().find_one_and_update(
+        {'$or': [
+            {'status': 'queued'},
+            {'status': 'running', 'updated_at': {'$lt': stale_before}},
+        ]},
+        {'$set': {'status': 'running', 'worker_id': worker_id, 'started_at': now, 'updated_at': now}},
+        sort=[('created_at', 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+class JobReclaimed(Exception):
+    """The job was handed to another worker while this one was running it"""
+
+
+def _update_job(job_id, worker_id, fields):
+    """Update a job this worker is running; raises JobReclaimed if it no longer owns it"""
+    fields['updated_at'] = _now()
+    result = get_export_job_collection().update_one(
+        {'job_id': job_id, 'worker_id': worker_id, 'status': 'running'},
+        {'$set': fields}
+    )
+    if result.matched_count == 0:
+        raise JobReclaimed(job_id)
+
+
+def _room_query(filters):
+    query = {}
+    if filters.get('widget_ids'):
+        query['widget_id'] = {'$in': filters['widget_ids']}
+    if filters.get('agent_id'):
+        query['assigned_agent'] = filters['agent_id']
+    return query
+
+
+class _Progress:
+    """Throttled progress writer; also serves as the job heartbeat"""
+
+    def __init__(self, job_id, worker_id, rooms_total):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.rooms_total = rooms_total
+        self.rooms_done = 0
+        self.messages_exported = 0
+        self._last_write = 0
+
+    def count(self, messages):
+        # Heartbeat while streaming, so one large room cannot outlast STALE_AFTER
+        for message in messages:
+            self.messages_exported += 1
+            self.tick()
+            yield message
+
+    def room_done(self):
+        self.rooms_done += 1
+        self.tick()
+
+    def tick(self):
+        if time.monotonic() - self._last_write >= PROGRESS_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self._last_write = time.monotonic()
+        _update_job(self.job_id, self.worker_id, {'progress': {
+            'rooms_total': self.rooms_total,
+            'rooms_done': self.rooms_done,
+            'messages_exported': self.messages_exported,
+        }})
+
+
+def _room_messages(room_id, filters):
+    """Messages for one room, or None when the room has none in range"""
+    query = build_message_query(room_id=room_id, start=filters.get('start_date'), end=filters.get('end_date'))
+    cursor = iter_messages(query, batch_size=_config('BATCH_SIZE', 1000))
+    first = next(cursor, None)
+    if first is None:
+        return None
+    return itertools.chain([first], cursor)
+
+
+def _write_per_room(path, room_ids, job, progress):
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for room_id in room_ids:
+            messages = _room_messages(room_id, job['filters'])
+            if messages is not None:
+                with archive.open(export_filename(f"chat_{room_id}", job['format']), 'w') as member:
+                    for chunk in iter_bytes(iter_export(progress.count(messages), job['format'])):
+                        member.write(chunk)
+            progress.room_done()
+
+
+def _write_combined(path, room_ids, job, progress):
+    with open(path, 'wb') as output:
+        def chunks():
+            for room_id in room_ids:
+                messages = _room_messages(room_id, job['filters'])
+                if messages is not None:
+                    yield from iter_export(progress.count(messages), 'ndjson')
+                progress.room_done()
+
+        for data in iter_bytes(chunks(), compress=True):
+            output.write(data)
+
+
+def _store_archive(local_path, filename):
+    """Move the finished archive to its final storage; returns the `archive` field"""
+    size = os.path.getsize(local_path)
+    if _config('STORAGE', 'local') == 's3':
+        key = f"{_config('S3_PREFIX', 'exports/')}{filename}"
+        s3_client = boto3.client(
+            's3',
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            region_name=settings.AWS_S3_REGION_NAME
+        )
+        s3_client.upload_file(local_path, settings.AWS_STORAGE_BUCKET_NAME, key)
+        os.remove(local_path)
+        return {'storage': 's3', 'key': key, 'filename': filename, 'size': size}
+
+    export_dir = str(_config('LOCAL_DIR'))
+    os.makedirs(export_dir, exist_ok=True)
+    final_path = os.path.join(export_dir, filename)
+    shutil.move(local_path, final_path)
+    return {'storage': 'local', 'path': final_path, 'filename': filename, 'size': size}
+
+
+def run_export_job(job):
+    """Build the archive for a claimed job and record the outcome"""
+    job_id = job['job_id']
+    worker_id = job.get('worker_id')
+    try:
+        room_ids = [
+            room['room_id']
+            for room in get_room_collection().find(_room_query(job['filters']), {'room_id': 1}).sort('room_id', 1)
+        ]
+        progress = _Progress(job_id, worker_id, len(room_ids))
+        progress.flush()
+
+        if job['layout'] == 'combined':
+            filename = export_filename(f"export_{job_id}", 'ndjson', compress=True)
+            writer = _write_combined
+        else:
+            filename = f"export_{job_id}.zip"
+            writer = _write_per_room
+
+        fd, tmp_path = tempfile.mkstemp(suffix=f"-{filename}")
+        os.close(fd)
+        try:
+            writer(tmp_path, room_ids, job, progress)
+            progress.flush()  # still ours before publishing the archive
+            archive = _store_archive(tmp_path, filename)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        _update_job(job_id, worker_id, {
+            'status': 'completed',
+            'archive': archive,
+            'finished_at': _now(),
+            'progress': {
+                'rooms_total': progress.rooms_total,
+                'rooms_done': progress.rooms_done,
+                'messages_exported': progress.messages_exported,
+            },
+        })
+        logger.info(f"Export job {job_id} completed: {progress.rooms_done} rooms, {progress.messages_exported} messages")
+    except JobReclaimed:
+        logger.warning(f"Export job {job_id} was reclaimed by another worker; {worker_id} stopped")
+    except Exception as e:
+        logger.error(f"Export job {job_id} failed: {e}", exc_info=True)
+        try:
+            _update_job(job_id, worker_id, {'status': 'failed', 'error': str(e), 'finished_at': _now()})
+        except JobReclaimed:
+            pass
+
+
+def get_download_url(archive):
+    """Presigned URL for S3 archives (None for local ones)"""
+    if archive.get('storage') != 's3':
+        return None
+    s3_client = boto3.client(
+        's3',
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        region_name=settings.AWS_S3_REGION_NAME
+    )
+    return s3_client.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': archive['key']},
+        ExpiresIn=_config('DOWNLOAD_URL_EXPIRY', 3600),
+    )
@@ -0,0 +1,122 @@
+"""
+Streaming chat-history export.
+
+Messages are read from a batched Mongo cursor and encoded one row at a time,
+so memory stays flat no matter how large the room is.  The same generators
+back the HTTP export view and the background export jobs.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from wish_bot.db import get_chat_collection
+
+EXPORT_FORMATS = ('csv', 'ndjson', 'json')
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+CSV_HEADER = ['message_id', 'sender', 'text', 'timestamp']
+
+DEFAULT_BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+
+def build_message_query(room_id=None, room_ids=None, start=None, end=None):
+    query = {}
+    if room_id:
+        query['room_id'] = room_id
+    elif room_ids is not None:
+        query['room_id'] = {'$in': list(room_ids)}
+    date_q = {}
+    if start:
+        date_q['$gte'] = start
+    if end:
+        date_q['$lt'] = end
+    if date_q:
+        query['timestamp'] = date_q
+    return query
+
+
+def iter_messages(query, batch_size=DEFAULT_BATCH_SIZE, sort=(('timestamp', 1),)):
+    """Batched cursor over matching messages, oldest first"""
+    return get_chat_collection().find(query).sort(list(sort)).batch_size(batch_size)
+
+
+def serialize_message(message):
+    """Normalize a message document for export (string _id, ISO timestamp)"""
+    message['_id'] = str(message.get('_id', ''))
+    ts = message.get('timestamp')
+    message['timestamp'] = ts.isoformat() if isinstance(ts, datetime) else str(ts)
+    return message
+
+
+def iter_csv(messages):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for m in messages:
+        m = serialize_message(m)
+        writer.writerow([
+            m.get('message_id', ''),
+            m.get('sender', ''),
+            m.get('message', ''),
+            m.get('timestamp', ''),
+        ])
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson(messages):
+    for m in messages:
+        yield json.dumps(serialize_message(m), cls=DjangoJSONEncoder) + '\n'
+
+
+def iter_json(messages):
+    """A JSON array written incrementally"""
+    yield '['
+    separator = '\n'
+    for m in messages:
+        yield separator + json.dumps(serialize_message(m), indent=2, cls=DjangoJSONEncoder)
+        separator = ',\n'
+    yield '\n]\n'
+
+
+ENCODERS = {
+    'csv': iter_csv,
+    'ndjson': iter_ndjson,
+    'json': iter_json,
+}
+
+
+def iter_export(messages, fmt):
+    """Encoded text chunks for `messages` in the given export format"""
+    return ENCODERS[fmt](messages)
+
+
+def iter_bytes(chunks, compress=False):
+    """UTF-8 encode text chunks, optionally as a single gzip stream"""
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode('utf-8')
+        return
+
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_filename(name, fmt, compress=False):
+    return f"{name}.{fmt}.gz" if compress else f"{name}.{fmt}"
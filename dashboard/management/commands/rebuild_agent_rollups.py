@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.rollups import day_bucket, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute agent_daily_stats rollups and per-room response counters from raw messages. "
+        "Run once after deploying, then periodically (e.g. nightly with --days 2) to repair drift. "
+        "Only closed days are rebuilt; today's rollups are left to the live consumers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--agent', help="Only rebuild rooms assigned to this agent")
+        parser.add_argument('--start', help="First day to rebuild (YYYY-MM-DD)")
+        parser.add_argument('--end', help="Last day to rebuild, inclusive (YYYY-MM-DD)")
+        parser.add_argument('--days', type=int, help="Rebuild the last N days (overrides --start/--end)")
+
+    def handle(self, *args, **options):
+        start = end = None
+        try:
+            if options['start']:
+                start = datetime.strptime(options['start'], "%Y-%m-%d")
+            if options['end']:
+                end = datetime.strptime(options['end'], "%Y-%m-%d") + timedelta(days=1)
+        except ValueError:
+            raise CommandError("Dates must be in YYYY-MM-DD format")
+
+        if options['days']:
+            end = day_bucket(datetime.utcnow()) + timedelta(days=1)
+            start = end - timedelta(days=options['days'])
+
+        rooms = rebuild_rollups(agent_id=options['agent'], start=start, end=end)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rollups from {rooms} rooms"))
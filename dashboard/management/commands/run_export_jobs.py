@@ -0,0 +1,32 @@
+import os
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from dashboard.export_jobs import claim_next_job, run_export_job
+
+
+class Command(BaseCommand):
+    help = "Process queued chat export jobs. Runs until interrupted unless --once is given."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue and exit")
+
+    def handle(self, *args, **options):
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        poll_interval = getattr(settings, 'EXPORT_JOBS', {}).get('POLL_INTERVAL', 5)
+        self.stdout.write(f"Export worker {worker_id} started")
+
+        while True:
+            job = claim_next_job(worker_id)
+            if job:
+                self.stdout.write(f"Running export job {job['job_id']}")
+                run_export_job(job)
+                continue
+            if options['once']:
+                break
+            time.sleep(poll_interval)
+
+        self.stdout.write(self.style.SUCCESS("Export queue drained"))
@@ -0,0 +1,266 @@
+"""
+Per-agent, per-widget, per-day message rollups (`agent_daily_stats`).
+
+Every counter is additive, so the consumer can `$inc` a day's document as
+messages arrive and AgentAnalytics only has to sum a handful of documents
+for any date range.  Response times are kept as a histogram over
+RESPONSE_BUCKETS so distributions and medians can be derived without the
+raw samples.  `rebuild_rollups` recomputes everything from the messages
+collection (via the columnar analytics_engine) and is also the periodic
+repair job; it only replaces closed days, building them aside and swapping
+them in, so it can run while consumers are writing.
+
+Room-level counterparts (agent/customer message counts, response totals,
+first_message_at/first_customer_at/first_response_at) are denormalized
+onto the room document by the same write path.
+"""
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from pymongo import ReplaceOne, UpdateOne
+
+from wish_bot.db import MAX_AWAITING_RESPONSES, get_agent_rollup_collection, get_room_collection
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the response-time histogram buckets; the last
+# bucket is open-ended.  60/300/900 line up with the API's distribution.
+RESPONSE_BUCKETS = [10, 30, 60, 120, 300, 600, 900, 1800, 3600, 14400]
+
+# How long a message may be in flight between its timestamp and its room
+# update; rooms active within this window of a rebuild keep their counters
+REBUILD_GRACE = timedelta(minutes=5)
+
+
+def day_bucket(ts):
+    return datetime(ts.year, ts.month, ts.day)
+
+
+def bucket_index(seconds):
+    for i, upper in enumerate(RESPONSE_BUCKETS):
+        if seconds < upper:
+            return i
+    return len(RESPONSE_BUCKETS)
+
+
+def infer_sender_type(message):
+    """sender_type for a message, inferred for documents written before it existed"""
+    sender_type = message.get('sender_type')
+    if sender_type:
+        return sender_type
+    sender = message.get('sender') or ''
+    if sender == 'Wish-bot':
+        return 'bot'
+    if sender.startswith('user_'):
+        return 'customer'
+    return 'agent'
+
+
+def build_rollup_update(agent_messages=0, customer_messages=0, response_times=(), first_response_time=None):
+    """`$inc` document applied to an agent's daily rollup"""
+    inc = defaultdict(int)
+    if agent_messages:
+        inc['agent_messages'] += agent_messages
+    if customer_messages:
+        inc['customer_messages'] += customer_messages
+    for seconds in response_times:
+        inc['response_count'] += 1
+        inc['response_time_sum'] += seconds
+        inc[f'response_hist.{bucket_index(seconds)}'] += 1
+    if first_response_time is not None:
+        inc['first_response_count'] += 1
+        inc['first_response_time_sum'] += first_response_time
+    return {'$inc': dict(inc)}
+
+
+def rollup_filter(agent_id, widget_id, ts):
+    return {'agent_id': agent_id, 'widget_id': widget_id, 'day': day_bucket(ts)}
+
+
+def summarize_histogram(hist):
+    """API distribution buckets plus an interpolated median from a histogram"""
+    counts = [int(hist.get(str(i), 0)) for i in range(len(RESPONSE_BUCKETS) + 1)]
+    distribution = {"under_1_min": 0, "1_5_min": 0, "5_15_min": 0, "over_15_min": 0}
+    for i, count in enumerate(counts):
+        upper = RESPONSE_BUCKETS[i] if i < len(RESPONSE_BUCKETS) else None
+        if upper is not None and upper <= 60:
+            distribution["under_1_min"] += count
+        elif upper is not None and upper <= 300:
+            distribution["1_5_min"] += count
+        elif upper is not None and upper <= 900:
+            distribution["5_15_min"] += count
+        else:
+            distribution["over_15_min"] += count
+
+    total = sum(counts)
+    median = None
+    if total:
+        half, seen = total / 2, 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= half:
+                lower = RESPONSE_BUCKETS[i - 1] if i else 0
+                upper = RESPONSE_BUCKETS[i] if i < len(RESPONSE_BUCKETS) else lower
+                median = lower + (upper - lower) * (half - seen) / count
+                break
+            seen += count
+    return distribution, median
+
+
+def load_rollups(agent_id, start=None, end=None):
+    query = {'agent_id': agent_id}
+    day_q = {}
+    if start:
+        day_q['$gte'] = day_bucket(start)
+    if end:
+        day_q['$lt'] = end
+    if day_q:
+        query['day'] = day_q
+    # room_ids is only on documents written before it was dropped
+    projection = {'_id': 0, 'rebuild_id': 0, 'room_ids': 0}
+    return list(get_agent_rollup_collection().find(query, projection).sort('day', 1))
+
+
+def merge_rollups(rollups):
+    """Sum a list of rollup documents into one"""
+    merged = defaultdict(float)
+    hist = defaultdict(int)
+    for doc in rollups:
+        for field in ('agent_messages', 'customer_messages', 'response_count', 'response_time_sum',
+                      'first_response_count', 'first_response_time_sum'):
+            merged[field] += doc.get(field, 0)
+        for bucket, count in (doc.get('response_hist') or {}).items():
+            hist[bucket] += count
+    merged['response_hist'] = dict(hist)
+    return merged
+
+
+def _rebuild_batch(batch, staging, cutoff, start=None, end=None):
+    """
+    Replay one batch of rooms with a single columnar message load.
+
+    Rollup increments go to the `staging` collection.  Room counters are
+    only written to rooms with no message since `cutoff`; returns the
+    number of rooms whose counters were skipped because they were busy.
+    """
+    from dashboard.analytics_engine import MessageFrame, room_day_rows, room_fields
+
+    frame = MessageFrame.load([room['room_id'] for room in batch])
+    fields = room_fields(frame, MAX_AWAITING_RESPONSES)
+    rows = room_day_rows(frame, MAX_AWAITING_RESPONSES)
+    rooms_by_id = {room['room_id']: room for room in batch}
+    for room_id in rooms_by_id:
+        # Rooms without messages get their counters reset
+        fields.setdefault(room_id, {
+            'agent_message_count': 0, 'customer_message_count': 0, 'response_count': 0,
+            'response_time_sum': 0.0, 'first_message_at': None, 'first_customer_at': None, 'first_response_at': None,
+            'first_response_seconds': None, 'awaiting_customer_ts': [], 'awaiting_customer_ids': [],
+        })
+
+    # A room that took a message after the cutoff may have live $inc/$push
+    # updates the frame did not see, so its counters are left alone
+    idle = {'$or': [{'last_timestamp': {'$lt': cutoff}}, {'last_timestamp': None}]}
+    room_updates = [UpdateOne({'room_id': room_id, **idle}, {'$set': doc}) for room_id, doc in fields.items()]
+    rollup_updates = []
+    for (room_id, day), data in rows.items():
+        if (start and day < day_bucket(start)) or (end and day >= end):
+            continue
+        room = rooms_by_id[room_id]
+        update = build_rollup_update(
+            data['agent_messages'], data['customer_messages'],
+            data['response_times'], data['first_response_time']
+        )
+        rollup_updates.append(UpdateOne(
+            {'agent_id': room['assigned_agent'], 'widget_id': room.get('widget_id'), 'day': day},
+            update,
+            upsert=True
+        ))
+
+    skipped = 0
+    if room_updates:
+        result = get_room_collection().bulk_write(room_updates, ordered=False)
+        skipped = len(room_updates) - result.matched_count
+    if rollup_updates:
+        staging.bulk_write(rollup_updates, ordered=False)
+    return skipped
+
+
+def _swap_in_rollups(staging, rollup_query, rebuild_id, batch_size):
+    """
+    Replace the rollups matched by `rollup_query` with the staged ones.
+
+    Each staged document replaces its live counterpart in place, then live
+    documents in scope that the rebuild did not produce are deleted, so
+    readers never see a day missing or counted twice.
+    """
+    rollups = get_agent_rollup_collection()
+    replacements = []
+    for doc in staging.find({}, {'_id': 0}):
+        doc['rebuild_id'] = rebuild_id
+        key = {'agent_id': doc['agent_id'], 'widget_id': doc['widget_id'], 'day': doc['day']}
+        replacements.append(ReplaceOne(key, doc, upsert=True))
+        if len(replacements) >= batch_size:
+            rollups.bulk_write(replacements, ordered=False)
+            replacements = []
+    if replacements:
+        rollups.bulk_write(replacements, ordered=False)
+    rollups.delete_many({**rollup_query, 'rebuild_id': {'$ne': rebuild_id}})
+
+
+def rebuild_rollups(agent_id=None, start=None, end=None, batch_size=500):
+    """
+    Recompute rollups (and room-level counters) from raw messages.
+
+    Scoped to rooms assigned to `agent_id` when given; `start`/`end` limit
+    which days of rollups are replaced.  Only closed days are rebuilt (the
+    live consumer still `$inc`s today's documents), and rollups are built
+    in a staging collection and swapped in when complete.  Room counters of
+    rooms that took messages while the rebuild ran are left to the next
+    run.  Returns the number of rooms replayed.
+    """
+    started = datetime.utcnow()
+    cutoff = started - REBUILD_GRACE
+    closed = day_bucket(cutoff)
+    end = min(end, closed) if end else closed
+    if start and start >= end:
+        logger.info("No closed days to rebuild rollups for")
+        return 0
+
+    room_query = {'assigned_agent': agent_id} if agent_id else {'assigned_agent': {'$nin': [None, '']}}
+    if start:
+        # Only rooms with messages inside the window can contribute to it
+        room_query['$or'] = [{'last_timestamp': {'$gte': start}}, {'last_timestamp': None}]
+    rollup_query = {'agent_id': agent_id} if agent_id else {}
+    day_q = {'$lt': end}
+    if start:
+        day_q['$gte'] = day_bucket(start)
+    rollup_query['day'] = day_q
+
+    rooms = get_room_collection()
+    rebuild_id = uuid.uuid4().hex
+    staging = get_agent_rollup_collection().database[f"agent_daily_stats_rebuild_{rebuild_id}"]
+    staging.create_index([('agent_id', 1), ('widget_id', 1), ('day', 1)], unique=True)
+
+    replayed = skipped = 0
+    try:
+        batch = []
+        for room in rooms.find(room_query, {'room_id': 1, 'widget_id': 1, 'assigned_agent': 1}):
+            batch.append(room)
+            if len(batch) >= batch_size:
+                skipped += _rebuild_batch(batch, staging, cutoff, start, end)
+                replayed += len(batch)
+                batch = []
+        if batch:
+            skipped += _rebuild_batch(batch, staging, cutoff, start, end)
+            replayed += len(batch)
+
+        _swap_in_rollups(staging, rollup_query, rebuild_id, batch_size)
+    finally:
+        staging.drop()
+
+    logger.info(
+        f"Rebuilt agent rollups from {replayed} rooms up to {end:%Y-%m-%d}; "
+        f"{skipped} busy rooms kept their live counters"
+    )
+    return replayed
@@ -1,6 +1,8 @@
 from django.urls import path
 from . import views
 from .views import ContactListCreateView, ContactRetrieveUpdateDeleteView, DeactivateRoom, AgentAnalytics, ExportChatHistoryAPIView
+from .views import TeamLeaderboardAPIView
+from .views import ExportJobAPIView, ExportJobDetailAPIView, ExportJobDownloadAPIView
 from .views import AddAgentView,EditAgentAPIView,DeleteAgentAPIView,AgentDetailAPIView,AgentFeedbackList
 
 
@@ -22,8 +24,12 @@ urlpatterns = [
     path('deactivate-room/', DeactivateRoom.as_view(), name='deactivate-room'),
     # Agent Analytics URLs
     path('agent-analytics/<str:agent_name>/', AgentAnalytics.as_view(), name='agent-analytics'),
+    path('team-leaderboard/', TeamLeaderboardAPIView.as_view(), name='team-leaderboard'),
     # Export Chat History URL
     path('export-chat-history/', ExportChatHistoryAPIView.as_view(), name='export-chat-history'),
+    path('export-jobs/', ExportJobAPIView.as_view(), name='export-jobs'),
+    path('export-jobs/<str:job_id>/', ExportJobDetailAPIView.as_view(), name='export-job-detail'),
+    path('export-jobs/<str:job_id>/download/', ExportJobDownloadAPIView.as_view(), name='export-job-download'),
     
     # User Feedback URL
     path('user-feedback/', views.user_feedback, name='user-feedback'),
@@ -10,10 +10,11 @@ from django.http import JsonResponse
 from pymongo.errors import DuplicateKeyError
 from utils.random_id import generate_contact_id  # Import the contact ID generator
 from wish_bot.db import  get_admin_collection, get_contact_collection, get_shortcut_collection, get_tag_collection, get_widget_collection # Import the contacts collection
-import csv,io,json,uuid
+import json,uuid
 from datetime import datetime
 from pymongo.errors import PyMongoError  # Assuming PyMongo for MongoDB
-from django.http import HttpResponse
+import os
+from django.http import FileResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.utils.dateparse import parse_datetime
 from django.core.serializers.json import DjangoJSONEncoder
 from drf_yasg.utils import swagger_auto_schema
@@ -30,6 +31,13 @@ from pymongo import ASCENDING, DESCENDING
 from collections import defaultdict
 from rest_framework.decorators import api_view
 from  authentication.permissions import  IsSuperAdmin
+from chat.room_events import invalidate_admin_access, invalidate_room_context, invalidate_room_contexts
+from dashboard.exports import (
+    CONTENT_TYPES, EXPORT_FORMATS, build_message_query, export_filename, iter_bytes, iter_export, iter_messages,
+)
+from dashboard.export_jobs import LAYOUTS, create_export_job, get_download_url, get_export_job
+from utils import cache
+from utils.executor import iterate_blocking
 
 # Optional helper to get conversations collection
 def get_conversations_collection():
@@ -38,6 +46,11 @@ def get_conversations_collection():
     return db['conversations']
 
 
+def invalidate_agent_caches(agent_id, *families):
+    """Drop an agent's cached lookups after a write; a Redis failure is logged, not raised"""
+    for family in families:
+        cache.invalidate_after_write(family, agent_id)
+
 
 
 @jwt_required# ✅ ensure user is authenticated
@@ -46,10 +59,13 @@ def agent_list(request):
     try:
         agents_collection = get_admin_collection()
         organization = request.GET.get('organization')  # Get query param
+        widget_id = request.GET.get('widget_id')
 
         query = {'role': 'agent'}
         if organization:
             query['organization'] = organization
+        if widget_id:
+            query['assigned_widgets'] = widget_id  # multikey index
 
         # Fetch only users with role 'agent'
         agents = list(agents_collection.find(query, {
@@ -247,6 +263,17 @@ class EditAgentAPIView(APIView):
             if result.modified_count == 0:
                 return Response({'message': 'No changes made.'}, status=200)
 
+            if assigned_widgets is not None:
+                invalidate_agent_caches(agent_id, cache.agent_widgets)
+                invalidate_admin_access(agent_id)
+
+            if name:
+                # Live rooms cache the assigned agent's display name
+                assigned_rooms = get_room_collection().find(
+                    {'assigned_agent': agent_id, 'is_active': True}, {'room_id': 1}
+                )
+                invalidate_room_contexts(room['room_id'] for room in assigned_rooms)
+
             return Response({'message': 'Agent updated successfully.'}, status=200)
 
         except PyMongoError as e:
@@ -276,6 +303,8 @@ class DeleteAgentAPIView(APIView):
                 return Response({'detail': 'Agent not found.'}, status=404)
 
             agents_collection.delete_one({'admin_id': agent_id})
+            invalidate_agent_caches(agent_id, cache.agent_widgets, cache.superadmin)
+            invalidate_admin_access(agent_id)
             logger.info(f"🗑️ Agent {agent_id} deleted successfully by {request.user.get('email', 'unknown user')}"      )
             return Response({'message': f"Agent {agent_id} deleted successfully by {request.user.get('email')}"}, status=200)
         except PyMongoError as e:
@@ -445,6 +474,7 @@ class AssignAgentToRoom(APIView):
                 {"room_id": room_id},
                 {"$set": {"assigned_agent": agent_name}}
             )
+            invalidate_room_context(room_id)
 
             return Response(
                 {"message": f"Agent '{agent_name}' assigned to room '{room_id}'"},
@@ -476,8 +506,22 @@ from wish_bot.db import (
     get_admin_collection,
     get_trigger_collection,
     get_contact_collection,
+    reset_room_unread,
 )
+from utils.pagination import InvalidCursor, build_page, keyset_query, paginate, parse_limit
 from utils.redis_client import redis_client
+from utils.room_index import get_unread_sync, reset_unread_sync
+
+
+def get_assigned_widgets(admin_id):
+    """Widgets assigned to an agent, read through the shared agent_widgets cache"""
+    def load():
+        record = get_admin_collection().find_one({'admin_id': admin_id}, {'assigned_widgets': 1})
+        widgets = record.get('assigned_widgets', []) if record else []
+        return [widgets] if isinstance(widgets, str) else widgets
+
+    return cache.agent_widgets.get_sync(admin_id, load)
+
 @jwt_required
 def conversation_list(request):
     """Conversation list with pagination and limited contact info"""
@@ -487,30 +531,33 @@ def conversation_list(request):
         admin_id = user.get('admin_id')
 
         # Pagination params
-        page = int(request.GET.get("page", 1))
-        page_size = int(request.GET.get("page_size", 20))
-        skip = (page - 1) * page_size
+        page_size = parse_limit(request.GET.get("page_size"), default=20)
+        cursor = request.GET.get("cursor")
 
         assigned_widgets = []
         if role == 'agent':
-            user_record = get_admin_collection().find_one({'admin_id': admin_id})
-            if user_record:
-                assigned_widgets = user_record.get('assigned_widgets', [])
-                if isinstance(assigned_widgets, str):
-                    assigned_widgets = [assigned_widgets]
+            assigned_widgets = get_assigned_widgets(admin_id)
 
         room_collection = get_room_collection()
 
-        pipeline = []
-
         # Role-based filter
-        if role == 'agent':
-            pipeline.append({
-                "$match": {"widget_id": {"$in": assigned_widgets}}
-            })
+        room_filter = {"widget_id": {"$in": assigned_widgets}} if role == 'agent' else {}
+
+        # Last message and unread count are denormalized onto the room, so the
+        # page is picked from the (widget_id, last_timestamp, _id) index before any join
+        try:
+            match, sort = keyset_query(room_filter, "last_timestamp", cursor)
+        except InvalidCursor as e:
+            return JsonResponse({"error": str(e), "rooms": []}, status=400)
 
-        pipeline += [
-            {"$sort": {"created_at": -1}},  # Sort by created_at descending
+        pipeline = [
+            {"$match": match},
+
+            # Sort by last message timestamp (latest first)
+            {"$sort": dict(sort)},
+
+            # Pagination
+            {"$limit": page_size + 1},
 
             # Join widget info
             {
@@ -533,53 +580,6 @@ def conversation_list(request):
                 }
             },
             {"$unwind": {"path": "$contact", "preserveNullAndEmptyArrays": True}},
-            
-            # ✅ Lookup for last message only (Fixed with timestamp type handling)
-            {
-                "$lookup": {
-                    "from": "messages",
-                    "let": {"roomId": "$room_id"},
-                    "pipeline": [
-                        {
-                            "$match": {
-                                "$expr": {"$eq": ["$room_id", "$$roomId"]}
-                            }
-                        },
-                        {
-                            # ✅ Convert timestamp string to date if needed
-                            "$addFields": {
-                                "ts": {
-                                    "$cond": {
-                                        "if": {"$eq": [{"$type": "$timestamp"}, "string"]},
-                                        "then": {"$toDate": "$timestamp"},
-                                        "else": "$timestamp"
-                                    }
-                                }
-                            }
-                        },
-                        {"$sort": {"ts": -1}},  # ✅ Sort properly by converted timestamp
-                        {"$limit": 1},
-                        {
-                            "$project": {
-                                "_id": 0,
-                                "message": 1,
-                                "sender": 1,        # 👈 include who sent it
-                                "ts": 1
-                            }
-                        }
-                    ],
-                    "as": "last_message"
-                }
-            },
-            {"$unwind": {"path": "$last_message", "preserveNullAndEmptyArrays": True}},
-            {
-                "$addFields": {
-                    "last_message": "$last_message.message",
-                    "last_sender": "$last_message.sender",
-                    "last_timestamp": "$last_message.ts"
-                }
-            },
-
 
             # Lookup agent details
             {
@@ -595,7 +595,6 @@ def conversation_list(request):
             # Project fields for response
             {
                 "$project": {
-                    "_id": 0,
                     "room_id": 1,
                     "contact_id": 1,
                     "assigned_agent": 1,
@@ -610,6 +609,8 @@ def conversation_list(request):
                     "last_message": 1,
                     "last_sender": 1,
                     "last_timestamp": 1,
+                    "message_count": 1,
+                    "unread_count": 1,
                     "widget": {
                         "widget_id": "$widget.widget_id",
                         "name": "$widget.name",
@@ -630,24 +631,18 @@ def conversation_list(request):
                         "email": "$contact.email"
                     }
                 }
-            },
-
-            # Sort by last message timestamp (latest first)
-            {"$sort": {"last_timestamp": -1}},
-
-            # Pagination
-            {"$skip": skip},
-            {"$limit": page_size}
+            }
         ]
 
         # Execute pipeline
-        results = list(room_collection.aggregate(pipeline))
+        results, next_cursor = build_page(
+            list(room_collection.aggregate(pipeline)), "last_timestamp", page_size, strip_id=True
+        )
 
-        # Add unread counts and typing users from Redis
+        # Add typing users from Redis
         for room in results:
             room_id = room['room_id']
-            unread_key = f'unread:{room_id}'
-            room['unread_count'] = int(redis_client.get(unread_key) or 0)
+            room['unread_count'] = int(room.get('unread_count') or 0)
 
             typing_key = f'typing:{room_id}:*'
             typing_users = []
@@ -669,16 +664,13 @@ def conversation_list(request):
                 room["widget"]["created_at"] = room["widget"]["created_at"].isoformat()
 
         # Total count for pagination
-        total_count = room_collection.count_documents(
-            {"widget_id": {"$in": assigned_widgets}} if role == "agent" else {}
-        )
+        total_count = room_collection.count_documents(room_filter)
 
         return JsonResponse({
             "rooms": results,
             "total_count": total_count,
-            "page": page,
             "page_size": page_size,
-            "total_pages": (total_count + page_size - 1) // page_size
+            "next_cursor": next_cursor
         }, status=200)
 
     except Exception as e:
@@ -719,8 +711,7 @@ def chat_room_view(request, room_id):  # Changed from enhanced_chat_room_view
 
         # Agent access check
         if role == "agent":
-            agent = agents_collection.find_one({"admin_id": admin_id})
-            assigned_widgets = agent.get("assigned_widgets", []) if agent else []
+            assigned_widgets = get_assigned_widgets(admin_id)
 
             if widget_id not in assigned_widgets:
                 return JsonResponse({
@@ -751,12 +742,12 @@ def chat_room_view(request, room_id):  # Changed from enhanced_chat_room_view
                 }
 
         # Get unread count and reset it if agent is viewing
-        unread_key = f'unread:{room_id}'
-        unread_count = int(redis_client.get(unread_key) or 0)
+        unread_count = get_unread_sync(widget_id, room_id)
         
         # Reset unread count when agent views the room
         if role == 'agent':
-            redis_client.delete(unread_key)
+            reset_unread_sync(widget_id, room_id)
+            reset_room_unread(room_id)
 
         # Get typing status
         typing_key = f'typing:{room_id}:*'
@@ -975,8 +966,8 @@ def contact_list_api(request):
 
         # Get query parameters
         widget_id = request.GET.get('widget_id')
-        limit = int(request.GET.get('limit', 50))
-        offset = int(request.GET.get('offset', 0))
+        limit = parse_limit(request.GET.get('limit'))
+        cursor = request.GET.get('cursor')
 
         contact_collection = get_contact_collection()
         
@@ -985,8 +976,7 @@ def contact_list_api(request):
         
         # Role-based access control
         if role == 'agent':
-            agent = get_admin_collection().find_one({'admin_id': admin_id})
-            assigned_widgets = agent.get('assigned_widgets', []) if agent else []
+            assigned_widgets = get_assigned_widgets(admin_id)
             
             if widget_id:
                 if widget_id not in assigned_widgets:
@@ -1003,11 +993,14 @@ def contact_list_api(request):
         # Get total count
         total_count = contact_collection.count_documents(contact_filter)
 
-        # Fetch contacts with pagination
-        contacts = list(contact_collection.find(
-            contact_filter,
-            {'_id': 0}
-        ).sort('created_at', DESCENDING).skip(offset).limit(limit))
+        # Fetch contacts with keyset pagination
+        try:
+            contacts, next_cursor = paginate(
+                contact_collection, contact_filter, 'created_at', limit,
+                cursor=cursor, projection={'_id': 0}
+            )
+        except InvalidCursor as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
 
         # Format datetime fields
         for contact in contacts:
@@ -1020,8 +1013,8 @@ def contact_list_api(request):
             'contacts': contacts,
             'total_count': total_count,
             'returned_count': len(contacts),
-            'offset': offset,
-            'limit': limit
+            'limit': limit,
+            'next_cursor': next_cursor
         })
 
     except Exception as e:
@@ -1046,8 +1039,7 @@ def room_stats_api(request):
         # Build base filter for role-based access
         base_filter = {}
         if role == 'agent':
-            agent = get_admin_collection().find_one({'admin_id': admin_id})
-            assigned_widgets = agent.get('assigned_widgets', []) if agent else []
+            assigned_widgets = get_assigned_widgets(admin_id)
             base_filter['widget_id'] = {'$in': assigned_widgets}
 
         # Get basic counts
@@ -1065,10 +1057,11 @@ def room_stats_api(request):
         total_messages = chat_collection.count_documents({'room_id': {'$in': room_ids}})
 
         # Get total unread count across accessible rooms
-        total_unread = 0
-        for room in room_collection.find({**base_filter, 'is_active': True}):
-            unread_key = f'unread:{room["room_id"]}'
-            total_unread += int(redis_client.get(unread_key) or 0)
+        unread_totals = list(room_collection.aggregate([
+            {'$match': {**base_filter, 'is_active': True}},
+            {'$group': {'_id': None, 'total': {'$sum': '$unread_count'}}}
+        ]))
+        total_unread = unread_totals[0]['total'] if unread_totals else 0
 
         # Get agent assignment stats
         assigned_rooms = room_collection.count_documents({
@@ -1109,16 +1102,14 @@ def mark_messages_seen_api(request, room_id):
         user = request.jwt_user
         role = user.get('role')
         admin_id = user.get('admin_id')
+        room = get_room_collection().find_one({'room_id': room_id}, {'widget_id': 1})
 
         # Role-based access check
         if role == 'agent':
-            room_collection = get_room_collection()
-            room = room_collection.find_one({'room_id': room_id})
             if not room:
                 return JsonResponse({'error': 'Room not found'}, status=404)
 
-            agent = get_admin_collection().find_one({'admin_id': admin_id})
-            assigned_widgets = agent.get('assigned_widgets', []) if agent else []
+            assigned_widgets = get_assigned_widgets(admin_id)
             
             if room.get('widget_id') not in assigned_widgets:
                 return JsonResponse({'error': 'Access denied'}, status=403)
@@ -1131,8 +1122,8 @@ def mark_messages_seen_api(request, room_id):
         )
 
         # Reset unread count
-        unread_key = f'unread:{room_id}'
-        redis_client.delete(unread_key)
+        reset_unread_sync(room.get('widget_id') if room else None, room_id)
+        reset_room_unread(room_id)
 
         return JsonResponse({
             'success': True,
@@ -1162,10 +1153,7 @@ def widget_conversations(request, widget_id):
 
         # 🔍 Dynamically fetch assigned widgets for agents
         if role == 'agent':
-            user_record = get_admin_collection().find_one({'admin_id': admin_id})
-            assigned_widgets = user_record.get('assigned_widgets', []) if user_record else []
-            if isinstance(assigned_widgets, str):
-                assigned_widgets = [assigned_widgets]
+            assigned_widgets = get_assigned_widgets(admin_id)
 
             if widget_id not in assigned_widgets:
                 return JsonResponse({"error": "Access denied for this widget"}, status=403)
@@ -1259,10 +1247,7 @@ def get_shortcuts_by_widget(request, widget_id):
 
         # Access control for agents
         if role == 'agent':
-            user_record = get_admin_collection().find_one({'admin_id': admin_id})
-            assigned_widgets = user_record.get('assigned_widgets', []) if user_record else []
-            if isinstance(assigned_widgets, str):
-                assigned_widgets = [assigned_widgets]
+            assigned_widgets = get_assigned_widgets(admin_id)
             if widget_id not in assigned_widgets:
                 return JsonResponse({"error": "Access denied for this widget"}, status=403)
 
@@ -1281,10 +1266,7 @@ def get_tags_by_widget(request, widget_id):
         admin_id = user.get('admin_id')
 
         if role == 'agent':
-            user_record = get_admin_collection().find_one({'admin_id': admin_id})
-            assigned_widgets = user_record.get('assigned_widgets', []) if user_record else []
-            if isinstance(assigned_widgets, str):
-                assigned_widgets = [assigned_widgets]
+            assigned_widgets = get_assigned_widgets(admin_id)
             if widget_id not in assigned_widgets:
                 return JsonResponse({"error": "Access denied for this widget"}, status=403)
 
@@ -1306,10 +1288,7 @@ def get_triggers_by_widget(request, widget_id):
         admin_id = user.get('admin_id')
 
         if role == 'agent':
-            user_record = get_admin_collection().find_one({'admin_id': admin_id})
-            assigned_widgets = user_record.get('assigned_widgets', []) if user_record else []
-            if isinstance(assigned_widgets, str):
-                assigned_widgets = [assigned_widgets]
+            assigned_widgets = get_assigned_widgets(admin_id)
             if widget_id not in assigned_widgets:
                 return JsonResponse({"error": "Access denied for this widget"}, status=403)
 
@@ -1565,6 +1544,7 @@ class DeactivateRoom(APIView):
             {"room_id": room_id},
             {"$set": {"active": False, "archived_at": datetime.utcnow()}}  # Add archive timestamp too
         )
+        invalidate_room_context(room_id)
 
         return Response({"message": f"Room '{room_id}' deactivated and archived."}, status=status.HTTP_200_OK)
     
@@ -1653,7 +1633,14 @@ from collections import defaultdict
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-import statistics
+from dashboard.analytics_engine import MessageFrame, agent_stats
+from dashboard.rollups import infer_sender_type, load_rollups, merge_rollups, summarize_histogram
+
+ROOM_ANALYTICS_PROJECTION = {
+    "_id": 0, "room_id": 1, "created_at": 1, "closed_at": 1, "session_history": 1, "user_feedback": 1,
+    "message_count": 1, "first_message_at": 1, "last_timestamp": 1, "agent_message_count": 1, "customer_message_count": 1,
+    "response_count": 1, "response_time_sum": 1, "first_response_seconds": 1,
+}
 
 class AgentAnalytics(APIView):
     permission_classes = [IsSuperAdmin]
@@ -1662,12 +1649,22 @@ class AgentAnalytics(APIView):
     Get comprehensive analytics for a specific agent, including chat history, 
     response times, session data, and feedback.
     Supports optional filters for date range, preview messages, grouping by day/week, and rating.
+
+    Message-derived numbers come from the agent_daily_stats rollups and the
+    counters denormalized on each room, so no messages are loaded (except
+    for previews when include_preview=true).
+
+    The date range selects two things: chat_history and the chat/session
+    counts cover rooms *created* in the range, while the rollup totals
+    (response times, their distribution and median, total_messages_sent)
+    cover messages *sent* in the range in any of the agent's rooms.  With
+    group_by, messages_sent and average_response_time_seconds are per
+    message day and the chat counts per room creation day.
     """
     
     def get(self, request, agent_name):
         try:
             chat_rooms = get_room_collection()
-            messages = get_chat_collection()
 
             # Optional Query Params
             start_date = request.GET.get('start_date')
@@ -1707,28 +1704,20 @@ class AgentAnalytics(APIView):
             if date_filter:
                 room_filter["created_at"] = date_filter.copy()
 
-            rooms = list(chat_rooms.find(room_filter))
-
-            if not rooms:
-                return self._empty_response(agent_name)
-
-            room_ids = [room["room_id"] for room in rooms]
+            rooms = list(chat_rooms.find(room_filter, ROOM_ANALYTICS_PROJECTION))
 
-            # Step 2: Get messages for these rooms
-            message_filter = {"room_id": {"$in": room_ids}}
-            
-            # Apply date filter to messages if provided
-            if date_filter:
-                message_filter["timestamp"] = date_filter.copy()
+            # Step 2: Load the agent's daily rollups (messages sent in the date range)
+            rollups = load_rollups(agent_name, date_filter.get("$gte"), date_filter.get("$lt"))
 
-            all_messages = list(messages.find(message_filter).sort("timestamp", 1))
+            if not rooms and not rollups:
+                return self._empty_response(agent_name)
 
             # Step 3: Process analytics
-            analytics_data = self._process_analytics(rooms, all_messages, rating_filter, include_preview)
+            analytics_data = self._process_analytics(agent_name, rooms, rollups, rating_filter, include_preview)
 
             # Step 4: Group stats if requested
             if group_by in ["day", "week"]:
-                return self._get_grouped_stats(analytics_data, group_by, agent_name)
+                return self._get_grouped_stats(analytics_data, rollups, group_by, agent_name)
 
             return Response(analytics_data, status=200)
 
@@ -1763,46 +1752,27 @@ class AgentAnalytics(APIView):
             "chat_history": [],
         }, status=200)
 
-    def _process_analytics(self, rooms, all_messages, rating_filter, include_preview):
+    def _process_analytics(self, agent_name, rooms, rollups, rating_filter, include_preview):
         """Process analytics data for the agent"""
-        
-        # Group messages by room
-        messages_by_room = defaultdict(list)
-        for msg in all_messages:
-            messages_by_room[msg["room_id"]].append(msg)
-
         chat_history = []
-        response_times = []
-        first_response_times = []
-        agent_message_count = 0
         total_session_duration = 0
         total_chat_duration = 0
         feedback_data = []
 
         for room in rooms:
             room_id = room["room_id"]
-            msgs = messages_by_room.get(room_id, [])
-            
-            if not msgs:
+            if not room.get("message_count") or not room.get("last_timestamp"):
                 continue
 
-            # Calculate response times
-            room_response_times = self._calculate_response_times(msgs)
-            first_response_time = self._calculate_first_response_time(msgs)
-            
-            if room_response_times:
-                response_times.extend(room_response_times)
-            if first_response_time:
-                first_response_times.append(first_response_time)
+            first_response_time = room.get("first_response_seconds")
+            response_count = room.get("response_count", 0)
 
-            # Calculate chat duration (first to last message)
-            chat_duration = (msgs[-1]["timestamp"] - msgs[0]["timestamp"]).total_seconds() / 60
+            # Chat duration (first to last message); rooms not yet backfilled by
+            # rebuild_agent_rollups fall back to the room's creation time
+            first_message_at = room.get("first_message_at") or room["created_at"]
+            chat_duration = (room["last_timestamp"] - first_message_at).total_seconds() / 60
             total_chat_duration += chat_duration
 
-            # Count agent messages
-            agent_messages = [m for m in msgs if m.get("sender_type") == "agent"]
-            agent_message_count += len(agent_messages)
-
             # Calculate session duration from session history
             session_duration = self._calculate_session_duration(room)
             total_session_duration += session_duration
@@ -1835,12 +1805,12 @@ class AgentAnalytics(APIView):
                 "room_id": room_id,
                 "created_at": room["created_at"].isoformat(),
                 "closed_at": room.get("closed_at").isoformat() if room.get("closed_at") else None,
-                "last_message_time": msgs[-1]["timestamp"].isoformat(),
-                "total_messages": len(msgs),
-                "agent_messages": len(agent_messages),
-                "customer_messages": len([m for m in msgs if m.get("sender_type") == "customer"]),
+                "last_message_time": room["last_timestamp"].isoformat(),
+                "total_messages": room["message_count"],
+                "agent_messages": room.get("agent_message_count", 0),
+                "customer_messages": room.get("customer_message_count", 0),
                 "first_response_time_seconds": first_response_time,
-                "average_response_time_seconds": sum(room_response_times) / len(room_response_times) if room_response_times else None,
+                "average_response_time_seconds": room.get("response_time_sum", 0) / response_count if response_count else None,
                 "chat_duration_minutes": chat_duration,
                 "session_duration_minutes": session_duration,
                 "is_active": room.get("closed_at") is None,
@@ -1851,10 +1821,7 @@ class AgentAnalytics(APIView):
             }
 
             if include_preview:
-                history_item["preview"] = {
-                    "first": f"{msgs[0].get('sender_type', 'unknown')}: {msgs[0].get('message', '')[:100]}",
-                    "last": f"{msgs[-1].get('sender_type', 'unknown')}: {msgs[-1].get('message', '')[:100]}"
-                }
+                history_item["preview"] = self._get_preview(room_id)
 
             chat_history.append(history_item)
 
@@ -1863,12 +1830,12 @@ class AgentAnalytics(APIView):
         completed_sessions = len(chat_history) - active_sessions
         
         # Response time statistics
-        avg_response_time = sum(response_times) / len(response_times) if response_times else None
-        avg_first_response_time = sum(first_response_times) / len(first_response_times) if first_response_times else None
-        median_response_time = statistics.median(response_times) if response_times else None
-        
-        # Response time distribution
-        response_time_distribution = self._calculate_response_time_distribution(response_times)
+        totals = merge_rollups(rollups)
+        avg_response_time = totals["response_time_sum"] / totals["response_count"] if totals["response_count"] else None
+        avg_first_response_time = (
+            totals["first_response_time_sum"] / totals["first_response_count"] if totals["first_response_count"] else None
+        )
+        response_time_distribution, median_response_time = summarize_histogram(totals["response_hist"])
         
         # Session statistics
         avg_session_duration = total_session_duration / len(chat_history) if chat_history else None
@@ -1878,14 +1845,14 @@ class AgentAnalytics(APIView):
         feedback_summary = self._calculate_feedback_summary(feedback_data)
 
         return {
-            "agent_name": room["assigned_agent"] if rooms else "Unknown",
+            "agent_name": agent_name,
             "total_chats_handled": len(chat_history),
             "active_chat_sessions": active_sessions,
             "completed_chat_sessions": completed_sessions,
             "average_response_time_seconds": round(avg_response_time, 2) if avg_response_time else None,
             "average_first_response_time_seconds": round(avg_first_response_time, 2) if avg_first_response_time else None,
             "median_response_time_seconds": round(median_response_time, 2) if median_response_time else None,
-            "total_messages_sent": agent_message_count,
+            "total_messages_sent": int(totals["agent_messages"]),
             "total_session_duration_minutes": round(total_session_duration, 2),
             "average_session_duration_minutes": round(avg_session_duration, 2) if avg_session_duration else None,
             "average_chat_duration_minutes": round(avg_chat_duration, 2) if avg_chat_duration else None,
@@ -1894,41 +1861,16 @@ class AgentAnalytics(APIView):
             "chat_history": chat_history,
         }
 
-    def _calculate_response_times(self, msgs):
-        """Calculate response times for agent messages"""
-        response_times = []
-        
-        for i in range(len(msgs) - 1):
-            current_msg = msgs[i]
-            
-            # If current message is from customer
-            if current_msg.get("sender_type") == "customer":
-                # Find next agent response
-                for j in range(i + 1, len(msgs)):
-                    next_msg = msgs[j]
-                    if next_msg.get("sender_type") == "agent":
-                        response_time = (next_msg["timestamp"] - current_msg["timestamp"]).total_seconds()
-                        response_times.append(response_time)
-                        break
-        
-        return response_times
-
-    def _calculate_first_response_time(self, msgs):
-        """Calculate first response time (first customer message to first agent response)"""
-        first_customer_msg = None
-        first_agent_response = None
-        
-        for msg in msgs:
-            if msg.get("sender_type") == "customer" and first_customer_msg is None:
-                first_customer_msg = msg
-            elif msg.get("sender_type") == "agent" and first_customer_msg and first_agent_response is None:
-                first_agent_response = msg
-                break
-        
-        if first_customer_msg and first_agent_response:
-            return (first_agent_response["timestamp"] - first_customer_msg["timestamp"]).total_seconds()
-        
-        return None
+    def _get_preview(self, room_id):
+        """First and last message of a room (two indexed lookups)"""
+        messages = get_chat_collection()
+        projection = {"_id": 0, "message": 1, "sender": 1, "sender_type": 1}
+        first = messages.find_one({"room_id": room_id}, projection, sort=[("timestamp", 1)]) or {}
+        last = messages.find_one({"room_id": room_id}, projection, sort=[("timestamp", -1)]) or {}
+        return {
+            "first": f"{infer_sender_type(first)}: {first.get('message', '')[:100]}",
+            "last": f"{infer_sender_type(last)}: {last.get('message', '')[:100]}"
+        }
 
     def _calculate_session_duration(self, room):
         """Calculate total session duration from session history"""
@@ -1942,28 +1884,6 @@ class AgentAnalytics(APIView):
         
         return total_duration
 
-    def _calculate_response_time_distribution(self, response_times):
-        """Calculate response time distribution"""
-        distribution = {
-            "under_1_min": 0,
-            "1_5_min": 0,
-            "5_15_min": 0,
-            "over_15_min": 0
-        }
-        
-        for rt in response_times:
-            rt_minutes = rt / 60
-            if rt_minutes < 1:
-                distribution["under_1_min"] += 1
-            elif rt_minutes < 5:
-                distribution["1_5_min"] += 1
-            elif rt_minutes < 15:
-                distribution["5_15_min"] += 1
-            else:
-                distribution["over_15_min"] += 1
-        
-        return distribution
-
     def _calculate_feedback_summary(self, feedback_data):
         """Calculate feedback summary statistics"""
         total_ratings = len(feedback_data)
@@ -1988,20 +1908,26 @@ class AgentAnalytics(APIView):
             "rating_distribution": rating_distribution
         }
 
-    def _get_grouped_stats(self, analytics_data, group_by, agent_name):
+    def _get_grouped_stats(self, analytics_data, rollups, group_by, agent_name):
         """Return grouped statistics by day or week"""
+        period_format = "%Y-%m-%d" if group_by == "day" else "%Y-W%U"
         grouped = defaultdict(list)
         
         for item in analytics_data["chat_history"]:
             key_date = datetime.fromisoformat(item["created_at"])
-            if group_by == "day":
-                key = key_date.strftime("%Y-%m-%d")
-            else:  # week
-                key = key_date.strftime("%Y-W%U")
-            grouped[key].append(item)
+            grouped[key_date.strftime(period_format)].append(item)
+
+        # Message activity per period comes straight from the daily rollups
+        rollups_by_period = defaultdict(list)
+        for doc in rollups:
+            rollups_by_period[doc["day"].strftime(period_format)].append(doc)
 
         grouped_stats = []
-        for key, items in sorted(grouped.items()):
+        for key in sorted(set(grouped) | set(rollups_by_period)):
+            items = grouped.get(key, [])
+            totals = merge_rollups(rollups_by_period.get(key, []))
+            avg_response = totals["response_time_sum"] / totals["response_count"] if totals["response_count"] else None
+
             # Calculate aggregated stats for this period
             total_chats = len(items)
             active_chats = sum(1 for item in items if item["is_active"])
@@ -2026,7 +1952,9 @@ class AgentAnalytics(APIView):
                 "average_first_response_time_seconds": round(avg_first_response, 2) if avg_first_response else None,
                 "average_session_duration_minutes": round(avg_session_duration, 2) if avg_session_duration else None,
                 "average_rating": round(avg_rating, 2) if avg_rating else None,
-                "total_ratings": len(ratings)
+                "total_ratings": len(ratings),
+                "messages_sent": int(totals["agent_messages"]),
+                "average_response_time_seconds": round(avg_response, 2) if avg_response else None
             })
 
         return Response({
@@ -2037,20 +1965,108 @@ class AgentAnalytics(APIView):
         }, status=200)
 
 
+# Leaderboard metrics: ascending for times, descending for volume
+LEADERBOARD_SORTS = {
+    "average_response_time_seconds": False,
+    "median_response_time_seconds": False,
+    "p90_response_time_seconds": False,
+    "average_first_response_time_seconds": False,
+    "messages_sent": True,
+    "total_chats": True,
+}
+
+class TeamLeaderboardAPIView(APIView):
+    permission_classes = [IsSuperAdmin]
+    authentication_classes = [JWTAuthentication]
+    """
+    Rank agents by response-time and volume metrics over a date range.
+    Query params:
+      - agent_ids  (optional, comma separated admin_ids; default all agents)
+      - start_date (optional, YYYY-MM-DD; default 30 days ago)
+      - end_date   (optional, YYYY-MM-DD, inclusive)
+      - sort_by    (optional, one of LEADERBOARD_SORTS; default average_response_time_seconds)
+
+    All agents' messages are loaded into one columnar frame and the stats are
+    computed together (see dashboard.analytics_engine).
+    """
+
+    def get(self, request):
+        try:
+            sort_by = request.GET.get("sort_by", "average_response_time_seconds")
+            if sort_by not in LEADERBOARD_SORTS:
+                return Response({"error": f"sort_by must be one of {', '.join(LEADERBOARD_SORTS)}"}, status=400)
+
+            try:
+                end = datetime.strptime(request.GET["end_date"], "%Y-%m-%d") + timedelta(days=1) \
+                    if request.GET.get("end_date") else None
+                start = datetime.strptime(request.GET["start_date"], "%Y-%m-%d") \
+                    if request.GET.get("start_date") else (end or datetime.utcnow()) - timedelta(days=30)
+            except ValueError:
+                return Response({"error": "Invalid date format. Use YYYY-MM-DD"}, status=400)
+
+            agent_query = {"role": "agent"}
+            agent_ids = [a.strip() for a in request.GET.get("agent_ids", "").split(",") if a.strip()]
+            if agent_ids:
+                agent_query = {"admin_id": {"$in": agent_ids}}
+            agents = {
+                a["admin_id"]: a.get("name")
+                for a in get_admin_collection().find(agent_query, {"_id": 0, "admin_id": 1, "name": 1})
+            }
+            if not agents:
+                return Response({"leaderboard": [], "sort_by": sort_by, "total_agents": 0}, status=200)
+
+            # Rooms with activity in the window
+            room_filter = {"assigned_agent": {"$in": list(agents)}, "last_timestamp": {"$gte": start}}
+            if end:
+                room_filter["created_at"] = {"$lt": end}
+            room_agents = {
+                room["room_id"]: room["assigned_agent"]
+                for room in get_room_collection().find(room_filter, {"_id": 0, "room_id": 1, "assigned_agent": 1})
+            }
+
+            frame = MessageFrame.load(room_agents, start, end)
+            stats = agent_stats(frame, room_agents, agents)
+
+            leaderboard = []
+            for agent_id, name in agents.items():
+                stats[agent_id]["agent_name"] = name
+                leaderboard.append(stats[agent_id])
+
+            descending = LEADERBOARD_SORTS[sort_by]
+            ranked = sorted(
+                (row for row in leaderboard if row[sort_by] is not None),
+                key=lambda row: row[sort_by], reverse=descending
+            )
+            ranked += [row for row in leaderboard if row[sort_by] is None]
+            for rank, row in enumerate(ranked, start=1):
+                row["rank"] = rank
+
+            return Response({
+                "start_date": start.strftime("%Y-%m-%d"),
+                "end_date": (end - timedelta(days=1)).strftime("%Y-%m-%d") if end else None,
+                "sort_by": sort_by,
+                "total_agents": len(ranked),
+                "leaderboard": ranked,
+            }, status=200)
+
+        except Exception as e:
+            return Response({"error": f"Error building leaderboard: {str(e)}"}, status=500)
+
+
 class ExportChatHistoryAPIView(APIView):
     permission_classes = [IsSuperAdmin]  # Only admins or superadmins can access this view
     authentication_classes = [JWTAuthentication]  # Custom auth, no DRF auth needed
     
     """
-    Export chat history for a room (and optional date range) as CSV or JSON.
+    Stream chat history for a room (and optional date range) as CSV, NDJSON or JSON.
     Query params:
       - room_id (required)
       - start_date (optional, ISO format)
       - end_date   (optional, ISO format)
-      - format     (optional, one of 'csv','json'; default 'csv')
+      - format     (optional, one of 'csv','ndjson','json'; default 'csv')
+      - gzip       (optional, 'true' to download a .gz file)
     """
     def get(self, request):
-        print("✅ ExportChatHistoryAPIView HIT")
         room_id = request.query_params.get('room_id')
         if not room_id:
             return Response({"error": "room_id is required"}, status=status.HTTP_400_BAD_REQUEST)
@@ -2058,57 +2074,110 @@ class ExportChatHistoryAPIView(APIView):
         start_date = request.query_params.get('start_date')
         end_date   = request.query_params.get('end_date')
         fmt        = request.query_params.get('format', 'csv').lower()
+        compress   = request.query_params.get('gzip', 'false').lower() in ('1', 'true', 'yes')
+
+        if fmt not in EXPORT_FORMATS:
+            return Response({"error": "Unsupported format, choose csv, ndjson or json"}, status=status.HTTP_400_BAD_REQUEST)
 
         # Build query
-        query = {'room_id': room_id}
-        date_q = {}
+        start = end = None
         if start_date:
-            dt = parse_datetime(start_date)
-            if not dt: return Response({"error":"Invalid start_date"},400)
-            date_q['$gte'] = dt
+            start = parse_datetime(start_date)
+            if not start: return Response({"error":"Invalid start_date"},400)
         if end_date:
-            dt = parse_datetime(end_date)
-            if not dt: return Response({"error":"Invalid end_date"},400)
-            date_q['$lt'] = dt
-        if date_q:
-            query['timestamp'] = date_q
-
-        msgs = list(get_chat_collection().find(query).sort('timestamp',1))
-
-        # Normalize all messages safely
-        for m in msgs:
-            m['_id'] = str(m.get('_id', ''))
-            ts = m.get('timestamp')
-            if isinstance(ts, datetime):
-                m['timestamp'] = ts.isoformat()
-            else:
-                m['timestamp'] = str(ts)
-
-        # JSON
-        if fmt == 'json':
-            return HttpResponse(
-                json.dumps(msgs, indent=2, cls=DjangoJSONEncoder),
-                content_type='application/json',
-                headers={'Content-Disposition': f'attachment; filename="chat_{room_id}.json"'}
-            )
+            end = parse_datetime(end_date)
+            if not end: return Response({"error":"Invalid end_date"},400)
+        query = build_message_query(room_id=room_id, start=start, end=end)
+
+        # Rows are encoded as the cursor is consumed; the executor hop keeps
+        # the blocking cursor off the event loop under ASGI
+        chunks = iter_bytes(iter_export(iter_messages(query), fmt), compress=compress)
+        response = StreamingHttpResponse(
+            iterate_blocking(chunks),
+            content_type='application/gzip' if compress else CONTENT_TYPES[fmt]
+        )
+        filename = export_filename(f"chat_{room_id}", fmt, compress)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
-        # CSV
-        if fmt == 'csv':
-            output = io.StringIO()
-            writer = csv.writer(output)
-            # header
-            writer.writerow(['message_id','sender','text','timestamp'])
-            for m in msgs:
-                writer.writerow([
-                    m.get('message_id',''),
-                    m.get('sender',''),
-                    m.get('message',''),
-                    m.get('timestamp',''),
-                ])
-            return HttpResponse(
-                output.getvalue(),
-                content_type='text/csv',
-                headers={'Content-Disposition': f'attachment; filename="chat_{room_id}.csv"'}
-            )
-        return Response({"error": "Unsupported format, choose csv or json "}, status=status.HTTP_400_BAD_REQUEST)
 
+
+class ExportJobAPIView(APIView):
+    permission_classes = [IsSuperAdmin]
+    authentication_classes = [JWTAuthentication]
+
+    """
+    Queue a multi-room chat export that runs in the export worker
+    (`python manage.py run_export_jobs`).
+    Body:
+      - widget_ids (optional list) / agent_id (optional): which rooms to export
+      - start_date, end_date (optional, ISO format): message date range
+      - format (optional, 'csv','ndjson','json'; default 'ndjson')
+      - layout (optional, 'per_room' zip or 'combined' gzipped NDJSON; default 'per_room')
+    """
+    def post(self, request):
+        data = request.data
+        fmt = data.get('format', 'ndjson').lower()
+        layout = data.get('layout', 'per_room')
+        if fmt not in EXPORT_FORMATS:
+            return Response({"error": "Unsupported format, choose csv, ndjson or json"}, status=status.HTTP_400_BAD_REQUEST)
+        if layout not in LAYOUTS:
+            return Response({"error": "Unsupported layout, choose per_room or combined"}, status=status.HTTP_400_BAD_REQUEST)
+
+        widget_ids = data.get('widget_ids') or []
+        if isinstance(widget_ids, str):
+            widget_ids = [widget_ids]
+
+        dates = {}
+        for field in ('start_date', 'end_date'):
+            if data.get(field):
+                dates[field] = parse_datetime(data[field])
+                if not dates[field]:
+                    return Response({"error": f"Invalid {field}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = create_export_job(
+            created_by=request.user.get('admin_id'),
+            widget_ids=widget_ids,
+            agent_id=data.get('agent_id'),
+            start=dates.get('start_date'),
+            end=dates.get('end_date'),
+            fmt=fmt,
+            layout=layout,
+        )
+        return Response({"job_id": job['job_id'], "status": job['status']}, status=status.HTTP_202_ACCEPTED)
+
+
+class ExportJobDetailAPIView(APIView):
+    permission_classes = [IsSuperAdmin]
+    authentication_classes = [JWTAuthentication]
+
+    def get(self, request, job_id):
+        """Poll an export job's status and progress"""
+        job = get_export_job(job_id)
+        if not job:
+            return Response({"error": "Export job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        archive = job.pop('archive', None) or {}
+        job.pop('worker_id', None)
+        job['archive'] = {'filename': archive.get('filename'), 'size': archive.get('size')} if archive else None
+        return Response(json.loads(json.dumps(job, cls=DjangoJSONEncoder)), status=status.HTTP_200_OK)
+
+
+class ExportJobDownloadAPIView(APIView):
+    permission_classes = [IsSuperAdmin]
+    authentication_classes = [JWTAuthentication]
+
+    def get(self, request, job_id):
+        """Download a finished export (redirects to a presigned URL for S3 archives)"""
+        job = get_export_job(job_id)
+        if not job:
+            return Response({"error": "Export job not found"}, status=status.HTTP_404_NOT_FOUND)
+        if job.get('status') != 'completed' or not job.get('archive'):
+            return Response({"error": f"Export job is {job.get('status')}"}, status=status.HTTP_409_CONFLICT)
+
+        archive = job['archive']
+        if archive['storage'] == 's3':
+            return HttpResponseRedirect(get_download_url(archive))
+        if not os.path.exists(archive['path']):
+            return Response({"error": "Export archive no longer available"}, status=status.HTTP_410_GONE)
+        return FileResponse(open(archive['path'], 'rb'), as_attachment=True, filename=archive['filename'])
@@ -0,0 +1,78 @@
+// Paged chat history over the chat WebSocket, shared by the agent page and the
+// widget scripts.
+//
+// The server sends one `history` frame per page:
+//   { type: "history", room_id, before, messages: [...] }   (messages oldest first)
+// The first page arrives on connect (agents) or after request() (widgets);
+// older pages are requested with the frame's `before` cursor when the message
+// list is scrolled to the top.
+//
+// createChatHistory({
+//   getSocket,       // () => the chat WebSocket
+//   container,       // the scrolling message list, or a function returning it
+//   anchorSelector,  // selector of a rendered message (older pages go above the first)
+//   appendMessage,   // (msg) => renders one history message the way the page renders live ones
+// })
+(function (global) {
+    function createChatHistory(options) {
+        const getContainer = typeof options.container === "function" ? options.container : () => options.container;
+        const anchorSelector = options.anchorSelector || ".message";
+        let before = null;
+        let loading = false;
+        let pagesLoaded = 0;
+
+        function request(cursor = null) {
+            const socket = options.getSocket();
+            if (!socket || socket.readyState !== WebSocket.OPEN || loading) return;
+            loading = true;
+            socket.send(JSON.stringify(cursor ? { action: "get_history", before: cursor } : { action: "get_history" }));
+        }
+
+        function render(data) {
+            const messagesDiv = getContainer();
+            loading = false;
+            if (!messagesDiv) return;
+
+            if (pagesLoaded === 0) {
+                messagesDiv.addEventListener("scroll", () => {
+                    if (messagesDiv.scrollTop < 50 && before) request(before);
+                });
+            }
+
+            // appendMessage adds below what is shown; move this (older) page above it
+            const anchor = messagesDiv.querySelector(anchorSelector);
+            const previousHeight = messagesDiv.scrollHeight;
+            const existing = new Set(messagesDiv.children);
+            (data.messages || []).forEach((msg) => options.appendMessage(msg));
+            if (anchor) {
+                Array.from(messagesDiv.children)
+                    .filter((node) => !existing.has(node))
+                    .forEach((node) => messagesDiv.insertBefore(node, anchor));
+            }
+
+            if (pagesLoaded > 0) {
+                messagesDiv.scrollTop += messagesDiv.scrollHeight - previousHeight;
+            } else {
+                messagesDiv.scrollTop = messagesDiv.scrollHeight;
+            }
+            pagesLoaded++;
+            before = data.before;
+        }
+
+        // An error frame answers the outstanding request
+        function failed() {
+            loading = false;
+        }
+
+        return {
+            request,
+            render,
+            failed,
+            get pagesLoaded() {
+                return pagesLoaded;
+            },
+        };
+    }
+
+    global.createChatHistory = createChatHistory;
+})(window);
@@ -853,6 +853,7 @@ document.addEventListener("DOMContentLoaded", async function () {
     socket.onopen = () => {
       console.log("WebSocket connected");
       updateConnectionStatus(true);
+      if (chatHistory && chatHistory.pagesLoaded === 0) chatHistory.request();
     };
 
     socket.onmessage = (event) => {
@@ -940,10 +941,16 @@ document.addEventListener("DOMContentLoaded", async function () {
     }
 
     if (data.error) {
+      if (chatHistory) chatHistory.failed();
       appendSystemMessage(`Error: ${sanitizeHTML(data.error)}`);
       return;
     }
 
+    if (data.type === "history") {
+      if (chatHistory) chatHistory.render(data);
+      return;
+    }
+
     if (data.message || data.file_url) {
       appendMessage(
         data.sender,
@@ -1025,6 +1032,32 @@ document.addEventListener("DOMContentLoaded", async function () {
     }
   }
 
+  // Chat history pages are handled by the shared chat_history.js, served
+  // next to this script
+  let chatHistory = null;
+  const historyScript = document.createElement("script");
+  historyScript.src = new URL("chat_history.js", scriptSrc).href;
+  historyScript.onload = () => {
+    chatHistory = createChatHistory({
+      getSocket: () => socket,
+      container: () => document.getElementById("chat-messages"),
+      anchorSelector: ".message",
+      appendMessage: (msg) => {
+        appendMessage(
+          msg.sender,
+          msg.message,
+          msg.file_url,
+          msg.file_name,
+          msg.sender === "User" ? "user" : msg.sender === "System" ? "system" : "agent",
+          msg.message_id,
+          "delivered"
+        );
+      },
+    });
+    chatHistory.request();
+  };
+  document.head.appendChild(historyScript);
+
   // Append system message wrapper
   function appendSystemMessage(message) {
     appendMessage(
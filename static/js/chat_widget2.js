@@ -540,11 +540,10 @@ async function initializeChatWidget() {
                     sender: "User"
                 }));
 
-                // Load chat history if not already loaded
-                // if (!chatHistoryLoaded) {
-                //     await loadChatHistory();
-                //     chatHistoryLoaded = true;
-                // }
+                // Load chat history over the socket; older pages load on scroll
+                if (chatHistory && chatHistory.pagesLoaded === 0) {
+                    chatHistory.request();
+                }
             };
 
             socket.onmessage = (event) => {
@@ -687,6 +686,11 @@ async function initializeChatWidget() {
             try {
                 console.log("📩 Received message data:", data);
 
+                if (data.type === 'history') {
+                    if (chatHistory) chatHistory.render(data);
+                    return;
+                }
+
                 // First, handle trigger messages with higher priority
                 if (data.type === 'trigger_message' || data.is_trigger || (data.sender === 'Wish-bot' && data.suggested_replies)) {
                     console.log("🤖 Processing trigger/bot message");
@@ -817,6 +821,7 @@ async function initializeChatWidget() {
 
                 // Handle errors
                 if (data.error) {
+                    if (chatHistory) chatHistory.failed();
                     console.log("❌ Displaying error message:", data.error);
                     // appendSystemMessage(`Error: ${sanitizeHTML(data.error)}`);
                     return;
@@ -1002,6 +1007,33 @@ async function initializeChatWidget() {
             }
         }
 
+        // Chat history pages are handled by the shared chat_history.js, served
+        // next to this script
+        let chatHistory = null;
+        const historyScript = document.createElement("script");
+        historyScript.src = new URL("chat_history.js", scriptSrc).href;
+        historyScript.onload = () => {
+            chatHistory = createChatHistory({
+                getSocket: () => socket,
+                container: () => elements.messagesDiv,
+                anchorSelector: ".message",
+                appendMessage: (msg) => {
+                    appendMessage(
+                        msg.sender,
+                        msg.message,
+                        msg.file_url,
+                        msg.file_name,
+                        msg.sender === "User" ? "user" : msg.sender === "System" ? "system" : "agent",
+                        msg.message_id,
+                        "delivered",
+                        msg.timestamp
+                    );
+                },
+            });
+            chatHistory.request();
+        };
+        document.head.appendChild(historyScript);
+
         function appendSystemMessage(message, messageId = null) {
             const id = messageId || `sys-${Date.now()}`;
             appendMessage("System", message, null, null, "system", id, "delivered");
@@ -502,11 +502,10 @@ async function initializeChatWidget() {
                     sender: "User"
                 }));
 
-                // Load chat history if not already loaded
-                // if (!chatHistoryLoaded) {
-                //     await loadChatHistory();
-                //     chatHistoryLoaded = true;
-                // }
+                // Load chat history over the socket; older pages load on scroll
+                if (chatHistory && chatHistory.pagesLoaded === 0) {
+                    chatHistory.request();
+                }
             };
 
             socket.onmessage = (event) => {
@@ -652,6 +651,11 @@ async function initializeChatWidget() {
             try {
                 console.log("📩 Processing incoming message:", data);
 
+                if (data.type === 'history') {
+                    if (chatHistory) chatHistory.render(data);
+                    return;
+                }
+
                 // Handle typing indicators FIRST (before other checks)
                 if (data.type === 'typing_status' || (data.typing !== undefined && data.sender !== "User")) {
                     const typingId = `typing-${data.sender}`;
@@ -747,6 +751,7 @@ async function initializeChatWidget() {
 
                 // Handle errors
                 if (data.error) {
+                    if (chatHistory) chatHistory.failed();
                     console.log("❌ Displaying error message:", data.error);
                     appendSystemMessage(`Error: ${sanitizeHTML(data.error)}`);
                     return;
@@ -932,6 +937,33 @@ async function initializeChatWidget() {
             }
         }
 
+        // Chat history pages are handled by the shared chat_history.js, served
+        // next to this script
+        let chatHistory = null;
+        const historyScript = document.createElement("script");
+        historyScript.src = new URL("chat_history.js", scriptSrc).href;
+        historyScript.onload = () => {
+            chatHistory = createChatHistory({
+                getSocket: () => socket,
+                container: () => elements.messagesDiv,
+                anchorSelector: ".message",
+                appendMessage: (msg) => {
+                    appendMessage(
+                        msg.sender,
+                        msg.message,
+                        msg.file_url,
+                        msg.file_name,
+                        msg.sender === "User" ? "user" : msg.sender === "System" ? "system" : "agent",
+                        msg.message_id,
+                        "delivered",
+                        msg.timestamp
+                    );
+                },
+            });
+            chatHistory.request();
+        };
+        document.head.appendChild(historyScript);
+
         function appendSystemMessage(message, messageId = null) {
             const id = messageId || `sys-${Date.now()}`;
             appendMessage("System", message, null, null, "system", id, "delivered");
@@ -691,6 +691,7 @@ function injectStyles() {
                 console.log(`${CHAT_LOG_PREFIX} 🔌 WebSocket connected to:`, WIDGET_CONFIG.wsUrl);
                 // Initialize file attachment handling with upload functionality
                 handleFileAttachment(fileInput, socket, widgetId, chatMessages, WIDGET_CONFIG.uploadUrl);
+                if (chatHistory && chatHistory.pagesLoaded === 0) chatHistory.request();
             };
             socket.onclose = (e) => {
                 console.warn(`${CHAT_LOG_PREFIX} ⚠️ WebSocket closed:`, e);
@@ -712,7 +713,10 @@ function injectStyles() {
                     const formDiv = document.getElementById("chat-form");
 
                     if (data.error) {
+                        if (chatHistory) chatHistory.failed();
                         appendSystemMessage(data.error);
+                    } else if (data.type === "history") {
+                        if (chatHistory) chatHistory.render(data);
                     } else if (data.form_data_received) {
                         formDiv.style.display = "none";
                         input.disabled = false;
@@ -787,6 +791,28 @@ function injectStyles() {
             chatMessages.scrollTop = chatMessages.scrollHeight; // Scroll to bottom
         }
 
+        // Chat history pages are handled by the shared chat_history.js, served
+        // next to this script
+        let chatHistory = null;
+        const historyScript = document.createElement("script");
+        historyScript.src = new URL("chat_history.js", scriptSrc).href;
+        historyScript.onload = () => {
+            chatHistory = createChatHistory({
+                getSocket: () => socket,
+                container: () => chatMessages,
+                anchorSelector: ".bubble-wrapper",
+                appendMessage: (msg) => {
+                    const sender = msg.sender || "";
+                    let className = "agent";
+                    if (sender.toLowerCase() === "user") className = "user";
+                    else if (sender.toLowerCase() === "wish-bot" || sender.toLowerCase() === "system") className = "system";
+                    appendMessage(sender, msg.message, className, msg.message_id);
+                },
+            });
+            chatHistory.request();
+        };
+        document.head.appendChild(historyScript);
+
         function appendSystemMessage(msg) {
             appendMessage("System", sanitizeHTML(msg), "system", `sys-${Date.now()}`);
         }
@@ -12,6 +12,7 @@ from authentication.utils import is_agent_assigned_to_widget
 from rest_framework.views import APIView
 from rest_framework import status
 from authentication.jwt_auth import JWTAuthentication 
+from utils import cache
 
 logger = logging.getLogger(__name__)
 
@@ -921,6 +922,7 @@ def add_trigger(request):
             result = trigger_collection.insert_one(trigger_data)
 
             if result.inserted_id:
+                cache.invalidate_after_write(cache.widget_triggers, widget_id)
                 return JsonResponse({
                     'success': True,
                     'message': 'Trigger added successfully',
@@ -1023,6 +1025,7 @@ class PatchTriggerAPIView(APIView):
 
             if result.matched_count == 0:
                 return Response({'error': 'Trigger not found or widget_id mismatch'}, status=404)
+            cache.invalidate_after_write(cache.widget_triggers, widget_id)
 
             return Response({
                 'success': True,
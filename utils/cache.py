@@ -0,0 +1,337 @@
+"""
+Two-tier read-through cache.
+
+A `CacheFamily` is one kind of cached lookup (agent widgets, a room's
+widget, ...) stored under `<name>:<key>` in Redis:
+
+  - L1 is a per-process LRU bounded by entry count and a short TTL
+    (CACHE_LAYER['L1_SIZE'] / ['L1_TTL']) so hot keys skip the Redis
+    round trip
+  - L2 is Redis with the family's TTL, shared by every worker
+  - concurrent misses for the same key are coalesced into one load
+    (single-flight), both on the event loop and across view threads
+  - a loader returning None is cached too, for `negative_ttl` seconds,
+    so lookups of missing documents do not hit Mongo every time
+
+Values are stored as JSON.  Consumers use `await family.get(key, loader)`
+with an async loader; views use `family.get_sync(key, loader)`.
+Hit/miss counts and load latency are exported per family to Prometheus.
+
+`invalidate` bumps the key's generation (`cache_gen:<name>:<key>`),
+deletes the L2 entry and publishes the key and new generation on the
+`cache:invalidate` pub/sub channel.  Every process that has used the cache
+runs a listener thread that drops the matching L1 entry, so L1 staleness
+after a write is bounded by pub/sub latency rather than L1_TTL.  When the
+listener loses Redis it clears its whole L1 on resubscribe, since anything
+published in between is gone.
+
+A miss reads the generation together with the L2 entry, before calling the
+loader.  The result is written back to L2 (the `cache_store` script in
+utils/redis_scripts.py) and to L1 only if the generation is unchanged, so
+a load that started before an invalidate cannot put stale data back.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from prometheus_client import Counter, Histogram
+
+from utils import redis_scripts
+from utils.redis_client import async_redis_client, redis_client
+
+logger = logging.getLogger(__name__)
+
+cache_requests = Counter('cache_requests_total', 'Cache lookups by family and outcome', ['family', 'result'])
+cache_load_time = Histogram('cache_load_seconds', 'Time spent loading cache misses', ['family'])
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+GENERATION_PREFIX = "cache_gen:"
+# Generation counters outlive any load in flight by a wide margin
+GENERATION_TTL = 86400
+
+_MISSING = object()
+_families = {}
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _config(key, default=None):
+    return getattr(settings, 'CACHE_LAYER', {}).get(key, default)
+
+
+class _LRU:
+    """Thread-safe LRU of (expires_at, value) entries"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return _MISSING
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class CacheFamily:
+    def __init__(self, name, ttl, negative_ttl=None, l1_ttl=None, l1_size=None):
+        self.name = name
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.l1_ttl = _config('L1_TTL', 60) if l1_ttl is None else l1_ttl
+        self.l1 = _LRU(_config('L1_SIZE', 4096) if l1_size is None else l1_size)
+        # Generations seen on the invalidation bus, kept as long as an L1
+        # entry could live; guards L1 against loads that finish late
+        self.l1_generations = _LRU(self.l1.max_size)
+        self._l1_lock = threading.Lock()
+        self._inflight = {}
+        self._sync_inflight = {}
+        self._sync_lock = threading.Lock()
+        _families[name] = self
+
+    def redis_key(self, key):
+        return f"{self.name}:{key}" if key is not None else self.name
+
+    def generation_key(self, key):
+        return GENERATION_PREFIX + self.redis_key(key)
+
+    def _decode(self, raw):
+        try:
+            return json.loads(raw)
+        except (TypeError, ValueError):
+            # Written by something other than this layer; treat as a miss
+            return _MISSING
+
+    def _ttls(self, value):
+        if value is None:
+            return self.negative_ttl, min(self.l1_ttl, self.negative_ttl or 0)
+        return self.ttl, self.l1_ttl
+
+    def _l1_lookup(self, key):
+        value = self.l1.get(key)
+        if value is not _MISSING:
+            cache_requests.labels(self.name, 'l1_hit').inc()
+        return value
+
+    def _l1_store(self, key, value, ttl, generation):
+        """Set L1 unless an invalidation newer than `generation` arrived"""
+        with self._l1_lock:
+            seen = self.l1_generations.get(key)
+            if seen is not _MISSING and seen > generation:
+                return
+            self.l1.set(key, value, ttl)
+
+    def _l1_invalidate(self, key, generation=None):
+        with self._l1_lock:
+            if generation is not None:
+                self.l1_generations.set(key, generation, self.l1_ttl)
+            self.l1.pop(key)
+
+    def _l2_hit(self, key, raw, generation):
+        value = self._decode(raw) if raw is not None else _MISSING
+        if value is not _MISSING:
+            cache_requests.labels(self.name, 'l2_hit').inc()
+            self._l1_store(key, value, self._ttls(value)[1], generation)
+        return value
+
+    def _store_args(self, key, value, generation):
+        ttl = self._ttls(value)[0]
+        return [self.redis_key(key), self.generation_key(key)], [generation, ttl or 0, json.dumps(value)]
+
+    # Async API (consumers)
+
+    async def get(self, key, loader):
+        """Cached value for `key`, calling `await loader()` on a miss"""
+        _ensure_listener()
+        value = self._l1_lookup(key)
+        if value is not _MISSING:
+            return value
+
+        flight_key = (asyncio.get_running_loop(), key)
+        pending = self._inflight.get(flight_key)
+        if pending is not None:
+            cache_requests.labels(self.name, 'coalesced').inc()
+            return await asyncio.shield(pending)
+
+        task = asyncio.ensure_future(self._fill(key, loader))
+        self._inflight[flight_key] = task
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._inflight.pop(flight_key, None)
+            else:
+                task.add_done_callback(lambda _: self._inflight.pop(flight_key, None))
+
+    async def _fill(self, key, loader):
+        raw, generation = await async_redis_client.mget(self.redis_key(key), self.generation_key(key))
+        generation = int(generation or 0)
+        value = self._l2_hit(key, raw, generation)
+        if value is not _MISSING:
+            return value
+
+        cache_requests.labels(self.name, 'miss').inc()
+        with cache_load_time.labels(self.name).time():
+            value = await loader()
+        keys, args = self._store_args(key, value, generation)
+        if await redis_scripts.run('cache_store', keys, args):
+            self._l1_store(key, value, self._ttls(value)[1], generation)
+        else:
+            cache_requests.labels(self.name, 'stale_load').inc()
+        return value
+
+    async def invalidate(self, key=None):
+        """Drop `key` from Redis and from the L1 of every process"""
+        self._l1_invalidate(key)
+        pipe = async_redis_client.pipeline()
+        pipe.incr(self.generation_key(key))
+        pipe.expire(self.generation_key(key), GENERATION_TTL)
+        pipe.delete(self.redis_key(key))
+        generation = (await pipe.execute())[0]
+        self._l1_invalidate(key, generation)
+        await async_redis_client.publish(INVALIDATION_CHANNEL, _invalidation_message(self.name, key, generation))
+
+    # Sync API (views, management commands)
+
+    def get_sync(self, key, loader):
+        """Cached value for `key`, calling `loader()` on a miss"""
+        _ensure_listener()
+        value = self._l1_lookup(key)
+        if value is not _MISSING:
+            return value
+
+        with self._sync_lock:
+            done = self._sync_inflight.get(key)
+            leader = done is None
+            if leader:
+                done = self._sync_inflight[key] = threading.Event()
+
+        if not leader:
+            cache_requests.labels(self.name, 'coalesced').inc()
+            done.wait(timeout=_config('LOAD_TIMEOUT', 5))
+            value = self.l1.get(key)
+            if value is not _MISSING:
+                return value
+            # The leader failed (or L1 is disabled); load independently
+
+        try:
+            raw, generation = redis_client.mget(self.redis_key(key), self.generation_key(key))
+            generation = int(generation or 0)
+            value = self._l2_hit(key, raw, generation)
+            if value is not _MISSING:
+                return value
+
+            cache_requests.labels(self.name, 'miss').inc()
+            with cache_load_time.labels(self.name).time():
+                value = loader()
+            keys, args = self._store_args(key, value, generation)
+            if redis_scripts.run_sync('cache_store', keys, args):
+                self._l1_store(key, value, self._ttls(value)[1], generation)
+            else:
+                cache_requests.labels(self.name, 'stale_load').inc()
+            return value
+        finally:
+            if leader:
+                with self._sync_lock:
+                    self._sync_inflight.pop(key, None)
+                done.set()
+
+    def invalidate_sync(self, key=None):
+        self._l1_invalidate(key)
+        pipe = redis_client.pipeline()
+        pipe.incr(self.generation_key(key))
+        pipe.expire(self.generation_key(key), GENERATION_TTL)
+        pipe.delete(self.redis_key(key))
+        generation = pipe.execute()[0]
+        self._l1_invalidate(key, generation)
+        redis_client.publish(INVALIDATION_CHANNEL, _invalidation_message(self.name, key, generation))
+
+
+# Invalidation bus
+
+def _invalidation_message(family, key, generation):
+    return json.dumps({'family': family, 'key': key, 'generation': generation})
+
+
+def _apply_invalidation(data):
+    try:
+        message = json.loads(data)
+        family = _families.get(message['family'])
+    except (TypeError, ValueError, KeyError):
+        logger.warning(f"Ignoring malformed cache invalidation: {data!r}")
+        return
+    if family is not None:
+        family._l1_invalidate(message.get('key'), message.get('generation'))
+
+
+def _listen():
+    while True:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            for family in list(_families.values()):
+                family.l1.clear()
+            while True:
+                message = pubsub.get_message(timeout=1.0)
+                if message and message.get('type') == 'message':
+                    _apply_invalidation(message['data'])
+        except Exception as e:
+            logger.warning(f"Cache invalidation listener lost Redis, resubscribing: {e}")
+            time.sleep(1)
+        finally:
+            pubsub.close()
+
+
+def _ensure_listener():
+    global _listener
+    if _listener is not None:
+        return
+    with _listener_lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, name='cache-invalidation', daemon=True)
+            _listener.start()
+
+
+# Families shared by the consumers and the dashboard views.  Key names match
+# the Redis keys the hand-rolled caches used before.
+def invalidate_after_write(family, key=None):
+    """Invalidate from a view whose write already committed; a Redis failure is logged, not raised"""
+    try:
+        family.invalidate_sync(key)
+    except Exception as e:
+        logger.error(f"Failed to invalidate {family.name} cache for {key}: {e}")
+
+
+agent_widgets = CacheFamily('agent_widgets', ttl=300)
+room_widget = CacheFamily('room_widget', ttl=3600, negative_ttl=10)
+widget_ids = CacheFamily('all_widgets', ttl=300)
+superadmin = CacheFamily('superadmin', ttl=300)
+widget_triggers = CacheFamily('triggers', ttl=300)
@@ -0,0 +1,144 @@
+"""
+Dedicated thread pool for blocking I/O issued from async code.
+
+`sync_to_async` defaults to thread_sensitive=True, which funnels every call
+in a worker onto a single shared thread.  Consumers use `run_blocking`
+instead so that blocking Mongo/Redis/S3/file work runs in parallel on a
+bounded pool with a queue limit and an optional per-call timeout.
+
+Configured through settings.IO_EXECUTOR:
+
+    IO_EXECUTOR = {
+        'MAX_WORKERS': 32,     # threads in the pool
+        'MAX_QUEUE': 1000,     # calls allowed to wait for a free thread
+        'TIMEOUT': 10,         # default per-call timeout in seconds (None = no limit)
+    }
+"""
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from prometheus_client import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+io_executor_queue_depth = Gauge('io_executor_queue_depth', 'Blocking calls waiting for an I/O executor thread')
+io_executor_active = Gauge('io_executor_active_calls', 'Blocking calls currently running on the I/O executor')
+io_executor_wait_seconds = Gauge('io_executor_wait_seconds', 'Queue wait of the most recently started blocking call')
+io_executor_wait_time = Histogram('io_executor_wait_time_seconds', 'Time blocking calls spend queued before running')
+
+DEFAULT_MAX_WORKERS = 32
+DEFAULT_MAX_QUEUE = 1000
+DEFAULT_TIMEOUT = 10
+_UNSET = object()
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+class ExecutorSaturated(Exception):
+    """Raised when the I/O executor queue is full"""
+
+
+def _config(key, default):
+    return getattr(settings, 'IO_EXECUTOR', {}).get(key, default)
+
+
+def get_io_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=_config('MAX_WORKERS', DEFAULT_MAX_WORKERS),
+                    thread_name_prefix='io-executor'
+                )
+    return _executor
+
+
+def _track_pending(delta):
+    global _pending
+    with _pending_lock:
+        _pending += delta
+        return _pending
+
+
+async def run_blocking(func, *args, timeout=_UNSET, **kwargs):
+    """
+    Run `func(*args, **kwargs)` on the I/O executor and await the result.
+
+    `timeout` defaults to IO_EXECUTOR['TIMEOUT']; pass None to wait forever.
+    On timeout the caller gets asyncio.TimeoutError but the thread keeps
+    running the call to completion, so keep blocking calls short.
+    """
+    if timeout is _UNSET:
+        timeout = _config('TIMEOUT', DEFAULT_TIMEOUT)
+
+    max_queue = _config('MAX_QUEUE', DEFAULT_MAX_QUEUE)
+    if _track_pending(1) > max_queue:
+        _track_pending(-1)
+        raise ExecutorSaturated(f"I/O executor queue is full ({max_queue} calls waiting)")
+    io_executor_queue_depth.inc()
+
+    submitted_at = time.monotonic()
+    state = {'started': False, 'abandoned': False}
+
+    def dequeue():
+        # Called exactly once per call, either by the worker thread or by
+        # the caller when it gives up before a thread picked the call up.
+        _track_pending(-1)
+        io_executor_queue_depth.dec()
+
+    def call():
+        with _pending_lock:
+            if state['abandoned']:
+                return None
+            state['started'] = True
+        dequeue()
+        waited = time.monotonic() - submitted_at
+        io_executor_wait_seconds.set(waited)
+        io_executor_wait_time.observe(waited)
+        io_executor_active.inc()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            io_executor_active.dec()
+
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(get_io_executor(), call)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        with _pending_lock:
+            abandoned = not state['started']
+            state['abandoned'] = True
+        if abandoned:
+            dequeue()
+        if isinstance(e, asyncio.TimeoutError):
+            logger.warning(f"Blocking call {getattr(func, '__name__', func)} timed out after {timeout}s")
+        raise
+
+
+def _next_items(iterator, count):
+    return list(itertools.islice(iterator, count))
+
+
+async def iterate_blocking(iterable, chunk_size=16):
+    """
+    Consume a blocking iterator from async code, `chunk_size` items per
+    executor hop.  Used to stream sync generators (e.g. Mongo cursors)
+    through StreamingHttpResponse under ASGI without buffering them.
+    """
+    iterator = iter(iterable)
+    while True:
+        items = await run_blocking(_next_items, iterator, chunk_size, timeout=None)
+        if not items:
+            return
+        for item in items:
+            yield item
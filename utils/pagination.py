@@ -0,0 +1,100 @@
+"""
+Keyset (cursor) pagination for MongoDB queries.
+
+Instead of `$skip`, each page is fetched with a range filter on the sort key
+plus `_id` as a tie-breaker, so deep pages cost the same as the first one as
+long as a matching `(…, sort_field, _id)` index exists.  Cursors are opaque
+URL-safe strings; clients pass back the `next_cursor` of the previous page.
+"""
+import base64
+
+from bson import json_util
+from pymongo import DESCENDING
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Clamp a user-supplied page size to 1..maximum"""
+    try:
+        limit = int(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def encode_cursor(sort_value, doc_id):
+    payload = json_util.dumps([sort_value, doc_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, doc_id = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except Exception:
+        raise InvalidCursor("Invalid pagination cursor")
+    return sort_value, doc_id
+
+
+def keyset_query(query, sort_field, cursor=None, direction=DESCENDING):
+    """
+    Return `(query, sort)` for the page after `cursor`.
+
+    Documents without `sort_field` sort below every value, so they are
+    reached last in descending order and first in ascending order.
+    """
+    sort = [(sort_field, direction), ('_id', direction)]
+    if not cursor:
+        return query, sort
+
+    sort_value, doc_id = decode_cursor(cursor)
+    op = '$lt' if direction == DESCENDING else '$gt'
+    if sort_value is None:
+        after = [{sort_field: None, '_id': {op: doc_id}}]
+        if direction != DESCENDING:
+            after.append({sort_field: {'$ne': None}})
+    else:
+        after = [
+            {sort_field: {op: sort_value}},
+            {sort_field: sort_value, '_id': {op: doc_id}},
+        ]
+        if direction == DESCENDING:
+            after.append({sort_field: None})
+
+    return {'$and': [query, {'$or': after}]} if query else {'$or': after}, sort
+
+
+def cursor_projection(projection):
+    """Make sure `_id` is fetched; returns `(projection, strip_id)`"""
+    if projection and projection.get('_id') == 0:
+        projection = {k: v for k, v in projection.items() if k != '_id'} or None
+        return projection, True
+    return projection, False
+
+
+def build_page(docs, sort_field, limit, strip_id=False):
+    """Trim a `limit + 1` fetch to `limit` docs and compute `next_cursor`"""
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    next_cursor = None
+    if has_more and docs:
+        last = docs[-1]
+        next_cursor = encode_cursor(last.get(sort_field), last['_id'])
+    if strip_id:
+        for doc in docs:
+            doc.pop('_id', None)
+    return docs, next_cursor
+
+
+def paginate(collection, query, sort_field, limit, cursor=None, direction=DESCENDING, projection=None):
+    """Fetch one keyset page from a sync collection; returns `(docs, next_cursor)`"""
+    query, sort = keyset_query(query, sort_field, cursor, direction)
+    projection, strip_id = cursor_projection(projection)
+    docs = list(collection.find(query, projection).sort(sort).limit(limit + 1))
+    return build_page(docs, sort_field, limit, strip_id)
@@ -0,0 +1,136 @@
+"""
+Agent presence registry in Redis.
+
+  presence:agents              ZSET  admin_id -> last heartbeat (epoch seconds)
+  presence:connections         HASH  admin_id -> open websocket connections
+  presence:widget:<widget_id>  ZSET  admin_id -> last heartbeat, agents online for a widget
+  presence:memberships:<admin> SET   widgets the agent was registered under
+
+An agent is online while it has a heartbeat newer than PRESENCE['TTL'].
+Online counts are a ZCOUNT over the heartbeat range and the expiry sweep
+only touches members below the cutoff, so neither depends on how many keys
+the rest of Redis holds.  Every consumer (chat and notification sockets)
+goes through `agent_connected` / `heartbeat` / `agent_disconnected`;
+the last-connection removal runs as one script (`agent_disconnect` in
+utils/redis_scripts.py) so it cannot race a new connect.
+"""
+import logging
+import time
+
+from django.conf import settings
+
+from utils import redis_scripts
+from utils.redis_client import async_redis_client
+
+logger = logging.getLogger(__name__)
+
+AGENTS_KEY = "presence:agents"
+CONNECTIONS_KEY = "presence:connections"
+PRESENCE_TTL = getattr(settings, 'PRESENCE', {}).get('TTL', 3600)
+
+
+WIDGET_KEY_PREFIX = "presence:widget:"
+
+
+def widget_key(widget_id):
+    return f"{WIDGET_KEY_PREFIX}{widget_id}"
+
+
+def memberships_key(admin_id):
+    return f"presence:memberships:{admin_id}"
+
+
+def _cutoff():
+    return time.time() - PRESENCE_TTL
+
+
+async def heartbeat(admin_id, widget_ids=()):
+    """Refresh an agent's heartbeat, registering it under `widget_ids`"""
+    if not admin_id:
+        return
+    now = time.time()
+    pipe = async_redis_client.pipeline()
+    pipe.zadd(AGENTS_KEY, {admin_id: now})
+    for widget_id in widget_ids:
+        pipe.zadd(widget_key(widget_id), {admin_id: now})
+    if widget_ids:
+        pipe.sadd(memberships_key(admin_id), *widget_ids)
+    await pipe.execute()
+
+
+async def agent_connected(admin_id, widget_ids=()):
+    """Count a new connection and mark the agent online"""
+    if not admin_id:
+        return
+    await async_redis_client.hincrby(CONNECTIONS_KEY, admin_id, 1)
+    await heartbeat(admin_id, widget_ids)
+
+
+async def agent_disconnected(admin_id):
+    """Drop one connection; the agent goes offline when it was the last one"""
+    if not admin_id:
+        return
+    await redis_scripts.run(
+        'agent_disconnect',
+        [CONNECTIONS_KEY, AGENTS_KEY, memberships_key(admin_id)],
+        [admin_id, WIDGET_KEY_PREFIX]
+    )
+
+
+async def remove_agents(admin_ids):
+    """Take agents out of every presence structure"""
+    if not admin_ids:
+        return
+    pipe = async_redis_client.pipeline()
+    for admin_id in admin_ids:
+        pipe.smembers(memberships_key(admin_id))
+    memberships = await pipe.execute()
+
+    pipe = async_redis_client.pipeline()
+    for admin_id, widget_ids in zip(admin_ids, memberships):
+        for widget_id in widget_ids:
+            pipe.zrem(widget_key(widget_id), admin_id)
+        pipe.delete(memberships_key(admin_id))
+    pipe.zrem(AGENTS_KEY, *admin_ids)
+    pipe.hdel(CONNECTIONS_KEY, *admin_ids)
+    await pipe.execute()
+
+
+async def is_online(admin_id):
+    score = await async_redis_client.zscore(AGENTS_KEY, admin_id)
+    return score is not None and float(score) >= _cutoff()
+
+
+async def online_count(widget_id=None):
+    """Number of agents online, overall or for one widget"""
+    key = widget_key(widget_id) if widget_id else AGENTS_KEY
+    return int(await async_redis_client.zcount(key, _cutoff(), '+inf'))
+
+
+async def online_agents(widget_id=None):
+    key = widget_key(widget_id) if widget_id else AGENTS_KEY
+    return await async_redis_client.zrangebyscore(key, _cutoff(), '+inf')
+
+
+async def online_page(after=None, limit=200):
+    """
+    Up to `limit` online agents with a heartbeat newer than the score
+    `after`, oldest first, as (admin_id, score) pairs.
+    """
+    cutoff = _cutoff()
+    low = f"({after}" if after is not None and after >= cutoff else cutoff
+    return await async_redis_client.zrangebyscore(AGENTS_KEY, low, '+inf', start=0, num=limit, withscores=True)
+
+
+async def sweep_expired(limit=None):
+    """
+    Remove agents whose heartbeat expired (e.g. a worker died without
+    running disconnect), at most `limit` of them, oldest first.  Returns
+    the removed admin ids.
+    """
+    page = {'start': 0, 'num': limit} if limit else {}
+    expired = await async_redis_client.zrangebyscore(AGENTS_KEY, '-inf', f"({_cutoff()}", **page)
+    if expired:
+        await remove_agents(expired)
+        logger.debug(f"Presence sweep removed {len(expired)} agents")
+    return expired
@@ -0,0 +1,131 @@
+"""
+Token-bucket rate limiting in Redis, shared by consumers and views.
+
+A policy scope (RATE_LIMITS['<scope>']) holds one bucket per dimension,
+e.g. 'visitor', 'ip' and 'widget'.  Each bucket refills at `rate` tokens
+per `period` seconds and holds at most `burst` tokens.  A check takes one
+token from every bucket that applies, in a single Lua call: either all
+buckets have a token and all are charged, or none are and the caller gets
+the wait until the emptiest one refills.  Being one atomic script, the
+check has no read-then-write window for concurrent requests to slip
+through, and costs one round trip (the `token_bucket` script in
+utils/redis_scripts.py, called by SHA).
+
+When Redis is unreachable checks fail open, as the old limiters did.
+
+Per-IP buckets key on the client address resolved by `client_ip`: behind
+RATE_LIMIT_TRUSTED_PROXIES proxy hops the address is read from
+X-Forwarded-For, counting that many entries from the right (the ones our
+own proxies appended), so a client cannot pick its bucket by sending the
+header itself.
+"""
+import logging
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.http import JsonResponse
+from prometheus_client import Counter
+
+from utils import redis_scripts
+
+logger = logging.getLogger(__name__)
+
+rate_limited = Counter('rate_limited_total', 'Requests rejected by the rate limiter', ['scope', 'dimension'])
+
+
+def get_policy(scope):
+    return getattr(settings, 'RATE_LIMITS', {}).get(scope, {})
+
+
+def client_ip(peer, forwarded_for=None):
+    """Client address from the socket peer and the X-Forwarded-For header"""
+    hops = getattr(settings, 'RATE_LIMIT_TRUSTED_PROXIES', 0)
+    if hops and forwarded_for:
+        forwarded = [ip.strip() for ip in forwarded_for.split(',') if ip.strip()]
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return peer
+
+
+def scope_client_ip(scope):
+    """`client_ip` for a Channels connection scope"""
+    headers = dict(scope.get('headers') or [])
+    forwarded_for = headers.get(b'x-forwarded-for', b'').decode('latin-1')
+    return client_ip((scope.get('client') or (None,))[0], forwarded_for)
+
+
+def _bucket_args(scope, subjects):
+    """Keys and ARGV for the buckets of `scope` that have a subject"""
+    dimensions, keys, args = [], [], [time.time()]
+    for dimension, limit in get_policy(scope).items():
+        subject = subjects.get(dimension)
+        if not subject:
+            continue
+        dimensions.append(dimension)
+        keys.append(f"rate:{scope}:{dimension}:{subject}")
+        args += [limit['rate'] / limit.get('period', 1), limit.get('burst', limit['rate'])]
+    return dimensions, keys, args
+
+
+def _result(scope, dimensions, raw):
+    """(allowed, retry_after seconds) from the script's reply"""
+    if raw == '0':
+        return True, 0
+    wait, _, index = raw.partition(':')
+    rate_limited.labels(scope, dimensions[int(index) - 1]).inc()
+    return False, float(wait)
+
+
+async def check(scope, **subjects):
+    """
+    Take a token for `scope` from the bucket of every dimension given in
+    `subjects` (e.g. visitor=room_id, ip=..., widget=widget_id).
+    """
+    dimensions, keys, args = _bucket_args(scope, subjects)
+    if not keys:
+        return True, 0
+    try:
+        return _result(scope, dimensions, await redis_scripts.run('token_bucket', keys, args))
+    except Exception as e:
+        logger.error(f"Rate limit check for {scope} failed: {e}")
+        return True, 0
+
+
+def check_sync(scope, **subjects):
+    dimensions, keys, args = _bucket_args(scope, subjects)
+    if not keys:
+        return True, 0
+    try:
+        return _result(scope, dimensions, redis_scripts.run_sync('token_bucket', keys, args))
+    except Exception as e:
+        logger.error(f"Rate limit check for {scope} failed: {e}")
+        return True, 0
+
+
+def rate_limit(scope):
+    """
+    View decorator limiting by client IP (plus `widget_id` when the URL has
+    one) under RATE_LIMITS[scope]; answers 429 with Retry-After.
+    Disabled when DEBUG is on.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped_view(request, *args, **kwargs):
+            if not settings.DEBUG:
+                allowed, retry_after = check_sync(
+                    scope,
+                    ip=client_ip(request.META.get('REMOTE_ADDR'), request.META.get('HTTP_X_FORWARDED_FOR')),
+                    widget=kwargs.get('widget_id'),
+                )
+                if not allowed:
+                    response = JsonResponse({
+                        'error': 'Too many requests',
+                        'retry_after': retry_after
+                    }, status=429)
+                    response['Retry-After'] = str(max(1, round(retry_after)))
+                    return response
+
+            return view_func(request, *args, **kwargs)
+        return wrapped_view
+    return decorator
@@ -1,10 +1,55 @@
+"""
+Shared Redis clients.
+
+`async_redis_client` is for consumers and any other code running on the
+event loop; `redis_client` is the synchronous facade for Django views and
+management commands. Both use one settings-driven connection pool each
+(REDIS_URL, or REDIS_USER/REDIS_PASSWORD/REDIS_HOST/REDIS_PORT, plus the
+timeouts in REDIS_SETTINGS).
+"""
+import os
+
 import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+def _setting(name, default=None):
+    # Fall back to the environment for standalone scripts (e.g. migrate_all.py)
+    try:
+        return getattr(settings, name, default)
+    except ImproperlyConfigured:
+        return os.getenv(name, default)
+
+
+def get_redis_url():
+    redis_url = _setting('REDIS_URL')
+    if redis_url:
+        return redis_url
+
+    user = _setting('REDIS_USER', 'default')
+    password = _setting('REDIS_PASSWORD', '')
+    host = _setting('REDIS_HOST', '127.0.0.1')
+    port = _setting('REDIS_PORT', '6379')
+    auth = f"{user}:{password}@" if password else ""
+    return f"redis://{auth}{host}:{port}/0"
+
+
+def get_pool_kwargs():
+    options = _setting('REDIS_SETTINGS', None) or {}
+    return {
+        'decode_responses': True,
+        'max_connections': int(options.get('MAX_CONNECTIONS', 100)),
+        'socket_connect_timeout': options.get('SOCKET_CONNECT_TIMEOUT', 5),
+        'socket_timeout': options.get('SOCKET_TIMEOUT', 5),
+        'retry_on_timeout': options.get('RETRY_ON_TIMEOUT', True),
+        'health_check_interval': options.get('HEALTH_CHECK_INTERVAL', 30),
+    }
+
+
+redis_pool = redis.ConnectionPool.from_url(get_redis_url(), **get_pool_kwargs())
+redis_client = redis.Redis(connection_pool=redis_pool)
 
-redis_client = redis.StrictRedis(
-    host='localhost',
-    port=6379,
-    db=0,
-    # username='default',
-    # password='Geeks@1302',
-    decode_responses=True
-)
+async_redis_pool = aioredis.ConnectionPool.from_url(get_redis_url(), **get_pool_kwargs())
+async_redis_client = aioredis.Redis(connection_pool=async_redis_pool)
@@ -0,0 +1,181 @@
+"""
+Lua scripts run by Redis, loaded once and called by SHA.
+
+`load_all()` runs SCRIPT LOAD for every script when the process starts
+(chat/consumers.py calls it next to the startup ping); after that each
+call is a single EVALSHA.  If Redis lost its script cache (restart,
+SCRIPT FLUSH) the script is reloaded on the NOSCRIPT error and the call
+retried once.
+
+  token_bucket      rate-limit buckets (utils/rate_limit.py)
+  unread_adjust     unread counters in widget_unread:<widget_id> hashes
+                    (utils/room_index.py)
+  room_index_swap   install a rebuilt room index (utils/room_index.py)
+  agent_disconnect  drop one agent connection, going offline on the last
+                    (utils/presence.py)
+  cache_store       write a cache entry unless it was invalidated
+                    meanwhile (utils/cache.py)
+  release_lock      delete a lock only if this holder still owns it
+"""
+import hashlib
+import logging
+
+from redis.exceptions import NoScriptError
+
+from utils.redis_client import async_redis_client, redis_client
+
+logger = logging.getLogger(__name__)
+
+# KEYS: one bucket per dimension
+# ARGV: now, then (tokens per second, burst) for each key
+# Returns '0' when allowed, otherwise "<seconds to wait>:<index of the limiting key>"
+TOKEN_BUCKET = """
+local now = tonumber(ARGV[1])
+local levels = {}
+local wait, limiting = 0, 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local level = tonumber(state[1]) or burst
+    local elapsed = math.max(0, now - (tonumber(state[2]) or now))
+    level = math.min(burst, level + elapsed * rate)
+    levels[i] = level
+    if level < 1 and (1 - level) / rate > wait then
+        wait, limiting = (1 - level) / rate, i
+    end
+end
+if wait > 0 then
+    return string.format('%.3f:%d', wait, limiting)
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', key, 'tokens', levels[i] - 1, 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+end
+return '0'
+"""
+
+# KEYS: widget_unread hashes, one per change (repeats allowed)
+# ARGV: (room_id, delta) for each key; a delta of 'reset' clears the count
+# The count never goes below zero and a room at zero is removed from the hash.
+# Returns {count before, count after} for each change, flattened.
+UNREAD_ADJUST = """
+local results = {}
+for i, key in ipairs(KEYS) do
+    local room_id = ARGV[i * 2 - 1]
+    local delta = ARGV[i * 2]
+    local previous = tonumber(redis.call('HGET', key, room_id)) or 0
+    local count = 0
+    if delta ~= 'reset' then
+        count = math.max(0, previous + tonumber(delta))
+    end
+    if count > 0 then
+        redis.call('HSET', key, room_id, count)
+    else
+        redis.call('HDEL', key, room_id)
+    end
+    results[#results + 1] = previous
+    results[#results + 1] = count
+end
+return results
+"""
+
+# KEYS: live rooms ZSET, live unread HASH, rebuilt rooms ZSET, rebuilt unread HASH, ready flag
+# ARGV: time the rebuild started
+# Rooms touched on the live index after the rebuild started keep their newer
+# score; then the rebuilt keys replace the live ones in one step.
+ROOM_INDEX_SWAP = """
+local recent = redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[1], '+inf', 'WITHSCORES')
+for i = 1, #recent, 2 do
+    local current = tonumber(redis.call('ZSCORE', KEYS[3], recent[i]))
+    if not current or current < tonumber(recent[i + 1]) then
+        redis.call('ZADD', KEYS[3], recent[i + 1], recent[i])
+    end
+end
+for i = 1, 2 do
+    if redis.call('EXISTS', KEYS[i + 2]) == 1 then
+        redis.call('RENAME', KEYS[i + 2], KEYS[i])
+        redis.call('PERSIST', KEYS[i])
+    else
+        redis.call('DEL', KEYS[i])
+    end
+end
+redis.call('SET', KEYS[5], 1)
+return 1
+"""
+
+# KEYS: connections HASH, agents ZSET, the agent's memberships SET
+# ARGV: admin_id, widget presence key prefix
+# Decrements the agent's connection count; when it reaches zero the agent
+# is removed everywhere in the same step, so a concurrent connect can't be
+# wiped.  Returns the remaining connections.
+AGENT_DISCONNECT = """
+local remaining = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if remaining > 0 then
+    return remaining
+end
+for _, widget_id in ipairs(redis.call('SMEMBERS', KEYS[3])) do
+    redis.call('ZREM', ARGV[2] .. widget_id, ARGV[1])
+end
+redis.call('DEL', KEYS[3])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[1], ARGV[1])
+return 0
+"""
+
+# KEYS: cache entry, its generation counter
+# ARGV: generation read before loading, TTL (0 stores nothing), JSON value
+# Returns 1 if the generation is unchanged (and the entry was written), else 0.
+CACHE_STORE = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+if tonumber(ARGV[2]) > 0 then
+    redis.call('SETEX', KEYS[1], ARGV[2], ARGV[3])
+end
+return 1
+"""
+
+# KEYS: lock; ARGV: holder token
+RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+SCRIPTS = {
+    'token_bucket': TOKEN_BUCKET,
+    'unread_adjust': UNREAD_ADJUST,
+    'room_index_swap': ROOM_INDEX_SWAP,
+    'release_lock': RELEASE_LOCK,
+    'agent_disconnect': AGENT_DISCONNECT,
+    'cache_store': CACHE_STORE,
+}
+SHAS = {name: hashlib.sha1(source.encode()).hexdigest() for name, source in SCRIPTS.items()}
+
+
+def load_all():
+    """SCRIPT LOAD every script so the first calls skip the NOSCRIPT retry"""
+    for name, source in SCRIPTS.items():
+        if redis_client.script_load(source) != SHAS[name]:
+            logger.warning(f"Redis returned an unexpected SHA for script {name}")
+    logger.info(f"[REDIS] Loaded {len(SCRIPTS)} Lua scripts")
+
+
+def run_sync(name, keys=(), args=()):
+    try:
+        return redis_client.evalsha(SHAS[name], len(keys), *keys, *args)
+    except NoScriptError:
+        redis_client.script_load(SCRIPTS[name])
+        return redis_client.evalsha(SHAS[name], len(keys), *keys, *args)
+
+
+async def run(name, keys=(), args=()):
+    try:
+        return await async_redis_client.evalsha(SHAS[name], len(keys), *keys, *args)
+    except NoScriptError:
+        await async_redis_client.script_load(SCRIPTS[name])
+        return await async_redis_client.evalsha(SHAS[name], len(keys), *keys, *args)
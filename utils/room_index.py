@@ -0,0 +1,393 @@
+"""
+Per-widget room index in Redis.
+
+For every widget three structures are kept current by the chat write path:
+
+  widget_rooms:<widget_id>   ZSET  room_id -> last activity (epoch seconds), active rooms only
+  widget_unread:<widget_id>  HASH  room_id -> unread count (rooms with 0 unread are absent)
+  widget_live:<widget_id>    ZSET  room_id -> visitor connect time (entries older than LIVE_TTL are stale)
+
+Room lists, unread totals and live-visitor lookups are answered from these
+with a handful of O(log n) calls instead of loading every active room from
+Mongo.  A widget's index is rebuilt from Mongo the first time it is read
+after Redis lost it (see `ensure_indexed`): one reader takes the widget's
+rebuild lock and builds into temporary keys that are swapped in atomically,
+while other readers wait for it to finish.
+
+Unread counts are only changed through the `unread_adjust` script
+(utils/redis_scripts.py), so a decrement can neither go negative nor drop
+an increment that lands between its read and its write.
+"""
+import asyncio
+import datetime
+import logging
+import time
+import uuid
+
+from utils import redis_scripts
+from utils.executor import run_blocking
+from utils.redis_client import async_redis_client, redis_client
+
+logger = logging.getLogger(__name__)
+
+LIVE_TTL = 3600  # seconds a connect marks a visitor live, same as the old live_visitor:<room> keys
+REBUILD_CHUNK = 1000
+REBUILD_LOCK_TTL = 300  # seconds; also the lifetime of abandoned temporary keys
+REBUILD_WAIT = 10  # seconds a reader waits for another worker's rebuild
+
+
+def rooms_key(widget_id):
+    return f"widget_rooms:{widget_id}"
+
+
+def unread_key(widget_id):
+    return f"widget_unread:{widget_id}"
+
+
+def live_key(widget_id):
+    return f"widget_live:{widget_id}"
+
+
+def ready_key(widget_id):
+    return f"widget_index_ready:{widget_id}"
+
+
+def lock_key(widget_id):
+    return f"widget_index_lock:{widget_id}"
+
+
+def rebuild_key(key):
+    return f"widget_index_tmp:{key}"
+
+
+def activity_score(ts):
+    if isinstance(ts, datetime.datetime):
+        return ts.replace(tzinfo=datetime.timezone.utc).timestamp() if ts.tzinfo is None else ts.timestamp()
+    return 0
+
+
+# Write path
+
+async def touch_room(widget_id, room_id, ts=None, only_new=False):
+    """Record room activity; with `only_new` just make sure the room is indexed"""
+    if widget_id:
+        score = activity_score(ts or datetime.datetime.utcnow())
+        await async_redis_client.zadd(rooms_key(widget_id), {room_id: score}, nx=only_new)
+
+
+async def remove_room(widget_id, room_id):
+    """Drop a room that is no longer active from every structure"""
+    if not widget_id:
+        return
+    pipe = async_redis_client.pipeline()
+    pipe.zrem(rooms_key(widget_id), room_id)
+    pipe.hdel(unread_key(widget_id), room_id)
+    pipe.zrem(live_key(widget_id), room_id)
+    await pipe.execute()
+
+
+def _unread_changes(changes):
+    """Script KEYS/ARGV for (widget_id, room_id, delta) changes, skipping rooms without a widget"""
+    keys, args = [], []
+    for widget_id, room_id, delta in changes:
+        if widget_id:
+            keys.append(unread_key(widget_id))
+            args.extend([room_id, delta])
+    return keys, args
+
+
+def _unread_results(changes, results):
+    """(previous, new) per change, (0, 0) for the skipped widget-less ones"""
+    pairs = iter(zip(results[::2], results[1::2]))
+    return [tuple(int(n) for n in next(pairs)) if widget_id else (0, 0) for widget_id, _, _ in changes]
+
+
+async def adjust_unread_many(changes):
+    """
+    Apply (widget_id, room_id, delta) changes in one atomic script call; a
+    delta of 'reset' clears the count.  Returns the (previous, new) counts
+    of each change, in order.
+    """
+    changes = list(changes)
+    keys, args = _unread_changes(changes)
+    results = await redis_scripts.run('unread_adjust', keys, args) if keys else []
+    return _unread_results(changes, results)
+
+
+async def adjust_unread(widget_id, room_id, delta):
+    return (await adjust_unread_many([(widget_id, room_id, delta)]))[0]
+
+
+async def increment_unread(widget_id, room_id, amount=1):
+    """Add to a room's unread count; returns the new count"""
+    return (await adjust_unread(widget_id, room_id, amount))[1]
+
+
+async def decrement_unread(widget_id, room_id):
+    """
+    Subtract one unread message; returns the new count, or None when the
+    room had nothing unread (so there was nothing to take away)
+    """
+    previous, count = await adjust_unread(widget_id, room_id, -1)
+    return count if previous > 0 else None
+
+
+async def reset_unread(widget_id, room_id):
+    await adjust_unread(widget_id, room_id, 'reset')
+
+
+async def set_live(widget_id, room_id, is_live, ts=None):
+    if not widget_id:
+        return
+    if is_live:
+        await async_redis_client.zadd(live_key(widget_id), {room_id: activity_score(ts or datetime.datetime.utcnow())})
+    else:
+        await async_redis_client.zrem(live_key(widget_id), room_id)
+
+
+# Read path
+
+async def get_unread(widget_id, room_id):
+    if not widget_id:
+        return 0
+    return int(await async_redis_client.hget(unread_key(widget_id), room_id) or 0)
+
+
+async def room_states(rooms):
+    """
+    Unread count and live flag for `rooms` (dicts with room_id/widget_id),
+    as two lists in the same order.
+    """
+    cutoff = time.time() - LIVE_TTL
+    pipe = async_redis_client.pipeline()
+    for room in rooms:
+        widget_id = room.get('widget_id')
+        pipe.hget(unread_key(widget_id), room['room_id'])
+        pipe.zscore(live_key(widget_id), room['room_id'])
+    results = await pipe.execute() if rooms else []
+    unread = [int(count or 0) for count in results[::2]]
+    live = [score is not None and float(score) >= cutoff for score in results[1::2]]
+    return unread, live
+
+
+async def live_rooms(widget_ids):
+    """room_id -> widget_id for rooms with a live visitor (prunes stale entries)"""
+    cutoff = time.time() - LIVE_TTL
+    pipe = async_redis_client.pipeline()
+    for widget_id in widget_ids:
+        pipe.zremrangebyscore(live_key(widget_id), '-inf', f"({cutoff}")
+        pipe.zrange(live_key(widget_id), 0, -1)
+    results = await pipe.execute() if widget_ids else []
+    live = {}
+    for widget_id, members in zip(widget_ids, results[1::2]):
+        for room_id in members:
+            live[room_id] = widget_id
+    return live
+
+
+async def unread_counts(widget_ids):
+    """room_id -> (widget_id, unread) for every room with unread messages"""
+    pipe = async_redis_client.pipeline()
+    for widget_id in widget_ids:
+        pipe.hgetall(unread_key(widget_id))
+    results = await pipe.execute() if widget_ids else []
+    counts = {}
+    for widget_id, hashed in zip(widget_ids, results):
+        for room_id, count in hashed.items():
+            if int(count) > 0:
+                counts[room_id] = (widget_id, int(count))
+    return counts
+
+
+async def count_rooms(widget_ids):
+    pipe = async_redis_client.pipeline()
+    for widget_id in widget_ids:
+        pipe.zcard(rooms_key(widget_id))
+    return sum(await pipe.execute()) if widget_ids else 0
+
+
+async def room_ids(widget_ids):
+    """Every indexed (active) room across `widget_ids`"""
+    pipe = async_redis_client.pipeline()
+    for widget_id in widget_ids:
+        pipe.zrange(rooms_key(widget_id), 0, -1)
+    return [room_id for members in (await pipe.execute() if widget_ids else []) for room_id in members]
+
+
+def _encode_cursor(score, room_id):
+    return f"{score!r}:{room_id}"
+
+
+def _decode_cursor(cursor):
+    score, _, room_id = cursor.partition(':')
+    return float(score), room_id
+
+
+async def page_rooms(widget_ids, limit, cursor=None):
+    """
+    Most recently active rooms across `widget_ids`, newest first.
+
+    Returns `([(room_id, widget_id, score)], next_cursor)`.  Each widget is
+    read with ZREVRANGEBYSCORE from the cursor down, so a page costs
+    O(log n + limit) per widget whatever its depth.
+    """
+    max_score, after_room = ('+inf', None) if not cursor else _decode_cursor(cursor)
+
+    # Rooms tied with the cursor score may be skipped, so over-fetch by the tie count
+    pipe = async_redis_client.pipeline()
+    for widget_id in widget_ids:
+        if after_room is not None:
+            pipe.zcount(rooms_key(widget_id), max_score, max_score)
+    ties = await pipe.execute() if after_room is not None and widget_ids else [0] * len(widget_ids)
+
+    pipe = async_redis_client.pipeline()
+    for widget_id, tie_count in zip(widget_ids, ties):
+        pipe.zrevrangebyscore(rooms_key(widget_id), max_score, '-inf', start=0, num=limit + 1 + tie_count, withscores=True)
+    results = await pipe.execute() if widget_ids else []
+
+    merged = []
+    for widget_id, members in zip(widget_ids, results):
+        for room_id, score in members:
+            # Equal scores come back in descending member order
+            if after_room is not None and score == max_score and room_id >= after_room:
+                continue
+            merged.append((room_id, widget_id, score))
+    merged.sort(key=lambda item: (item[2], item[0]), reverse=True)
+
+    page = merged[:limit]
+    next_cursor = _encode_cursor(page[-1][2], page[-1][0]) if len(merged) > limit else None
+    return page, next_cursor
+
+
+async def ensure_indexed(widget_ids):
+    """Rebuild the index of any widget whose Redis structures are missing"""
+    if not widget_ids:
+        return
+    pipe = async_redis_client.pipeline()
+    for widget_id in widget_ids:
+        pipe.exists(ready_key(widget_id))
+    ready = await pipe.execute()
+    for widget_id, is_ready in zip(widget_ids, ready):
+        if not is_ready:
+            await run_blocking(rebuild_widget_index, widget_id)
+            await _wait_for_rebuild(widget_id)
+
+
+async def _wait_for_rebuild(widget_id):
+    """Wait (bounded) while another worker holds the widget's rebuild lock"""
+    deadline = time.monotonic() + REBUILD_WAIT
+    while time.monotonic() < deadline:
+        pipe = async_redis_client.pipeline()
+        pipe.exists(ready_key(widget_id))
+        pipe.exists(lock_key(widget_id))
+        is_ready, is_locked = await pipe.execute()
+        if is_ready or not is_locked:
+            return
+        await asyncio.sleep(0.1)
+    logger.warning(f"Room index for widget {widget_id} still rebuilding after {REBUILD_WAIT}s")
+
+
+# Sync helpers (views, management commands)
+
+def get_unread_sync(widget_id, room_id):
+    if not widget_id:
+        return 0
+    return int(redis_client.hget(unread_key(widget_id), room_id) or 0)
+
+
+def adjust_unread_many_sync(changes):
+    changes = list(changes)
+    keys, args = _unread_changes(changes)
+    results = redis_scripts.run_sync('unread_adjust', keys, args) if keys else []
+    return _unread_results(changes, results)
+
+
+def adjust_unread_sync(widget_id, room_id, delta):
+    return adjust_unread_many_sync([(widget_id, room_id, delta)])[0]
+
+
+def reset_unread_sync(widget_id, room_id):
+    adjust_unread_sync(widget_id, room_id, 'reset')
+
+
+def ensure_indexed_sync(widget_id):
+    """Rebuild a widget's index if Redis lost it; a rebuild already running elsewhere is not waited for"""
+    if widget_id and not redis_client.exists(ready_key(widget_id)):
+        rebuild_widget_index(widget_id)
+
+
+def widget_room_ids_sync(widget_id):
+    return redis_client.zrange(rooms_key(widget_id), 0, -1)
+
+
+def count_rooms_sync(widget_id):
+    return redis_client.zcard(rooms_key(widget_id))
+
+
+def rooms_active_since_sync(widget_id, since):
+    """Rooms with activity at or after the datetime `since`"""
+    return redis_client.zrangebyscore(rooms_key(widget_id), activity_score(since), '+inf')
+
+
+def unread_total_sync(widget_id):
+    return sum(int(count) for count in redis_client.hvals(unread_key(widget_id)))
+
+
+def rebuild_widget_index(widget_id):
+    """
+    Load a widget's active rooms and unread counts from Mongo into Redis.
+
+    Builds into temporary keys and swaps them in with `room_index_swap`, so
+    readers never see a half-built index and rooms touched meanwhile keep
+    their newer activity.  Returns the number of rooms indexed, or None when
+    another worker holds the rebuild lock.
+    """
+    from wish_bot.db import get_room_collection
+
+    token = uuid.uuid4().hex
+    if not redis_client.set(lock_key(widget_id), token, nx=True, ex=REBUILD_LOCK_TTL):
+        logger.debug(f"Room index for widget {widget_id} is already being rebuilt")
+        return None
+
+    try:
+        started = time.time()
+        live_rooms, live_unread = rooms_key(widget_id), unread_key(widget_id)
+        tmp_rooms, tmp_unread = rebuild_key(live_rooms), rebuild_key(live_unread)
+        projection = {'_id': 0, 'room_id': 1, 'last_timestamp': 1, 'created_at': 1, 'unread_count': 1}
+
+        pipe = redis_client.pipeline()
+        pipe.delete(tmp_rooms, tmp_unread)
+        indexed = 0
+        for room in get_room_collection().find({'widget_id': widget_id, 'is_active': True}, projection):
+            pipe.zadd(tmp_rooms, {room['room_id']: activity_score(room.get('last_timestamp') or room.get('created_at'))})
+            if room.get('unread_count'):
+                pipe.hset(tmp_unread, room['room_id'], int(room['unread_count']))
+            indexed += 1
+            if indexed % REBUILD_CHUNK == 0:
+                pipe.expire(tmp_rooms, REBUILD_LOCK_TTL)
+                pipe.expire(tmp_unread, REBUILD_LOCK_TTL)
+                pipe.execute()
+                pipe = redis_client.pipeline()
+        pipe.execute()
+
+        # Re-read the unread counts of rooms that had activity while building
+        recent = redis_client.zrangebyscore(live_rooms, started - 1, '+inf')
+        if recent:
+            pipe = redis_client.pipeline()
+            for room in get_room_collection().find({'room_id': {'$in': recent}}, {'_id': 0, 'room_id': 1, 'unread_count': 1}):
+                if room.get('unread_count'):
+                    pipe.hset(tmp_unread, room['room_id'], int(room['unread_count']))
+                else:
+                    pipe.hdel(tmp_unread, room['room_id'])
+            pipe.execute()
+
+        redis_scripts.run_sync(
+            'room_index_swap',
+            [live_rooms, live_unread, tmp_rooms, tmp_unread, ready_key(widget_id)],
+            [started - 1]
+        )
+    finally:
+        redis_scripts.run_sync('release_lock', [lock_key(widget_id)], [token])
+
+    logger.info(f"Rebuilt room index for widget {widget_id}: {indexed} rooms")
+    return indexed
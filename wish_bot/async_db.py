@@ -0,0 +1,268 @@
+"""
+Async MongoDB data-access layer for the Channels consumers.
+
+Built on pymongo's native asyncio client so consumers can await queries
+directly instead of hopping to a worker thread through sync_to_async.
+Documents are returned in exactly the same shape as the synchronous
+`wish_bot.db` getters; indexes are still owned by the sync registry.
+"""
+import os
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+from pymongo import AsyncMongoClient, ReturnDocument
+from pymongo.server_api import ServerApi
+
+from utils.executor import run_blocking
+from utils.pagination import build_page, keyset_query
+from wish_bot.db import build_room_summary_update, get_collection
+
+load_dotenv()
+
+_async_mongo_client = None
+_ensured_collections = set()
+
+
+def get_async_mongo_client():
+    global _async_mongo_client
+    if _async_mongo_client is None:
+        uri = os.getenv('MONGO_URI')
+        if not uri:
+            raise ValueError("MONGO_URI not set in environment variables")
+        _async_mongo_client = AsyncMongoClient(uri, server_api=ServerApi('1'))
+    return _async_mongo_client
+
+
+async def get_async_collection(name):
+    """Async handle for `name`; indexes are bootstrapped once via wish_bot.db"""
+    if name not in _ensured_collections:
+        await run_blocking(get_collection, name, timeout=None)
+        _ensured_collections.add(name)
+    return get_async_mongo_client()['wish_bot_db'][name]
+
+
+async def insert_with_timestamps(collection, document):
+    """Insert a document with created_at and updated_at timestamps in UTC"""
+    current_time = datetime.now(timezone.utc)
+    document['created_at'] = current_time
+    document['updated_at'] = current_time
+    return await collection.insert_one(document)
+
+
+# Rooms
+
+async def find_room(room_id, projection=None):
+    collection = await get_async_collection('rooms')
+    return await collection.find_one({'room_id': room_id}, projection)
+
+
+async def find_rooms(room_ids, projection=None):
+    collection = await get_async_collection('rooms')
+    return await collection.find({'room_id': {'$in': list(room_ids)}}, projection).to_list(None)
+
+
+async def find_active_rooms(widget_ids=None, projection=None, sort=None, assigned_agent=None):
+    collection = await get_async_collection('rooms')
+    query = {'is_active': True}
+    if widget_ids is not None:
+        query['widget_id'] = {'$in': widget_ids}
+    if assigned_agent is not None:
+        query['assigned_agent'] = assigned_agent
+    cursor = collection.find(query, projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    return await cursor.to_list(None)
+
+
+async def set_room_active(room_id, status, reset_unread=False):
+    collection = await get_async_collection('rooms')
+    fields = {'is_active': status}
+    if reset_unread:
+        fields['unread_count'] = 0
+    return await collection.update_one(
+        {'room_id': room_id},
+        {'$set': fields},
+        upsert=True
+    )
+
+
+async def record_room_message(room_id, message, sender, timestamp, increment_unread=False, sender_type=None,
+                              message_id=None):
+    """
+    Atomically update the room's last-message summary and counters.
+
+    Returns the response-tracking fields as they were *before* the update
+    (customer messages still awaiting a reply, first customer/response time).
+    """
+    collection = await get_async_collection('rooms')
+    return await collection.find_one_and_update(
+        {'room_id': room_id},
+        build_room_summary_update(message, sender, timestamp, increment_unread, sender_type, message_id),
+        projection={
+            '_id': 0, 'room_id': 1, 'awaiting_customer_ts': 1, 'awaiting_customer_ids': 1,
+            'first_customer_at': 1, 'first_response_at': 1,
+        },
+        return_document=ReturnDocument.BEFORE
+    )
+
+
+async def record_room_responses(room_id, response_times):
+    collection = await get_async_collection('rooms')
+    return await collection.update_one(
+        {'room_id': room_id},
+        {'$inc': {'response_count': len(response_times), 'response_time_sum': sum(response_times)}}
+    )
+
+
+async def set_first_response(room_id, responded_at, seconds):
+    """Stamp the room's first agent response once; returns True if this call set it"""
+    collection = await get_async_collection('rooms')
+    result = await collection.update_one(
+        {'room_id': room_id, 'first_response_at': None},
+        {'$set': {'first_response_at': responded_at, 'first_response_seconds': seconds}}
+    )
+    return result.modified_count > 0
+
+
+async def reset_room_unread(room_id):
+    collection = await get_async_collection('rooms')
+    return await collection.update_one({'room_id': room_id}, {'$set': {'unread_count': 0}})
+
+
+async def reset_rooms_unread(room_ids):
+    collection = await get_async_collection('rooms')
+    return await collection.update_many({'room_id': {'$in': list(room_ids)}}, {'$set': {'unread_count': 0}})
+
+
+async def decrement_room_unread(room_id):
+    """Decrement the unread counter, never below zero"""
+    collection = await get_async_collection('rooms')
+    return await collection.update_one(
+        {'room_id': room_id, 'unread_count': {'$gt': 0}},
+        {'$inc': {'unread_count': -1}}
+    )
+
+
+# Messages
+
+async def insert_message(document):
+    collection = await get_async_collection('messages')
+    return await insert_with_timestamps(collection, document)
+
+
+async def set_message_fields(message_id, fields):
+    collection = await get_async_collection('messages')
+    return await collection.update_one({'message_id': message_id}, {'$set': fields})
+
+
+async def delete_message(message_id):
+    collection = await get_async_collection('messages')
+    return await collection.delete_one({'message_id': message_id})
+
+
+async def find_recent_messages(room_id, limit=50):
+    """Newest-first page of messages for a room"""
+    collection = await get_async_collection('messages')
+    cursor = collection.find({'room_id': room_id}).sort([('timestamp', -1), ('_id', -1)]).limit(limit)
+    return await cursor.to_list(None)
+
+
+async def find_messages_page(room_id, limit=50, cursor=None):
+    """Keyset page of a room's messages, newest first; returns (messages, next_cursor)"""
+    collection = await get_async_collection('messages')
+    query, sort = keyset_query({'room_id': room_id}, 'timestamp', cursor)
+    docs = await collection.find(query).sort(sort).limit(limit + 1).to_list(None)
+    return build_page(docs, 'timestamp', limit)
+
+
+async def mark_message_seen(room_id, message_id, seen_at):
+    collection = await get_async_collection('messages')
+    return await collection.update_one(
+        {'message_id': message_id, 'room_id': room_id},
+        {'$set': {'seen': True, 'seen_at': seen_at}}
+    )
+
+
+async def mark_room_messages_seen(room_id, seen_at):
+    collection = await get_async_collection('messages')
+    return await collection.update_many(
+        {'room_id': room_id, 'seen': False, 'sender': {'$ne': 'agent'}},
+        {'$set': {'seen': True, 'seen_at': seen_at}}
+    )
+
+
+async def mark_rooms_messages_seen(room_ids, seen_at):
+    collection = await get_async_collection('messages')
+    return await collection.update_many(
+        {'room_id': {'$in': list(room_ids)}, 'seen': False, 'sender': {'$ne': 'agent'}},
+        {'$set': {'seen': True, 'seen_at': seen_at}}
+    )
+
+
+# Contacts
+
+async def insert_contact(document):
+    collection = await get_async_collection('contacts')
+    return await insert_with_timestamps(collection, document)
+
+
+async def find_contact_by_room(room_id):
+    collection = await get_async_collection('contacts')
+    return await collection.find_one({'room_id': room_id})
+
+
+async def find_contacts_by_rooms(room_ids):
+    """Map room_id -> contact document for several rooms in one query"""
+    collection = await get_async_collection('contacts')
+    contacts = await collection.find({'room_id': {'$in': list(room_ids)}}).to_list(None)
+    by_room = {}
+    for contact in contacts:
+        by_room.setdefault(contact['room_id'], contact)
+    return by_room
+
+
+async def count_contacts(query):
+    collection = await get_async_collection('contacts')
+    return await collection.count_documents(query)
+
+
+# Agent rollups
+
+async def increment_agent_rollup(rollup_filter, update):
+    collection = await get_async_collection('agent_daily_stats')
+    return await collection.update_one(rollup_filter, update, upsert=True)
+
+
+# Admins
+
+async def find_admin(admin_id, projection=None):
+    collection = await get_async_collection('admins')
+    return await collection.find_one({'admin_id': admin_id}, projection)
+
+
+async def find_admins(query=None, projection=None):
+    collection = await get_async_collection('admins')
+    return await collection.find(query or {}, projection).to_list(None)
+
+
+# Widgets
+
+async def find_widget_ids():
+    collection = await get_async_collection('widgets')
+    widgets = await collection.find({}, {'widget_id': 1}).to_list(None)
+    return [w['widget_id'] for w in widgets if 'widget_id' in w]
+
+
+# Triggers
+
+async def find_active_triggers(widget_id):
+    collection = await get_async_collection('triggers')
+    cursor = collection.find({'widget_id': widget_id, 'is_active': True}).sort('order', 1)
+    return await cursor.to_list(None)
+
+
+# Shortcuts
+
+async def find_shortcut(shortcut_id):
+    collection = await get_async_collection('shortcuts')
+    return await collection.find_one({'shortcut_id': shortcut_id})
@@ -4,13 +4,12 @@ import os
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from datetime import datetime, timezone
-import redis
+import threading
 
 load_dotenv()
 
 # Singleton MongoClient
 _mongo_client = None
-_redis_client = None
 
 def get_mongo_client():
     global _mongo_client
@@ -28,40 +27,10 @@ def get_mongo_client():
             raise
     return _mongo_client
 
-_redis_client = None
-
 def get_redis_client():
-    global _redis_client
-    if _redis_client is None:
-        redis_url = getattr(settings, 'REDIS_URL', None)
-        try:
-            if redis_url:
-                # If using TLS, change to rediss:// in settings
-                _redis_client = redis.from_url(redis_url, decode_responses=True)
-            else:
-                # Fallback to basic settings
-                _redis_client = redis.StrictRedis(
-                    host=getattr(settings, 'REDIS_HOST', 'localhost'),
-                    port=int(getattr(settings, 'REDIS_PORT', 6379)),
-                    db=0,
-                    decode_responses=True
-                )
-            _redis_client.ping()
-            print("Connected to Redis!")
-        except redis.ConnectionError as e:
-            print(f"Redis connection error: {e}")
-            if "No such host" in str(e):
-                print("Error: Redis hostname not found. Ensure REDIS_URL is correct.")
-            elif "SSL" in str(e):
-                print("Error: SSL/TLS issue. Use rediss:// for TLS and verify SSL support.")
-            _redis_client = None
-            raise
-        except redis.AuthenticationError as e:
-            print(f"Redis authentication error: {e}")
-            print("Error: Check username and password in REDIS_URL.")
-            _redis_client = None
-            raise
-    return _redis_client
+    """Sync Redis client backed by the shared pool in utils.redis_client"""
+    from utils.redis_client import redis_client
+    return redis_client
 
 
 def find_duplicates(collection, field):
@@ -78,158 +47,77 @@ def remove_duplicates(collection, field):
         collection.delete_many({"_id": {"$in": ids_to_delete}})
     print(f"Removed {len(duplicates)} duplicate {field} entries.")
 
-def get_chat_collection():
-    client = get_mongo_client()
-    db = client['wish_bot_db']
-    collection = db['messages']
-    
-    existing_indexes = collection.index_information()
-    
-    if 'message_id_1' in existing_indexes:
-        if not existing_indexes['message_id_1'].get('unique', False):
-            collection.drop_index('message_id_1')
-            remove_duplicates(collection, 'message_id')
-            collection.create_index([('message_id', 1)], unique=True, name='message_id_1')
+# Collection registry
+#
+# Collection handles are cached per process and their indexes are ensured the
+# first time a collection is requested (or up-front via the `ensure_indexes`
+# management command).  After that the getters below are plain dict lookups
+# with no round-trip to MongoDB.
+_collections = {}
+_collections_lock = threading.Lock()
+
+
+def _ensure_unique_index(collection, existing_indexes, field):
+    """Make sure `<field>_1` is a unique index, dropping duplicates first"""
+    index_name = f'{field}_1'
+    if index_name in existing_indexes:
+        if not existing_indexes[index_name].get('unique', False):
+            print(f"Dropping non-unique {index_name} index...")
+            collection.drop_index(index_name)
+            remove_duplicates(collection, field)
+            collection.create_index([(field, 1)], unique=True, name=index_name)
     else:
-        remove_duplicates(collection, 'message_id')
-        collection.create_index([('message_id', 1)], unique=True, name='message_id_1')
+        remove_duplicates(collection, field)
+        collection.create_index([(field, 1)], unique=True, name=index_name)
 
-    if 'room_id_1_timestamp_-1' not in existing_indexes:
-        collection.create_index([('room_id', 1), ('timestamp', -1)], name='room_id_1_timestamp_-1')
+
+def _ensure_timestamp_indexes(collection, existing_indexes):
     if 'created_at_-1' not in existing_indexes:
         collection.create_index([('created_at', -1)], name='created_at_-1')
     if 'updated_at_-1' not in existing_indexes:
         collection.create_index([('updated_at', -1)], name='updated_at_-1')
-    
-    return collection
 
-def get_room_collection():
-    client = get_mongo_client()
-    db = client['wish_bot_db']
-    collection = db['rooms']
-    
+
+def _ensure_chat_indexes(collection):
     existing_indexes = collection.index_information()
-    
-    if 'room_id_1' in existing_indexes:
-        if not existing_indexes['room_id_1'].get('unique', False):
-            print("Dropping non-unique room_id_1 index...")
-            collection.drop_index('room_id_1')
-            remove_duplicates(collection, 'room_id')
-            collection.create_index([('room_id', 1)], unique=True, name='room_id_1')
-    else:
-        remove_duplicates(collection, 'room_id')
-        collection.create_index([('room_id', 1)], unique=True, name='room_id_1')
+    _ensure_unique_index(collection, existing_indexes, 'message_id')
+    if 'room_id_1_timestamp_-1' not in existing_indexes:
+        collection.create_index([('room_id', 1), ('timestamp', -1)], name='room_id_1_timestamp_-1')
+    # Keyset pagination sorts on (timestamp, _id) within a room
+    if 'room_id_1_timestamp_-1__id_-1' not in existing_indexes:
+        collection.create_index([('room_id', 1), ('timestamp', -1), ('_id', -1)], name='room_id_1_timestamp_-1__id_-1')
+    _ensure_timestamp_indexes(collection, existing_indexes)
 
-    if 'created_at_-1' not in existing_indexes:
-        collection.create_index([('created_at', -1)], name='created_at_-1')
-    if 'updated_at_-1' not in existing_indexes:
-        collection.create_index([('updated_at', -1)], name='updated_at_-1')
-    
-    return collection
 
-def get_widget_collection():
-    """
-    Get MongoDB collection for widgets.
-    """
-    client = get_mongo_client()
-    db = client['wish_bot_db']
-    collection = db['widgets']
-    
+def _ensure_room_indexes(collection):
     existing_indexes = collection.index_information()
-    
-    # Ensure unique index on widget_id
-    if 'widget_id_1' in existing_indexes:
-        if not existing_indexes['widget_id_1'].get('unique', False):
-            print("Dropping non-unique widget_id_1 index...")
-            collection.drop_index('widget_id_1')
-            remove_duplicates(collection, 'widget_id')
-            collection.create_index([('widget_id', 1)], unique=True, name='widget_id_1')
-    else:
-        remove_duplicates(collection, 'widget_id')
-        collection.create_index([('widget_id', 1)], unique=True, name='widget_id_1')
-
-    # Add indexes for created_at and updated_at
-    if 'created_at_-1' not in existing_indexes:
-        collection.create_index([('created_at', -1)], name='created_at_-1')
-    if 'updated_at_-1' not in existing_indexes:
-        collection.create_index([('updated_at', -1)], name='updated_at_-1')
-    
-    return collection
+    _ensure_unique_index(collection, existing_indexes, 'room_id')
+    _ensure_timestamp_indexes(collection, existing_indexes)
 
-def insert_with_timestamps(collection, document):
-    """Insert a document with created_at and updated_at timestamps in UTC"""
-    current_time = datetime.now(timezone.utc)
-    document['created_at'] = current_time
-    document['updated_at'] = current_time
-    return collection.insert_one(document)
+    # Room lists sort (and keyset-paginate) on the denormalized last-message summary
+    if 'widget_id_1_last_timestamp_-1__id_-1' not in existing_indexes:
+        collection.create_index(
+            [('widget_id', 1), ('last_timestamp', -1), ('_id', -1)],
+            name='widget_id_1_last_timestamp_-1__id_-1'
+        )
+    if 'last_timestamp_-1__id_-1' not in existing_indexes:
+        collection.create_index([('last_timestamp', -1), ('_id', -1)], name='last_timestamp_-1__id_-1')
 
-def update_with_timestamp(collection, query, update_data):
-    """Update a document and update the updated_at timestamp in UTC"""
-    if '$set' not in update_data:
-        update_data['$set'] = {}
-    
-    update_data['$set']['updated_at'] = datetime.now(timezone.utc)
-    return collection.update_one(query, update_data)
 
-def update_many_with_timestamp(collection, query, update_data):
-    """Update multiple documents and update the updated_at timestamp in UTC"""
-    if '$set' not in update_data:
-        update_data['$set'] = {}
-    
-    update_data['$set']['updated_at'] = datetime.now(timezone.utc)
-    return collection.update_many(query, update_data)
+def _ensure_widget_indexes(collection):
+    existing_indexes = collection.index_information()
+    _ensure_unique_index(collection, existing_indexes, 'widget_id')
+    _ensure_timestamp_indexes(collection, existing_indexes)
 
-def get_agent_notes_collection():
-    """
-    Get MongoDB collection for agent notes
-    """
-    client = get_mongo_client() 
-    db = client['wish_bot_db'] 
-    collection = db['agent_notes']  
-    
-    return collection
 
-def get_ticket_collection():
-    client = get_mongo_client()
-    db = client['wish_bot_db']
-    collection = db['tickets']
-    
-    # Create indexes you want on ticket_id, created_at, updated_at, status etc.
+def _ensure_ticket_indexes(collection):
     existing_indexes = collection.index_information()
-    
     if 'ticket_id_1' not in existing_indexes:
         collection.create_index([('ticket_id', 1)], unique=True, name='ticket_id_1')
-    if 'created_at_-1' not in existing_indexes:
-        collection.create_index([('created_at', -1)], name='created_at_-1')
-    if 'updated_at_-1' not in existing_indexes:
-        collection.create_index([('updated_at', -1)], name='updated_at_-1')
-    
-    return collection
+    _ensure_timestamp_indexes(collection, existing_indexes)
 
-# def get_contact_collection():
-#     client = get_mongo_client()
-#     db = client['wish_bot_db']
-#     collection = db['contacts']
-
-#     # Index on contact_id or email/phone for uniqueness
-#     existing_indexes = collection.index_information()
-
-#     if 'contact_id_1' not in existing_indexes:
-#         collection.create_index([('contact_id', 1)], unique=True, name='contact_id_1')
-#     if 'email_1' not in existing_indexes:
-#         collection.create_index([('email', 1)], unique=True, name='email_1')
-#     if 'created_at_-1' not in existing_indexes:
-#         collection.create_index([('created_at', -1)], name='created_at_-1')
-    
-#     return collection
-
-# Similarly for shortcuts, tags
-
-def get_shortcut_collection():
-    client = get_mongo_client()
-    db = client['wish_bot_db']
-    collection = db['shortcuts']
 
+def _ensure_shortcut_indexes(collection):
     existing_indexes = collection.index_information()
 
     # Create compound unique index on (title + widget_id)
@@ -242,16 +130,8 @@ def get_shortcut_collection():
     if 'created_at_-1' not in existing_indexes:
         collection.create_index([('created_at', -1)], name='created_at_-1')
 
-    return collection
-
-
-    return collection
-
-def get_tag_collection():
-    client = get_mongo_client()
-    db = client['wish_bot_db']
-    collection = db['tags']
 
+def _ensure_tag_indexes(collection):
     existing_indexes = collection.index_information()
 
     # Remove global unique index on 'name'
@@ -265,42 +145,16 @@ def get_tag_collection():
     if 'tag_id_1' not in existing_indexes:
         collection.create_index([('tag_id', 1)], unique=True, name='tag_id_1')
 
-    return collection
-
-    return collection
-
-def get_user_collection():
-    client = get_mongo_client()
-    db = client['wish_bot_db']
-    collection = db['users']
 
+def _ensure_user_indexes(collection):
     existing_indexes = collection.index_information()
-
     if 'user_id_1' not in existing_indexes:
         collection.create_index([('user_id', 1)], unique=True, name='user_id_1')
     if 'email_1' not in existing_indexes:
         collection.create_index([('email', 1)], unique=True, name='email_1')
 
-    return collection
-
-# def get_agent_collection():
-#     client = get_mongo_client()
-#     db = client['wish_bot_db']
-#     collection = db['agents']
-
-#     existing_indexes = collection.index_information()
-#     if 'agent_id_1' not in existing_indexes:
-#         collection.create_index([('agent_id', 1)], unique=True, name='agent_id_1')
-#     if 'email_1' not in existing_indexes:
-#         collection.create_index([('email', 1)], unique=True, name='email_1')
-
-#     return collection
-
-def get_contact_collection():
-    client = get_mongo_client()
-    db = client['wish_bot_db']
-    collection = db['contacts']
 
+def _ensure_contact_indexes(collection):
     existing_indexes = collection.index_information()
 
     def create_partial_unique_index(field_name):
@@ -342,32 +196,23 @@ def get_contact_collection():
         create_partial_unique_index(field)
 
     # 📅 Timestamps indexes
-    if 'created_at_-1' not in existing_indexes:
-        collection.create_index([('created_at', -1)], name='created_at_-1')
-    if 'updated_at_-1' not in existing_indexes:
-        collection.create_index([('updated_at', -1)], name='updated_at_-1')
+    _ensure_timestamp_indexes(collection, existing_indexes)
 
-    return collection
+    # Keyset pagination of the contact list, optionally per widget
+    if 'created_at_-1__id_-1' not in existing_indexes:
+        collection.create_index([('created_at', -1), ('_id', -1)], name='created_at_-1__id_-1')
+    if 'widget_id_1_created_at_-1__id_-1' not in existing_indexes:
+        collection.create_index(
+            [('widget_id', 1), ('created_at', -1), ('_id', -1)],
+            name='widget_id_1_created_at_-1__id_-1'
+        )
 
 
-
-def get_agent_collection():
-    client = get_mongo_client()
-    db = client['wish_bot_db']
-    collection = db['agents']  # Change this name if your agents collection is different
-
+def _ensure_agent_indexes(collection):
     existing_indexes = collection.index_information()
 
     # Ensure unique index on agent_id (assuming this is your unique field)
-    if 'agent_id_1' in existing_indexes:
-        if not existing_indexes['agent_id_1'].get('unique', False):
-            print("Dropping non-unique agent_id_1 index...")
-            collection.drop_index('agent_id_1')
-            remove_duplicates(collection, 'agent_id')
-            collection.create_index([('agent_id', 1)], unique=True, name='agent_id_1')
-    else:
-        remove_duplicates(collection, 'agent_id')
-        collection.create_index([('agent_id', 1)], unique=True, name='agent_id_1')
+    _ensure_unique_index(collection, existing_indexes, 'agent_id')
 
     # Optional index on name or email
     if 'name_1' not in existing_indexes:
@@ -377,21 +222,10 @@ def get_agent_collection():
         collection.create_index([('email', 1)], name='email_1')
 
     # Timestamps (optional)
-    if 'created_at_-1' not in existing_indexes:
-        collection.create_index([('created_at', -1)], name='created_at_-1')
-    if 'updated_at_-1' not in existing_indexes:
-        collection.create_index([('updated_at', -1)], name='updated_at_-1')
-
-    return collection
-
+    _ensure_timestamp_indexes(collection, existing_indexes)
 
 
-def get_trigger_collection():
-    client = get_mongo_client()
-    db = client['wish_bot_db']
-    collection = db['triggers']
-
-    # Create indexes for commonly used fields
+def _ensure_trigger_indexes(collection):
     indexes = collection.index_information()
 
     if 'trigger_id_1' not in indexes:
@@ -406,14 +240,8 @@ def get_trigger_collection():
     if 'tags_1' not in indexes:
         collection.create_index('tags')
 
-    return collection
-
-def get_knowledge_base_collection():
-    client = get_mongo_client()
-    db = client['wish_bot_db']
-    collection = db['knowledge_base']
 
-    # Create indexes for commonly used fields
+def _ensure_knowledge_base_indexes(collection):
     indexes = collection.index_information()
 
     if 'kb_id_1' not in indexes:
@@ -425,53 +253,228 @@ def get_knowledge_base_collection():
     if 'tags_1' not in indexes:
         collection.create_index('tags')
 
-    return collection
 
+def _ensure_admin_indexes(collection):
+    existing_indexes = collection.index_information()
+
+    # Ensure unique index on email
+    _ensure_unique_index(collection, existing_indexes, 'email')
 
+    # Per-request profile lookups, and admins by widget (multikey)
+    if 'admin_id_1' not in existing_indexes:
+        collection.create_index([('admin_id', 1)], name='admin_id_1')
+    if 'assigned_widgets_1' not in existing_indexes:
+        collection.create_index([('assigned_widgets', 1)], name='assigned_widgets_1')
 
-def get_admin_collection():
+
+def _ensure_blacklist_indexes(collection):
+    existing_indexes = collection.index_information()
+
+    # Ensure unique index on token
+    _ensure_unique_index(collection, existing_indexes, 'token')
+
+
+def _ensure_export_job_indexes(collection):
+    existing_indexes = collection.index_information()
+    _ensure_unique_index(collection, existing_indexes, 'job_id')
+
+    # Workers claim the oldest queued job
+    if 'status_1_created_at_1' not in existing_indexes:
+        collection.create_index([('status', 1), ('created_at', 1)], name='status_1_created_at_1')
+    if 'created_by_1_created_at_-1' not in existing_indexes:
+        collection.create_index([('created_by', 1), ('created_at', -1)], name='created_by_1_created_at_-1')
+
+
+def _ensure_agent_rollup_indexes(collection):
+    existing_indexes = collection.index_information()
+    if 'agent_id_1_widget_id_1_day_1' not in existing_indexes:
+        collection.create_index(
+            [('agent_id', 1), ('widget_id', 1), ('day', 1)],
+            unique=True,
+            name='agent_id_1_widget_id_1_day_1'
+        )
+    if 'agent_id_1_day_1' not in existing_indexes:
+        collection.create_index([('agent_id', 1), ('day', 1)], name='agent_id_1_day_1')
+
+
+# collection name -> index bootstrap function (None = no managed indexes)
+COLLECTION_INDEXES = {
+    'messages': _ensure_chat_indexes,
+    'rooms': _ensure_room_indexes,
+    'widgets': _ensure_widget_indexes,
+    'agent_notes': None,
+    'tickets': _ensure_ticket_indexes,
+    'shortcuts': _ensure_shortcut_indexes,
+    'tags': _ensure_tag_indexes,
+    'users': _ensure_user_indexes,
+    'contacts': _ensure_contact_indexes,
+    'agents': _ensure_agent_indexes,
+    'triggers': _ensure_trigger_indexes,
+    'knowledge_base': _ensure_knowledge_base_indexes,
+    'admins': _ensure_admin_indexes,
+    'blacklisted_tokens': _ensure_blacklist_indexes,
+    'export_jobs': _ensure_export_job_indexes,
+    'agent_daily_stats': _ensure_agent_rollup_indexes,
+}
+
+
+def get_collection(name):
     """
-    Get MongoDB collection for admin users.
+    Return a cached handle for `name`, ensuring its indexes on first use.
+
+    Set MONGO_ENSURE_INDEXES = False in settings when indexes are built at
+    deploy time with `python manage.py ensure_indexes`.
     """
+    collection = _collections.get(name)
+    if collection is not None:
+        return collection
+
+    with _collections_lock:
+        collection = _collections.get(name)
+        if collection is None:
+            collection = get_mongo_client()['wish_bot_db'][name]
+            ensure_fn = COLLECTION_INDEXES.get(name)
+            if ensure_fn and getattr(settings, 'MONGO_ENSURE_INDEXES', True):
+                ensure_fn(collection)
+            _collections[name] = collection
+    return collection
+
+
+def ensure_indexes(names=None):
+    """Create/repair indexes for all registered collections (or `names`)"""
     client = get_mongo_client()
-    db = client['wish_bot_db']
-    collection = db['admins']
+    ensured = []
+    for name in names or COLLECTION_INDEXES:
+        ensure_fn = COLLECTION_INDEXES.get(name)
+        collection = client['wish_bot_db'][name]
+        if ensure_fn:
+            ensure_fn(collection)
+        with _collections_lock:
+            _collections[name] = collection
+        ensured.append(name)
+    return ensured
 
-    existing_indexes = collection.index_information()
 
-    # Ensure unique index on email
-    if 'email_1' in existing_indexes:
-        if not existing_indexes['email_1'].get('unique', False):
-            print("Dropping non-unique email_1 index...")
-            collection.drop_index('email_1')
-            remove_duplicates(collection, 'email')
-            collection.create_index([('email', 1)], unique=True, name='email_1')
-    else:
-        remove_duplicates(collection, 'email')
-        collection.create_index([('email', 1)], unique=True, name='email_1')
+def get_chat_collection():
+    return get_collection('messages')
 
-    return collection
+def get_room_collection():
+    return get_collection('rooms')
 
+def get_widget_collection():
+    """
+    Get MongoDB collection for widgets.
+    """
+    return get_collection('widgets')
 
-def get_blacklist_collection():
+def insert_with_timestamps(collection, document):
+    """Insert a document with created_at and updated_at timestamps in UTC"""
+    current_time = datetime.now(timezone.utc)
+    document['created_at'] = current_time
+    document['updated_at'] = current_time
+    return collection.insert_one(document)
+
+def update_with_timestamp(collection, query, update_data):
+    """Update a document and update the updated_at timestamp in UTC"""
+    if '$set' not in update_data:
+        update_data['$set'] = {}
+    
+    update_data['$set']['updated_at'] = datetime.now(timezone.utc)
+    return collection.update_one(query, update_data)
+
+def update_many_with_timestamp(collection, query, update_data):
+    """Update multiple documents and update the updated_at timestamp in UTC"""
+    if '$set' not in update_data:
+        update_data['$set'] = {}
+    
+    update_data['$set']['updated_at'] = datetime.now(timezone.utc)
+    return collection.update_many(query, update_data)
+
+# Unanswered customer message timestamps kept on a room for response times
+MAX_AWAITING_RESPONSES = 100
+
+def build_room_summary_update(message, sender, timestamp, increment_unread=False, sender_type=None, message_id=None):
     """
-    Get MongoDB collection for blacklisted tokens.
+    Update document that keeps a room's last-message summary current.
+
+    Applied to the room on every message insert so room lists can sort and
+    render from the room document alone.  With `sender_type` it also keeps
+    the per-room agent/customer counters and the queue of customer messages
+    (timestamps and ids) still waiting for an agent reply.
     """
-    client = get_mongo_client()
-    db = client['wish_bot_db']
-    collection = db['blacklisted_tokens']
+    update = {
+        '$set': {
+            'last_message': message,
+            'last_sender': sender,
+            'last_timestamp': timestamp,
+        },
+        '$inc': {'message_count': 1},
+        '$min': {'first_message_at': timestamp},
+    }
+    if increment_unread:
+        update['$inc']['unread_count'] = 1
+    if sender_type == 'customer':
+        update['$inc']['customer_message_count'] = 1
+        update['$min']['first_customer_at'] = timestamp
+        update['$push'] = {
+            'awaiting_customer_ts': {'$each': [timestamp], '$slice': MAX_AWAITING_RESPONSES},
+            'awaiting_customer_ids': {'$each': [message_id], '$slice': MAX_AWAITING_RESPONSES},
+        }
+    elif sender_type == 'agent':
+        update['$inc']['agent_message_count'] = 1
+        update['$set']['awaiting_customer_ts'] = []
+        update['$set']['awaiting_customer_ids'] = []
+    return update
+
+def reset_room_unread(room_id):
+    """Zero the denormalized unread counter on a room"""
+    return get_room_collection().update_one({'room_id': room_id}, {'$set': {'unread_count': 0}})
 
-    existing_indexes = collection.index_information()
+def get_agent_notes_collection():
+    """
+    Get MongoDB collection for agent notes
+    """
+    return get_collection('agent_notes')
 
-    # Ensure unique index on token
-    if 'token_1' in existing_indexes:
-        if not existing_indexes['token_1'].get('unique', False):
-            print("Dropping non-unique token_1 index...")
-            collection.drop_index('token_1')
-            remove_duplicates(collection, 'token')
-            collection.create_index([('token', 1)], unique=True, name='token_1')
-    else:
-        remove_duplicates(collection, 'token')
-        collection.create_index([('token', 1)], unique=True, name='token_1')
+def get_ticket_collection():
+    return get_collection('tickets')
+
+def get_shortcut_collection():
+    return get_collection('shortcuts')
+
+def get_tag_collection():
+    return get_collection('tags')
+
+def get_user_collection():
+    return get_collection('users')
+
+def get_contact_collection():
+    return get_collection('contacts')
+
+def get_agent_collection():
+    return get_collection('agents')  # Change this name if your agents collection is different
+
+def get_trigger_collection():
+    return get_collection('triggers')
 
-    return collection
\ No newline at end of file
+def get_knowledge_base_collection():
+    return get_collection('knowledge_base')
+
+def get_admin_collection():
+    """
+    Get MongoDB collection for admin users.
+    """
+    return get_collection('admins')
+
+def get_export_job_collection():
+    return get_collection('export_jobs')
+
+def get_agent_rollup_collection():
+    return get_collection('agent_daily_stats')
+
+
+def get_blacklist_collection():
+    """
+    Get MongoDB collection for blacklisted tokens.
+    """
+    return get_collection('blacklisted_tokens')